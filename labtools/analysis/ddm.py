@@ -0,0 +1,229 @@
+"""
+Differential dynamic microscopy (DDM).
+
+* :func:`log_lags` log-spaced integer lag times
+* :func:`q_index` precomputed |q| bin index of the rfft2 grid
+* :class:`DDM` computes the image structure function D(q, dt) of a stack
+
+The image structure function is
+
+    D(q, dt) = < |FFT(I(t + dt) - I(t))|^2 >_t
+
+azimuthally averaged over |q|. Frame differences are Fourier transformed in
+batches, and for each lag at most max_origins time origins are used, so the
+cost does not grow as N^2 and memory is bounded by the batch size, regardless
+of the number of frames.
+
+>>> import numpy as np
+>>> np.random.seed(0)
+>>> video = np.cumsum(np.random.randn(64,32,32), axis = 0) #random walk of pixels
+>>> ddm = DDM((32,32), lags = log_lags(64, 10), n_bins = 8, dt = 0.01)
+>>> D = ddm.run(video, batch_size = 16)
+>>> D.shape # (n_lags, n_bins)
+(10, 8)
+>>> bool(np.all(np.diff(D[:,3]) > 0)) #grows with lag time
+True
+
+Data of a given q bin can be fitted with :class:`.dls.fit.DlsFitter` models,
+using the (lag time [ms], |f(q,dt)|^2) layout that DlsFitter.open_dls reads
+from .npy files:
+
+>>> data = ddm.dls_data(3)
+>>> data.shape
+(10, 2)
+"""
+
+import os
+import numpy as np
+
+try:
+    from scipy import fft as _fft
+    def _rfft2(a, workers):
+        return _fft.rfft2(a, workers = workers)
+except ImportError:
+    def _rfft2(a, workers):
+        return np.fft.rfft2(a)
+
+from labtools.analysis.npimage.stack import RawStack
+
+def log_lags(n_frames, n_lags = 50, max_lag = None):
+    """Returns an array of unique, approximately log-spaced integer lags
+    between 1 and max_lag (n_frames - 1 by default).
+
+    >>> log_lags(1000, 10).tolist()
+    [1, 2, 5, 10, 22, 46, 100, 215, 464, 999]
+    """
+    if max_lag is None:
+        max_lag = n_frames - 1
+    max_lag = max(min(max_lag, n_frames - 1), 1)
+    lags = np.unique(np.rint(np.logspace(0, np.log10(max_lag), n_lags)).astype(int))
+    #fill up to n_lags, if rounding removed duplicates at short lags
+    while len(lags) < min(n_lags, max_lag):
+        extra = np.setdiff1d(np.arange(1, max_lag + 1), lags)[0]
+        lags = np.union1d(lags, [extra])
+    return lags
+
+def q_index(shape, n_bins = None, pixel_size = 1.):
+    """Returns (index, q) where index is an integer array of |q| bin numbers
+    of the rfft2 grid of an image of a given shape (n_bins for q beyond the
+    last bin), and q are mean |q| values of the bins in rad/pixel_size.
+
+    >>> index, q = q_index((8,8), 4)
+    >>> index.shape, len(q)
+    ((8, 5), 4)
+    """
+    height, width = shape
+    if n_bins is None:
+        n_bins = min(height, width) // 2
+    qy = 2 * np.pi * np.fft.fftfreq(height, pixel_size)
+    qx = 2 * np.pi * np.fft.rfftfreq(width, pixel_size)
+    qabs = np.sqrt(qy[:,None] ** 2 + qx[None,:] ** 2)
+    qmax = 2 * np.pi * 0.5 / pixel_size
+    index = np.minimum((qabs / qmax * n_bins).astype(int), n_bins)
+    counts = np.bincount(index.ravel(), minlength = n_bins + 1)[:n_bins]
+    sums = np.bincount(index.ravel(), weights = qabs.ravel(), minlength = n_bins + 1)[:n_bins]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        q = sums / counts
+    return index, q
+
+def frame_reader(source):
+    """Returns a function that reads frame of a given index from source,
+    a 3D array or memmap, a :class:`.npimage.stack.RawStack` or a
+    :class:`~labtools.pixelink.io.PixelinkDataStream`.
+    """
+    if isinstance(source, (np.ndarray, RawStack)):
+        return lambda i: source[i]
+    elif hasattr(source, 'get_frame'):
+        return lambda i: source.get_frame(i)[1]
+    raise ValueError('Source must support random access')
+
+class DDM(object):
+    """Image structure function calculator.
+
+    :param tuple shape:
+        (height, width) of frames
+    :param lags:
+        a sequence of integer lags (in frames), see :func:`log_lags`
+    :param int n_bins:
+        number of |q| bins, min(shape) // 2 by default
+    :param float dt:
+        time between frames in seconds
+    :param float pixel_size:
+        pixel size, determines units of :attr:`q`
+    :param int max_origins:
+        maximum number of time origins averaged for each lag
+    :param int workers:
+        number of FFT threads (used only with scipy.fft)
+    """
+    def __init__(self, shape, lags, n_bins = None, dt = 1., pixel_size = 1.,
+                 max_origins = 256, workers = 1):
+        self.shape = tuple(shape)
+        self.lags = np.asarray(lags, dtype = int)
+        self.index, self.q = q_index(self.shape, n_bins, pixel_size)
+        self.n_bins = len(self.q)
+        self._flat_index = self.index.ravel()
+        self._counts = np.bincount(self._flat_index, minlength = self.n_bins + 1)[:self.n_bins]
+        self.dt = dt
+        self.max_origins = max_origins
+        self.workers = workers
+        #: image structure function, (n_lags, n_bins) array
+        self.D = None
+        #: lags (in frames) of the rows of D
+        self.D_lags = None
+        #: azimuthally averaged power spectrum of frames, (n_bins,) array
+        self.power = None
+
+    def _azimuthal_sum(self, power):
+        return np.bincount(self._flat_index, weights = power.ravel(),
+                           minlength = self.n_bins + 1)[:self.n_bins]
+
+    def _power(self, frames):
+        #summed |FFT|^2 of a batch of frames
+        f = _rfft2(frames, self.workers)
+        p = f.real ** 2 + f.imag ** 2
+        return p.sum(axis = 0)
+
+    def origins(self, lag, n_frames):
+        """Returns time origins used for a given lag"""
+        n = n_frames - lag
+        if n <= self.max_origins:
+            return np.arange(n)
+        return np.unique(np.linspace(0, n - 1, self.max_origins).astype(int))
+
+    def run(self, source, batch_size = 32, n_frames = None):
+        """Computes D(q, dt) of source and returns it. See :func:`frame_reader`
+        for supported sources. Frames are read in batches of batch_size pairs.
+        Lags of n_frames or more are skipped, lags of the rows of D are
+        stored in :attr:`D_lags`.
+
+        >>> ddm = DDM((8,8), lags = [1, 2, 4, 8], n_bins = 2)
+        >>> D = ddm.run(np.zeros((5,8,8)))
+        >>> ddm.D_lags.tolist(), ddm.lags.tolist()
+        ([1, 2, 4], [1, 2, 4, 8])
+        """
+        read = frame_reader(source)
+        if n_frames is None:
+            n_frames = len(source)
+        lags = self.lags[self.lags < n_frames]
+        D = np.zeros((len(lags), self.n_bins))
+        power = np.zeros(self.n_bins)
+        n_power = 0
+        buffer = np.empty((batch_size, 2) + self.shape, dtype = 'float32')
+        for i, lag in enumerate(lags):
+            origins = self.origins(lag, n_frames)
+            total = np.zeros(self.index.shape)
+            for start in range(0, len(origins), batch_size):
+                batch = origins[start:start + batch_size]
+                data = buffer[0:len(batch)]
+                for j, t in enumerate(batch):
+                    data[j,0] = read(t)
+                    data[j,1] = read(t + lag)
+                if i == 0:
+                    power += self._azimuthal_sum(self._power(data[:,0]))
+                    n_power += len(batch)
+                total += self._power(data[:,1] - data[:,0])
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                D[i] = self._azimuthal_sum(total) / (self._counts * len(origins))
+        self.D_lags = lags
+        self.D = D
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            self.power = power / (self._counts * max(n_power, 1))
+        return D
+
+    @property
+    def lag_times(self):
+        """Lag times of the rows of D in seconds"""
+        return self.D_lags * self.dt
+
+    def isf(self, noise = None):
+        """Returns intermediate scattering function f(q, dt), assuming
+        D = A (1 - f) + B, with A + B = 2 * power. Noise B defaults to D at
+        the shortest lag, averaged over the highest 10% of q bins.
+        """
+        if noise is None:
+            noise = self.D[0, -max(self.n_bins // 10, 1):].mean()
+        A = 2 * self.power - noise
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return 1. - (self.D - noise) / A
+
+    def dls_data(self, q_bin, noise = None):
+        """Returns (n_lags, 2) array of lag time [ms] and |f(q, dt)|^2 of a given
+        q bin, which is the x, y layout used by :class:`.dls.fit.DlsFitter`"""
+        f = self.isf(noise)[:, q_bin]
+        return np.column_stack((self.lag_times * 1000., f ** 2))
+
+    def save(self, directory, prefix = 'ddm', noise = None):
+        """Saves :meth:`dls_data` of each q bin to directory as
+        <prefix>_q<bin>.npy files, that can be opened by DlsFitter.open_dls.
+        Also saves q values to <prefix>_q.npy. Returns a list of filenames."""
+        filenames = []
+        np.save(os.path.join(directory, prefix + '_q.npy'), self.q)
+        for i in range(self.n_bins):
+            filename = os.path.join(directory, '%s_q%03d.npy' % (prefix, i))
+            np.save(filename, self.dls_data(i, noise))
+            filenames.append(filename)
+        return filenames
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,230 @@
+"""
+Multi-speckle intensity correlation with a camera as a detector.
+
+* :class:`MultiTauCorrelator` computes pixel-wise g2(tau) with a multi-tau
+  scheme, updated frame-by-frame with fixed memory
+* :func:`correlate_frames` correlates frames of any frame source
+* :func:`correlate_camera` correlates frames captured with a
+  :class:`~labtools.pixelink.camera.Camera`
+
+Every pixel of the region of interest is treated as an independent detector.
+Correlations are normalized per pixel and then averaged over all pixels
+(ensemble average), which removes the effect of a static, non-uniform
+illumination. Results are returned as a (header, correlation, count_rate)
+tuple, the same as :func:`.dls.io.open_dls` returns, so correlation data can
+be fitted with :class:`.dls.fit.DlsFitter`.
+
+>>> import numpy as np
+>>> np.random.seed(0)
+>>> frames = np.random.rand(256, 8, 8) + 1. #uncorrelated speckles
+>>> header, correlation, count_rate = correlate_frames(frames, dt = 0.001, levels = 4, channels = 8)
+>>> correlation.shape[1], count_rate.shape
+(2, (256, 3))
+>>> bool(np.all(np.abs(correlation[:,1]) < 0.02)) #g2 - 1 = 0 for uncorrelated data
+True
+"""
+
+import time
+import numpy as np
+
+class MultiTauCorrelator(object):
+    """Pixel-wise multi-tau intensity correlator.
+
+    Level 0 holds lags 1 ... channels - 1 (in units of frames), each higher
+    level l holds lags channels/2 ... channels - 1 in units of 2**l frames,
+    with data binned by two between levels. Each update costs
+    O(pixels x channels) per level, and higher levels are updated at half
+    the rate of the previous one. Memory is fixed.
+
+    :param int pixels:
+        number of pixels (detectors)
+    :param int levels:
+        number of levels
+    :param int channels:
+        number of lags (channels) per level, must be even
+    :param int trace_size:
+        maximum number of points of the count rate :attr:`trace`, must be
+        even. When it is full, neighbouring points are averaged and
+        :attr:`trace_step` is doubled, so memory is fixed also for the trace.
+
+    >>> c = MultiTauCorrelator(1, levels = 2, channels = 4, trace_size = 4)
+    >>> for i in range(10):
+    ...     c.add([i])
+    >>> c.trace.tolist(), c.trace_step
+    ([1.5, 5.5], 4)
+    """
+    def __init__(self, pixels, levels = 12, channels = 16, trace_size = 1024):
+        if channels % 2:
+            raise ValueError('Number of channels must be even')
+        if trace_size % 2:
+            raise ValueError('Trace size must be even')
+        self.pixels, self.levels, self.channels = pixels, levels, channels
+        self._register = np.zeros((levels, channels, pixels), dtype = 'float32')
+        self._received = np.zeros(levels, dtype = int)
+        self._products = np.zeros((levels, channels, pixels))
+        self._counts = np.zeros((levels, channels), dtype = int)
+        self._pending = np.zeros((levels, pixels))
+        self._n_pending = np.zeros(levels, dtype = int)
+        self._sum = np.zeros(pixels)
+        self._trace = np.zeros(trace_size)
+        self._trace_length = 0
+        self._trace_sum = 0.
+        self._trace_count = 0
+        #: number of frames averaged in each point of the trace
+        self.trace_step = 1
+
+    def _add(self, level, data):
+        m = self.channels
+        n = self._received[level]
+        lo = 1 if level == 0 else m // 2
+        hi = min(m - 1, n)
+        if hi >= lo:
+            lags = np.arange(lo, hi + 1)
+            self._products[level, lags] += self._register[level, (n - lags) % m] * data
+            self._counts[level, lags] += 1
+        self._register[level, n % m] = data
+        self._received[level] += 1
+        if level + 1 < self.levels:
+            self._pending[level] += data
+            self._n_pending[level] += 1
+            if self._n_pending[level] == 2:
+                binned = self._pending[level] / 2.
+                self._pending[level] = 0.
+                self._n_pending[level] = 0
+                self._add(level + 1, binned)
+
+    def add(self, frame):
+        """Adds a frame (or a flat array of pixel values)"""
+        data = np.asarray(frame, dtype = 'float32').ravel()
+        self._sum += data
+        self._add_trace(data.mean())
+        self._add(0, data)
+
+    def _add_trace(self, value):
+        self._trace_sum += value
+        self._trace_count += 1
+        if self._trace_count == self.trace_step:
+            self._trace[self._trace_length] = self._trace_sum / self.trace_step
+            self._trace_length += 1
+            self._trace_sum, self._trace_count = 0., 0
+            if self._trace_length == len(self._trace):
+                half = len(self._trace) // 2
+                self._trace[:half] = self._trace.reshape(half, 2).mean(axis = 1)
+                self._trace_length = half
+                self.trace_step *= 2
+
+    @property
+    def frames(self):
+        """Number of added frames"""
+        return int(self._received[0])
+
+    @property
+    def trace(self):
+        """Mean intensity of frames, averaged over :attr:`trace_step` frames"""
+        return self._trace[:self._trace_length].copy()
+
+    @property
+    def lags(self):
+        """Lag times of all channels, in frames"""
+        m = self.channels
+        lags = [np.arange(1, m)]
+        for level in range(1, self.levels):
+            lags.append(np.arange(m // 2, m) * 2 ** level)
+        return np.concatenate(lags)
+
+    def g2(self, ensemble = True):
+        """Returns g2(tau) - 1 of lags with data. If ensemble is True,
+        returns the pixel averaged g2 - 1, else a (n_lags, pixels) array.
+
+        :returns:
+            (lags, g2 - 1) tuple
+        """
+        m = self.channels
+        n = max(self._received[0], 1)
+        mean = self._sum / n
+        valid = mean > 0
+        products = [self._products[0, 1:]]
+        counts = [self._counts[0, 1:]]
+        for level in range(1, self.levels):
+            products.append(self._products[level, m // 2:])
+            counts.append(self._counts[level, m // 2:])
+        products, counts = np.concatenate(products), np.concatenate(counts)
+        mask = counts > 0
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            g2 = products[mask][:,valid] / counts[mask][:,None] / mean[valid] ** 2
+        g2 -= 1.
+        if ensemble:
+            g2 = g2.mean(axis = 1)
+        return self.lags[mask], g2
+
+def correlate_frames(frames, dt, roi = None, levels = 12, channels = 16):
+    """Correlates all frames of frames, an iterable of images (a 3D array,
+    a :class:`~labtools.pixelink.io.PixelinkDataStream`, a
+    :class:`.npimage.stack.RawStack`...).
+
+    :param float dt:
+        time between frames in seconds
+    :param tuple roi:
+        (ymin, xmin, ymax, xmax) region of interest, whole frame by default
+    :returns:
+        (header, correlation, count_rate) tuple, see :func:`.dls.io.open_dls`.
+        Correlation columns are lag time [ms] and g2 - 1, count_rate
+        columns are time [s] and mean intensity (twice), see
+        :attr:`MultiTauCorrelator.trace`. Raises ValueError if there are
+        no frames.
+
+    >>> correlate_frames([], dt = 0.001)
+    Traceback (most recent call last):
+    ...
+    ValueError: No frames to correlate
+    """
+    if hasattr(frames, 'iter_frames'):
+        frames = frames.iter_frames()
+    correlator = None
+    for frame in frames:
+        if isinstance(frame, tuple): #PixelinkDataStream yields (desc, image)
+            frame = frame[-1]
+        if roi is not None:
+            frame = frame[roi[0]:roi[2], roi[1]:roi[3]]
+        if correlator is None:
+            correlator = MultiTauCorrelator(frame.size, levels, channels)
+        correlator.add(frame)
+    return correlation_data(correlator, dt)
+
+def correlate_camera(camera, n_frames, dt = None, roi = None, levels = 12, channels = 16):
+    """Captures n_frames with camera (a :class:`~labtools.pixelink.camera.Camera`)
+    and correlates them. A single frame buffer is used for all frames.
+    If dt is not given, the measured mean time between frames is used.
+    Returns the same as :func:`correlate_frames`.
+    """
+    buffer = camera.empty_frame()
+    correlator = None
+    t0 = time.time()
+    for i in range(n_frames):
+        camera.get_next_frame(buffer)
+        frame = buffer if roi is None else buffer[roi[0]:roi[2], roi[1]:roi[3]]
+        if correlator is None:
+            correlator = MultiTauCorrelator(frame.size, levels, channels)
+        correlator.add(frame)
+    if dt is None:
+        dt = (time.time() - t0) / max(n_frames, 1)
+    return correlation_data(correlator, dt)
+
+def correlation_data(correlator, dt):
+    """Returns (header, correlation, count_rate) tuple of a
+    :class:`MultiTauCorrelator`, in the layout of :func:`.dls.io.open_dls`"""
+    if correlator is None or correlator.frames == 0:
+        raise ValueError('No frames to correlate')
+    lags, g2 = correlator.g2()
+    correlation = np.column_stack((lags * dt * 1000., g2))
+    trace = correlator.trace
+    times = np.arange(len(trace)) * correlator.trace_step * dt
+    count_rate = np.column_stack((times, trace, trace))
+    header = {'Duration' : correlator.frames * dt,
+              'Pixels' : correlator.pixels,
+              'FrameTime' : dt}
+    return header, correlation, count_rate
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
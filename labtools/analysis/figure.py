@@ -14,6 +14,8 @@ from enthought.chaco.tools.image_inspector_tool import ImageInspectorTool, \
 
 from enthought.chaco.api import AbstractController
 
+from labtools.analysis.image.lut import DisplayLUT
+
 
 class DataPrinter(AbstractController):
     point0 = Tuple(Float,Float)
@@ -36,19 +38,15 @@ class DataPrinter(AbstractController):
         return process
                 
  
-def toRGB(image):
+def toRGB(image, lut = None, out = None):
     """
-    return a rgb from grayscale image, because it is dipslayed much faster
+    return a rgb from grayscale image, because it is dipslayed much faster.
+    Conversion is done with lut, a :class:`.image.lut.DisplayLUT`. If lut is 
+    None, image is returned unchanged.
     """
-#    if len(image.shape) == 2:
-#        a = numpy.empty(shape = image.shape + (3,), dtype = 'uint8') 
-#        im = numpy.array(255. * image / image.max(),dtype = 'uint8')
-#        a[:,:,0] = im[:,:]
-#        a[:,:,1] = im[:,:]
-#        a[:,:,2] = im[:,:]
-#        return a
-#    else:
-    return image
+    if lut is None:
+        return image
+    return lut(image, out)
 
 #===============================================================================
 # Attributes to use for the plot view.
@@ -75,9 +73,16 @@ class Figure(HasTraits):
     plot = Instance(Component,transient = True)
     process_selection = Function(transient = True)
     file = File('/home/andrej/Pictures/img_4406.jpg')
+    #: lower display limit (0 if None)
+    low = Instance(float)
+    #: upper display limit (dtype maximum if None)
+    high = Instance(float)
+    #: lookup table (contrast and colormap) used to convert images to RGB
+    lut = Instance(DisplayLUT, transient = True)
     
     traits_view = View(
                     Group(
+                        Group('low', 'high', orientation = "horizontal"),
                         Item('plot', editor=ComponentEditor(size=size,
                                                             bgcolor=bg_color), 
                              show_label=False),
@@ -90,6 +95,22 @@ class Figure(HasTraits):
         self.pd = self._pd_default()
         self.plot = self._plot_default()
 
+    def _lut_default(self):
+        return DisplayLUT(self.low, self.high, 'jet')
+    
+    def _low_changed(self, value):
+        self.lut.low = value
+        self._redraw_image()
+        
+    def _high_changed(self, value):
+        self.lut.high = value
+        self._redraw_image()
+        
+    def _redraw_image(self):
+        data = getattr(self, '_data', None)
+        if data is not None and self.plot is not None:
+            self.update_image(data)
+
     def _process_selection_default(self):
         def process(point0, point1):
             print('selection', point0, point1)
@@ -98,7 +119,7 @@ class Figure(HasTraits):
     def _pd_default(self):
         image = zeros(shape = (300,400))        
         pd = ArrayPlotData()
-        pd.set_data("imagedata", toRGB(image))   
+        pd.set_data("imagedata", toRGB(image, self.lut))   
         return pd
         
     def _plot_default(self):
@@ -114,7 +135,7 @@ class Figure(HasTraits):
         plot.x_axis.orientation = "top"
         #plot.y_axis.orientation = "top"
         #img_plot = plot.img_plot("imagedata",colormap = jet)[0]
-        img_plot = plot.img_plot("imagedata",name = 'image', colormap = jet)[0]
+        img_plot = plot.img_plot("imagedata",name = 'image')[0]
         
     # Tweak some of the plot properties
         #plot.bgcolor = "white"
@@ -139,12 +160,18 @@ class Figure(HasTraits):
         self.update_image(image.data)
     
     def update_image(self,data):
-        image = toRGB(data)
-        shape = image.shape
-        self.pd.set_data("imagedata", image) 
+        self._data = data
+        image = toRGB(data, self.lut)
+        shape = data.shape
+        old = self.pd.get_data("imagedata")
+        self.pd.set_data("imagedata", image)
+        if old is not None and old.shape == image.shape:
+            #same shape, only data has changed, no need to create a new plot
+            self.plot.request_redraw()
+            return
         self.plot.aspect_ratio = float(shape[1]) / shape[0]  
         self.plot.delplot('image')
-        img_plot = self.plot.img_plot("imagedata",name = 'image', colormap = jet)[0]
+        img_plot = self.plot.img_plot("imagedata",name = 'image')[0]
         imgtool = ImageInspectorTool(img_plot)
         img_plot.tools.append(imgtool)
         self.plot.overlays.pop()
@@ -19,7 +19,7 @@ import numpy
 # Enthought library imports
 from enthought.enable.api import Component, ComponentEditor
 from enthought.traits.api import HasTraits, Instance, Tuple, Float, Function,\
-     File, Enum
+     File, Enum, Int
 from enthought.traits.ui.api import Item, Group, View
 
 # Chaco imports
@@ -30,6 +30,8 @@ from enthought.chaco.tools.image_inspector_tool import ImageInspectorTool #, Ima
 
 from enthought.chaco.api import AbstractController
 
+from labtools.analysis.image.lut import DisplayLUT
+
 class DataPrinter(AbstractController):
     """
     """
@@ -53,25 +55,17 @@ class DataPrinter(AbstractController):
         return process
                 
  
-def to_RGB(image):
+def to_RGB(image, lut = None, out = None):
     """
     return a rgb from grayscale image, because it is dipslayed much faster than 
     using a gray color map in Chaco tools....
+    
+    Conversion is done with a lookup table, see :class:`.lut.DisplayLUT`. If
+    lut is not given, a gray table with full dtype range is used.
     """
-    if len(image.shape) == 2:
-        a = numpy.empty(shape = image.shape + (3,), dtype = 'uint8')
-        if image.dtype == 'uint8':
-            im = image
-        elif image.dtyle == 'uint16':
-            im = numpy.array(image / 2**8,dtype = 'uint8')
-        else:         
-            im = numpy.array(255.999 * image ,dtype = 'uint8')
-        a[:,:,0] = im[:,:]
-        a[:,:,1] = im[:,:]
-        a[:,:,2] = im[:,:]
-        return a
-    else:
-        return image
+    if lut is None:
+        lut = DisplayLUT()
+    return lut(image, out)
 
 #===============================================================================
 # Attributes to use for the plot view.
@@ -115,6 +109,14 @@ class Figure(HasTraits):
     
     #: defines which color map to use for grayscale images ('gray' or 'color')
     colormap = Enum('gray','color')
+    #: lower display limit of grayscale images (0 if None)
+    low = Instance(float)
+    #: upper display limit of grayscale images (dtype maximum if None)
+    high = Instance(float)
+    #: displayed images are decimated by this factor
+    decimation = Int(1)
+    #: lookup table used to convert grayscale images to RGB
+    lut = Instance(DisplayLUT, transient = True)
     
     traits_view = View(
                     Group(
@@ -130,6 +132,33 @@ class Figure(HasTraits):
         self.pd = self._pd_default()
         self.plot = self._plot_default()
 
+    def _lut_default(self):
+        return DisplayLUT(self.low, self.high, self._lut_colormap(), step = self.decimation)
+        
+    def _lut_colormap(self):
+        return 'gray' if self.colormap == 'gray' else 'jet'
+    
+    def _low_changed(self, value):
+        self.lut.low = value
+        self._redraw_image()
+        
+    def _high_changed(self, value):
+        self.lut.high = value
+        self._redraw_image()
+        
+    def _colormap_changed(self):
+        self.lut.colormap = self._lut_colormap()
+        self._redraw_image()
+        
+    def _decimation_changed(self, value):
+        self.lut.step = max(value, 1)
+        self._redraw_image()
+        
+    def _redraw_image(self):
+        data = getattr(self, '_data', None)
+        if data is not None and self.plot is not None:
+            self.plot_image(data)
+
     def _process_selection_default(self):
         def process(point0, point1):
             print('selection', point0, point1)
@@ -172,23 +201,29 @@ class Figure(HasTraits):
         :param array data:
             Input image array
         """
+        self._data = data
         self._plot_image(self.plot, data)
                
     def _plot_image(self,plot,data):
-        if self.colormap == 'gray':
-            image = to_RGB(data)
-        else:
-            image = data
+        image = to_RGB(data, self.lut)
         self.pd.set_data("imagedata", image) 
-        plot.aspect_ratio = float(image.shape[1]) / image.shape[0] 
+        plot.aspect_ratio = float(data.shape[1]) / data.shape[0] 
         if not plot.plots:
             img_plot = plot.img_plot("imagedata",name = 'image')[0]
+        self._set_bounds(plot, data.shape)
         
         img_plot = plot.plots['image'][0] 
         img_plot.edit_traits()
         #plot.request_redraw()
         plot.redraw()
         
+    def _set_bounds(self, plot, shape):
+        #decimated images are displayed in full resolution pixel coordinates
+        step = self.lut.step
+        height, width = -(-shape[0] // step), -(-shape[1] // step)
+        plot.plots['image'][0].index.set_data(numpy.arange(width + 1) * step, 
+                                              numpy.arange(height + 1) * step)
+        
     def update_image(self,data):
         import warnings
         warnings.warn('Use plot_image insteead!', DeprecationWarning,2)   
@@ -245,12 +280,9 @@ class FigureInspector(Figure):
                     )   
                     
     def _plot_image(self,plot,data):
-        if self.colormap == 'gray':
-            image = to_RGB(data)
-        else:
-            image = data
+        image = to_RGB(data, self.lut)
         self.pd.set_data("imagedata", image) 
-        plot.aspect_ratio = float(image.shape[1]) / image.shape[0] 
+        plot.aspect_ratio = float(data.shape[1]) / data.shape[0] 
         if not plot.plots:
             img_plot = plot.img_plot("imagedata",name = 'image')[0]
         
@@ -269,12 +301,14 @@ class FigureInspector(Figure):
                                                    color="white",
                                                     is_listener=False))
                                                    
+        self._set_bounds(plot, data.shape)
         img_plot = plot.plots['image'][0]                                          
         shape = image.shape
+        step = self.lut.step
         self.h_plot.index_range = img_plot.index_range.x_range
         self.v_plot.index_range = img_plot.index_range.y_range                 
-        self.pd.set_data('h_index', numpy.arange(shape[1]))
-        self.pd.set_data('v_index', numpy.arange(shape[0]))
+        self.pd.set_data('h_index', numpy.arange(shape[1]) * step)
+        self.pd.set_data('v_index', numpy.arange(shape[0]) * step)
         self.plot.request_redraw() 
         self.container.request_redraw() 
                 
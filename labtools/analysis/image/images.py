@@ -7,14 +7,14 @@ from enthought.traits.ui.api import View, Item, RangeEditor, ListEditor, HGroup,
     HSplit, Group, VSplit, TupleEditor
 
 from enthought.pyface.api import FileDialog, OK
-import warnings , pickle
+import warnings , pickle, os
 
 from scipy.misc.pilutil import imread
 
 from labtools.analysis.image.figure import Figure, FigureInspector
 from labtools.analysis.tools import Filenames
 from labtools.analysis.image.selection import RectangleSelections
-from labtools.analysis.image.filters import BaseFilter, Rotate, GaussianFilter
+from labtools.analysis.image.filters import BaseFilter, Rotate, GaussianFilter, FilterPipeline
 
 class Images(HasTraits):
     """Main class for image point selections
@@ -24,6 +24,8 @@ class Images(HasTraits):
     filters = List(Instance(BaseFilter))
     figure = Instance(Figure, transient = True)
     data = Array
+    #: filter executor with cached intermediate results
+    pipeline = Instance(FilterPipeline, (), transient = True)
     
     def _filters_default(self):
         return [Rotate(), GaussianFilter()]
@@ -43,12 +45,13 @@ class Images(HasTraits):
         figure = Figure(process_selection = selection_callback)          
         return figure
 
-    @on_trait_change('filenames.selected')
+    @on_trait_change('filenames.selected,filters.+')
     def open_image(self):
-        data = imread(self.filenames.selected)
-        for f in self.filters:
-            data =f.process(data)            
-        self.data = data
+        filename = self.filenames.selected
+        if not filename:
+            return
+        source = (filename, os.path.getmtime(filename))
+        self.data = self.pipeline.run(source, lambda : imread(filename), self.filters)
         
     
     @on_trait_change('data,analysis.updated')
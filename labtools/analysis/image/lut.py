@@ -0,0 +1,186 @@
+"""
+Lookup table (LUT) conversion of images to RGB for display.
+
+* :func:`make_lut` builds a (size, 3) uint8 table that maps pixel values to
+  colors, with contrast limits, gamma and a colormap
+* :class:`DisplayLUT` converts images to RGB with a cached table and a reused
+  output buffer, so that a display update of a 16 bit frame is a single
+  :func:`numpy.take` with no float conversion
+
+>>> import numpy as np
+>>> lut = DisplayLUT(low = 0, high = 4095) #12 bit camera data in uint16
+>>> im = np.array([[0, 4095], [2048, 65535]], dtype = 'uint16')
+>>> rgb = lut(im)
+>>> rgb.shape, rgb.dtype
+((2, 2, 3), dtype('uint8'))
+>>> rgb[...,0].tolist()
+[[0, 255], [128, 255]]
+
+Float and signed images are scaled to uint16 table indices with the same
+contrast limits:
+
+>>> DisplayLUT(low = 0.2, high = 0.8)(np.array([[0.2, 0.35, 0.8, 1.]]))[...,0].tolist()
+[[0, 64, 255, 255]]
+>>> DisplayLUT(0, 1000)(np.array([[-10, 500, 1000]], dtype = 'int16'))[...,0].tolist()
+[[0, 128, 255]]
+>>> DisplayLUT(-30000, 30000)(np.array([[-30000, 0, 30000]], dtype = 'int16'))[...,0].tolist()
+[[0, 128, 255]]
+
+Images are decimated before conversion, so that only the pixels that are
+displayed are converted. The output buffer is reused between calls:
+
+>>> lut.step = 2
+>>> out = lut(np.zeros((480, 640), dtype = 'uint16'))
+>>> out.shape, lut(np.ones((480, 640), dtype = 'uint16')) is out
+((240, 320, 3), True)
+"""
+
+import numpy as np
+
+def gray_table(n = 256):
+    """Returns a (n, 3) uint8 gray colormap table"""
+    x = np.linspace(0, 255, n) + 0.5
+    return np.repeat(x.astype('uint8')[:,None], 3, axis = 1)
+
+def jet_table(n = 256):
+    """Returns a (n, 3) uint8 jet colormap table"""
+    x = np.linspace(0., 1., n)
+    r = np.clip(1.5 - np.abs(4 * x - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * x - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * x - 1), 0, 1)
+    return (np.array([r, g, b]).T * 255 + 0.5).astype('uint8')
+
+#: available colormaps, name: table function
+COLORMAPS = {'gray' : gray_table, 'jet' : jet_table}
+
+def make_lut(low = 0, high = 65535, size = 65536, colormap = 'gray', gamma = 1.):
+    """Returns a (size, 3) uint8 table that maps values in [low, high] to
+    colormap colors. Values outside the limits are clipped.
+
+    :param float low:
+        value mapped to the first color
+    :param float high:
+        value mapped to the last color
+    :param int size:
+        number of entries (256 for uint8, 65536 for uint16 images)
+    :param colormap:
+        colormap name (see :data:`COLORMAPS`) or a (n, 3) uint8 table
+    :param float gamma:
+        gamma correction of the normalized values
+
+    >>> make_lut(0, 255, 256)[[0, 128, 255], 0].tolist()
+    [0, 128, 255]
+    >>> make_lut(100, 200, 256, 'jet')[[0, 255]].tolist()
+    [[0, 0, 128], [128, 0, 0]]
+    """
+    if high <= low:
+        high = low + 1
+    table = COLORMAPS[colormap]() if isinstance(colormap, str) else np.asarray(colormap, dtype = 'uint8')
+    x = (np.arange(size) - float(low)) / (high - low)
+    np.clip(x, 0., 1., out = x)
+    if gamma != 1.:
+        x **= gamma
+    return table[(x * (len(table) - 1) + 0.5).astype('intp')]
+
+class DisplayLUT(object):
+    """Converts gray images to RGB images for display. Tables are computed
+    only when parameters change.
+
+    :param float low:
+        lower contrast limit (0 by default)
+    :param float high:
+        upper contrast limit (maximum value of the dtype, or 1. for floats,
+        by default)
+    :param colormap:
+        colormap name or a (n, 3) uint8 table
+    :param float gamma:
+        gamma correction
+    :param int step:
+        decimation; every step-th pixel in each direction is converted
+    """
+    def __init__(self, low = None, high = None, colormap = 'gray', gamma = 1., step = 1):
+        self.low = low
+        self.high = high
+        self.colormap = colormap
+        self.gamma = gamma
+        self.step = step
+        self._key = None
+        self._lut = None
+        self._out = None
+        self._index = None
+        self._scaled = None
+
+    def limits(self, dtype):
+        """Returns (low, high) contrast limits for images of a given dtype"""
+        dtype = np.dtype(dtype)
+        if dtype.kind in 'iu':
+            default = np.iinfo(dtype).max
+        else:
+            default = 1.
+        low = 0 if self.low is None else self.low
+        high = default if self.high is None else self.high
+        return low, high
+
+    def lut(self, dtype, prescaled = False):
+        """Returns the table for images of a given dtype. uint8 images use
+        a 256-entry table, all other images a 65536-entry table. If prescaled
+        is True, contrast limits were already applied (images of other dtypes
+        are scaled to uint16 indices), and the table spans (0, 65535)."""
+        dtype = np.dtype(dtype)
+        size = 256 if dtype.itemsize == 1 and dtype.kind == 'u' else 65536
+        low, high = (0, 65535) if prescaled else self.limits(dtype)
+        colormap = self.colormap if isinstance(self.colormap, str) else id(self.colormap)
+        key = (size, low, high, colormap, self.gamma)
+        if key != self._key:
+            self._lut = make_lut(low, high, size, self.colormap, self.gamma)
+            self._key = key
+        return self._lut
+
+    def _buffer(self, name, shape, dtype):
+        buffer = getattr(self, name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype = dtype)
+            setattr(self, name, buffer)
+        return buffer
+
+    def _indices(self, image):
+        #returns image, or image scaled to uint16 table indices
+        dtype = image.dtype
+        if dtype.kind == 'u' and dtype.itemsize <= 2:
+            return image
+        low, high = self.limits(dtype)
+        index = self._buffer('_index', image.shape, 'uint16')
+        #subtract in float, integer images could wrap around
+        scaled = self._buffer('_scaled', image.shape, 'float32')
+        np.subtract(image, low, out = scaled, dtype = 'float32')
+        scaled *= 65535. / max(high - low, 1e-12)
+        np.clip(scaled, 0, 65535, out = scaled)
+        index[...] = np.rint(scaled, out = scaled)
+        return index
+
+    def __call__(self, image, out = None):
+        """Returns a (height, width, 3) uint8 RGB image of a 2D image. RGB
+        images are returned (decimated) unchanged if they are uint8, else
+        each channel is mapped with the gray level of the table. If out is
+        not given, an internal buffer is reused, so the result is valid until
+        the next call."""
+        image = np.asarray(image)
+        step = self.step
+        if step > 1:
+            image = image[::step, ::step]
+        if image.ndim == 3 and image.dtype == 'uint8':
+            return image
+        index = self._indices(image)
+        lut = self.lut(index.dtype, prescaled = index is not image)
+        if image.ndim == 3:
+            lut = np.ascontiguousarray(lut[:,1])
+            shape = index.shape
+        else:
+            shape = index.shape + (3,)
+        if out is None:
+            out = self._buffer('_out', shape, 'uint8')
+        return lut.take(index, axis = 0, out = out, mode = 'clip')
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,98 @@
+"""
+Tiled filter execution.
+
+* :func:`result_dtype` determines filter output data type from a dtype policy
+* :func:`iter_tiles` splits an image into tiles with halo overlap
+* :func:`filter_tiled` runs a local filter tile-by-tile, in multiple threads
+
+Local filters (gaussian, median...) only need a neighbourhood of each pixel,
+so an image can be processed in tiles, if each tile is extended by a halo
+of at least the filter radius. Temporary arrays are then only tile-sized and
+tiles are processed in parallel (scipy.ndimage releases the GIL).
+
+>>> import numpy as np, scipy.ndimage as nd
+>>> im = np.random.rand(300,200).astype('float32')
+>>> out = np.empty_like(im)
+>>> f = lambda block: nd.gaussian_filter(block, 2.)
+>>> out = filter_tiled(f, im, out, tile = 64, halo = 8, workers = 4)
+>>> np.allclose(out, nd.gaussian_filter(im, 2.), atol = 1e-6)
+True
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def result_dtype(dtype, policy = 'preserve'):
+    """Returns output dtype of a filter for a given input dtype and policy.
+
+    :param dtype:
+        input data type
+    :param str policy:
+        one of 'preserve' (output dtype is input dtype), 'float32' or 'float64'
+
+    >>> result_dtype('uint16', 'preserve'), result_dtype('uint16', 'float32')
+    (dtype('uint16'), dtype('float32'))
+    """
+    if policy == 'preserve':
+        return np.dtype(dtype)
+    elif policy in ('float32', 'float64'):
+        return np.dtype(policy)
+    else:
+        raise ValueError('Unknown dtype policy %s' % policy)
+
+def iter_tiles(shape, tile, halo = 0):
+    """Iterates over tiles of a 2D (or first two axes of) shape. Yields
+    (source, target, inner) tuples of slices; source is the tile extended by
+    halo (clipped at image edges), target is the tile in the output image and
+    inner is the tile position within the source block.
+
+    >>> source, target, inner = list(iter_tiles((4,6), 3, 1))[1]
+    >>> source, target, inner
+    ((slice(0, 4, None), slice(2, 6, None)), (slice(0, 3, None), slice(3, 6, None)), (slice(0, 3, None), slice(1, 4, None)))
+    """
+    height, width = shape[0:2]
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            y1, x1 = min(y + tile, height), min(x + tile, width)
+            sy, sx = max(y - halo, 0), max(x - halo, 0)
+            ey, ex = min(y1 + halo, height), min(x1 + halo, width)
+            source = (slice(sy, ey), slice(sx, ex))
+            target = (slice(y, y1), slice(x, x1))
+            inner = (slice(y - sy, y1 - sy), slice(x - sx, x1 - sx))
+            yield source, target, inner
+
+def filter_tiled(function, image, out, tile = 512, halo = 0, workers = 1):
+    """Applies function to image tile-by-tile and writes result to out.
+
+    :param function:
+        a function that takes an image block and returns the filtered block
+        (of the same shape)
+    :param array image:
+        input image
+    :param array out:
+        output array, of the same shape as image
+    :param int tile:
+        tile size in pixels
+    :param int halo:
+        overlap of tiles, should be at least the radius of the filter
+    :param int workers:
+        number of threads
+    :returns:
+        out array
+    """
+    def run(tiles):
+        source, target, inner = tiles
+        out[target] = function(image[source])[inner]
+    tiles = list(iter_tiles(image.shape, tile, halo))
+    if workers > 1 and len(tiles) > 1:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            #list() to raise exceptions from workers
+            list(executor.map(run, tiles))
+    else:
+        for t in tiles:
+            run(t)
+    return out
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,228 @@
+"""
+Particle detection and sub-pixel localization in images and image stacks.
+
+* :func:`bandpass` removes pixel noise and slowly varying background
+* :func:`find_maxima` finds candidate particle positions (local maxima)
+* :func:`refine_centroid` and :func:`refine_radial_symmetry` refine candidate
+  positions to sub-pixel precision, vectorized over all candidates
+* :func:`locate` does all of the above for a single frame
+* :func:`locate_stack` streams over a stack of frames (PDS stream, raw stack,
+  array or memmap) in chunks, processed in a thread pool
+
+>>> import numpy as np
+>>> y, x = np.indices((64,64))
+>>> im = np.zeros((64,64))
+>>> for py, px in [(20.3, 15.6), (40.7, 45.2)]:
+...     im += 100 * np.exp(-((y - py)**2 + (x - px)**2) / (2 * 1.5**2))
+>>> p = locate(im, diameter = 9, threshold = 10)
+>>> len(p)
+2
+>>> np.allclose(p['y'], [20.3, 40.7], atol = 0.1), np.allclose(p['x'], [15.6, 45.2], atol = 0.1)
+(True, True)
+
+For a stack, results of all frames are returned in one array:
+
+>>> stack = np.array([im] * 5)
+>>> p = locate_stack(stack, diameter = 9, threshold = 10, chunk_size = 2, workers = 2)
+>>> len(p), np.unique(p['frame']).tolist()
+(10, [0, 1, 2, 3, 4])
+"""
+
+import numpy as np
+import scipy.ndimage as nd
+
+from labtools.analysis.npimage.stack import iter_chunks
+from labtools.analysis.npimage.prefetch import PrefetchIterator
+
+#: dtype of localization results
+PARTICLE_DTYPE = np.dtype([('frame', 'uint32'),
+                           ('y', 'float64'),
+                           ('x', 'float64'),
+                           ('mass', 'float64')])
+
+#: available refinement methods
+METHODS = ('centroid', 'radial')
+
+def bandpass(image, noise = 1., size = 5, out = None):
+    """Band-pass filter: gaussian smoothing of width noise minus a boxcar
+    average of a given size (background). Negative values are set to zero.
+
+    :param array image:
+        input image
+    :param float noise:
+        width of the gaussian noise filter in pixels
+    :param int size:
+        size of the background averaging box, about the particle diameter
+    :param array out:
+        optional float output array
+    """
+    image = np.asarray(image, dtype = 'float32' if out is None else out.dtype)
+    out = nd.gaussian_filter(image, noise, output = out)
+    background = nd.uniform_filter(image, size)
+    np.subtract(out, background, out = out)
+    np.clip(out, 0, None, out = out)
+    return out
+
+def find_maxima(image, size = 5, threshold = None, margin = None):
+    """Returns (y, x) integer arrays of local maxima positions of image.
+
+    :param int size:
+        size of the neighbourhood for maximum detection
+    :param float threshold:
+        minimum value of a maximum. Defaults to the image mean.
+    :param int margin:
+        maxima closer to the image edge are excluded, defaults to size // 2
+    """
+    if threshold is None:
+        threshold = image.mean()
+    if margin is None:
+        margin = size // 2
+    mask = (nd.maximum_filter(image, size) == image) & (image > threshold)
+    if margin > 0:
+        mask[:margin] = False
+        mask[-margin:] = False
+        mask[:,:margin] = False
+        mask[:,-margin:] = False
+    return np.nonzero(mask)
+
+def _patches(image, y, x, radius):
+    #(n, 2*radius+1, 2*radius+1) patches around integer positions
+    d = np.arange(-radius, radius + 1)
+    yy = np.clip(y[:,None,None] + d[None,:,None], 0, image.shape[0] - 1)
+    xx = np.clip(x[:,None,None] + d[None,None,:], 0, image.shape[1] - 1)
+    return image[yy, xx].astype('float64')
+
+def refine_centroid(image, y, x, radius, iterations = 2):
+    """Refines positions with intensity-weighted centroids within a circular
+    mask of a given radius. Returns (y, x, mass) float arrays.
+    """
+    d = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(d, d, indexing = 'ij')
+    mask = (dy ** 2 + dx ** 2) <= radius ** 2
+    y, x = np.asarray(y, dtype = 'intp'), np.asarray(x, dtype = 'intp')
+    fy, fx = np.zeros(len(y)), np.zeros(len(x))
+    for i in range(max(iterations, 1)):
+        patches = _patches(image, y, x, radius) * mask
+        mass = patches.sum(axis = (1,2))
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            fy = np.nan_to_num((patches * dy).sum(axis = (1,2)) / mass)
+            fx = np.nan_to_num((patches * dx).sum(axis = (1,2)) / mass)
+        #move the mask if the centroid is more than half a pixel away
+        move = (np.abs(fy) > 0.5) | (np.abs(fx) > 0.5)
+        if not move.any():
+            break
+        y = np.clip(y + np.rint(fy).astype('intp') * move, 0, image.shape[0] - 1)
+        x = np.clip(x + np.rint(fx).astype('intp') * move, 0, image.shape[1] - 1)
+    return y + fy, x + fx, mass
+
+def refine_radial_symmetry(image, y, x, radius):
+    """Refines positions with the radial symmetry method (Parthasarathy,
+    Nature Methods 9, 724 (2012)): the center is the point closest to all
+    lines along local intensity gradients. Returns (y, x, mass) float arrays.
+    """
+    y, x = np.asarray(y, dtype = 'intp'), np.asarray(x, dtype = 'intp')
+    patches = _patches(image, y, x, radius)
+    n = 2 * radius + 1
+    #gradients along 45 degree rotated axes, at half-pixel grid points
+    dIdu = patches[:, :-1, 1:] - patches[:, 1:, :-1]
+    dIdv = patches[:, :-1, :-1] - patches[:, 1:, 1:]
+    dIdu = nd.uniform_filter(dIdu, (1, 3, 3))
+    dIdv = nd.uniform_filter(dIdv, (1, 3, 3))
+    grad2 = dIdu ** 2 + dIdv ** 2
+    #grid coordinates, y axis pointing up
+    c = np.arange(n - 1) - (n - 2) / 2.
+    xm = c[None, None, :]
+    ym = -c[None, :, None]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        m = -(dIdv + dIdu) / (dIdu - dIdv)
+    m[np.isnan(m)] = 0.
+    infinite = np.isinf(m)
+    if infinite.any():
+        finite = m[~infinite]
+        m[infinite] = 10 * np.abs(finite).max() if finite.size else 1e6
+    b = ym - m * xm
+    sgrad2 = grad2.sum(axis = (1,2))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        xc = (grad2 * xm).sum(axis = (1,2)) / sgrad2
+        yc = (grad2 * ym).sum(axis = (1,2)) / sgrad2
+        w = grad2 / np.sqrt((xm - xc[:,None,None]) ** 2 + (ym - yc[:,None,None]) ** 2)
+        wm2p1 = w / (m * m + 1)
+        sw = wm2p1.sum(axis = (1,2))
+        smmw = (m * m * wm2p1).sum(axis = (1,2))
+        smw = (m * wm2p1).sum(axis = (1,2))
+        smbw = (m * b * wm2p1).sum(axis = (1,2))
+        sbw = (b * wm2p1).sum(axis = (1,2))
+        det = smw * smw - smmw * sw
+        xc = (smbw * sw - smw * sbw) / det
+        yc = (smbw * smw - smmw * sbw) / det
+    #failed fits (flat patches) stay at the candidate position
+    xc = np.clip(np.nan_to_num(xc), -radius, radius)
+    yc = np.clip(np.nan_to_num(yc), -radius, radius)
+    return y - yc, x + xc, patches.sum(axis = (1,2))
+
+def locate(image, diameter = 7, threshold = None, noise = 1., method = 'centroid',
+           frame = 0):
+    """Detects and localizes particles in a single image.
+
+    :param array image:
+        input 2D image
+    :param int diameter:
+        approximate particle diameter in pixels (odd number)
+    :param float threshold:
+        minimum value of a maximum in the band-passed image, defaults to its mean
+    :param float noise:
+        noise filter width, see :func:`bandpass`
+    :param str method:
+        refinement method, one of :data:`METHODS`
+    :param int frame:
+        frame number to store in results
+    :returns:
+        a structured array of :data:`PARTICLE_DTYPE`
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown method %s, must be one of %s' % (method, METHODS))
+    radius = diameter // 2
+    filtered = bandpass(image, noise, diameter)
+    y, x = find_maxima(filtered, diameter, threshold, margin = radius)
+    if method == 'centroid':
+        y, x, mass = refine_centroid(filtered, y, x, radius)
+    else:
+        y, x, mass = refine_radial_symmetry(filtered, y, x, radius)
+    out = np.empty(len(y), dtype = PARTICLE_DTYPE)
+    out['frame'] = frame
+    out['y'], out['x'], out['mass'] = y, x, mass
+    return out
+
+def locate_stack(source, diameter = 7, chunk_size = 16, workers = 2, **kw):
+    """Localizes particles in all frames of source and returns a structured
+    array of :data:`PARTICLE_DTYPE`.
+
+    Source can be a :class:`.npimage.stack.RawStack`, a 3D array or memmap,
+    a :class:`~labtools.pixelink.io.PixelinkDataStream` or any iterable of
+    frames. Frames are read in chunks of chunk_size and processed by workers
+    threads. At most 2 * workers chunks are held in memory.
+
+    Other keyword arguments are passed to :func:`locate`.
+    """
+    def chunks():
+        start = 0
+        for chunk in iter_chunks(source, chunk_size):
+            if not isinstance(source, np.ndarray):
+                chunk = chunk.copy() #chunk buffer is reused by iter_chunks
+            yield start, chunk
+            start += len(chunk)
+
+    def process(item):
+        start, chunk = item
+        return [locate(frame, diameter, frame = start + i, **kw) for i, frame in enumerate(chunk)]
+
+    results = []
+    for particles in PrefetchIterator(process, chunks(), depth = 2 * workers, workers = workers):
+        results.extend(particles)
+    if not results:
+        return np.empty(0, dtype = PARTICLE_DTYPE)
+    return np.concatenate(results)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
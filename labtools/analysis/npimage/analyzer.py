@@ -8,6 +8,7 @@
 from enthought.traits.api import *
 from enthought.traits.ui.api import *
 from enthought.pyface.api import error
+from enthought.pyface.timer.api import do_after
 
 from .figure import Figure
 
@@ -18,6 +19,8 @@ import os
 from .tools import BaseProcessor
 
 from .experiment import Experiment
+from .integral import IntegralImage, rectangle_box
+from .tracker import DriftTracker
 
 
 def save_data(base_name, data, folder = '', prepend_text = ''):
@@ -51,6 +54,11 @@ STATISTICS_DTYPE = [('ID','uint16'),
                     ('sum','float32')
                     ]
 
+POSITION_DTYPE = [('ID','uint16'),
+                  ('x','float32'),
+                  ('y','float32')
+                  ]
+
 class ImageProcessor(BaseProcessor):
     """
     >>> e = Experiment() #first configure experiment
@@ -61,9 +69,17 @@ class ImageProcessor(BaseProcessor):
     statistics = List(Array,transient = True)
     results = Array(transient = True)
     fit_results = List(Array,transient = True)
+    #: selection center positions of tracked points
+    positions = List(Array,transient = True)
     
     constant_parameters = List(['a,n,s','s'])
     
+    #: whether to re-center selections by drift (FFT phase correlation) before fitting
+    track = Bool(False)
+    #: tracking time budget per image in seconds
+    track_budget = Float(0.05)
+    _tracker = Instance(DriftTracker, transient = True)
+    
     def _experiment_default(self):
         return Experiment()
 
@@ -72,6 +88,8 @@ class ImageProcessor(BaseProcessor):
         self.ok_to_fit = []
         self.statistics = []
         self.fit_results = []
+        self.positions = []
+        self._tracker = DriftTracker(budget = self.track_budget)
         for j in range(len(self.experiment.points)):
             self.experiment.index = j #change index to update analysis object
             self.fit_results.append(
@@ -83,14 +101,31 @@ class ImageProcessor(BaseProcessor):
                 numpy.zeros(
                     len(self.files), 
                     dtype = STATISTICS_DTYPE))                                           
+            self.positions.append(numpy.zeros(len(self.files), dtype = POSITION_DTYPE))
             self.initial_fit.append(self.experiment.analysis.fitting.results.get_parameters())
             self.ok_to_fit.append(self.experiment.analysis.fitting.is_fitting)
             print(self.initial_fit)
 
 
+    def track_points(self, image, i):
+        """Moves point selections by the drift of their content since the 
+        previous image. All points are tracked in one vectorized call.
+        """
+        points = self.experiment.points
+        boxes = [rectangle_box(point.selection, image.shape) for point in points]
+        shifts = self._tracker.update(image, boxes)
+        for j, (point, (dy, dx)) in enumerate(zip(points, shifts)):
+            x, y = point.selection.center
+            point.selection.center = (x + dx, y + dy)
+            self.positions[j][i] = (i, x + dx, y + dy)
+
     def process(self, image, i):
+        if self.track:
+            self.track_points(image, i)
         for j in range(len(self.experiment.points)):
             self.experiment.index = j
+            #few boxes per image, slicing is cheaper than building an IntegralImage
+            self.experiment.analysis.calc_statistics(image)
             self.statistics[j]['ID'][i] = i
             self.statistics[j]['min'][i]  = self.experiment.analysis.statistics.min
             self.statistics[j]['max'][i]  = self.experiment.analysis.statistics.max
@@ -128,6 +163,14 @@ class ImageProcessor(BaseProcessor):
                       prepend_text = '#Fit results on points\n#' + ','.join(['ID'] + keys)+'\n')  
             save_npy_data('fit_results_point_' + str(j), self.fit_results[j], folder = self.directory)
             
+            if self.track:
+                save_txt_data('positions_point_' + str(j), self.positions[j], 
+                          folder = self.directory, 
+                          prepend_text = '#Tracked positions of points\n#' + ','.join(['ID','x','y'])+'\n')
+                save_npy_data('positions_point_' + str(j), self.positions[j], folder = self.directory)
+        if self.track and self._tracker.overruns:
+            print('Tracking exceeded time budget on %d images' % self._tracker.overruns)
+            
 
 class ControlPanel(HasTraits):
     """ 
@@ -138,6 +181,12 @@ class ControlPanel(HasTraits):
     do_fit = Button()
     image = Instance(ImageProcessor,transient = True)
     experiment = DelegatesTo('image')
+    
+    #: statistics update delay in ms, selection changes within this time are merged
+    statistics_delay = Int(100)
+    
+    _integral = Instance(IntegralImage, transient = True)
+    _statistics_pending = Bool(False, transient = True)
 
     def _image_default(self):
         return ImageProcessor(experiment = Experiment())
@@ -145,12 +194,24 @@ class ControlPanel(HasTraits):
     def _do_fit_fired(self):
         self.experiment.analysis.fit(self.image.array)
 
-    #curently it updates every time a point is selected... slow, fix this
     @on_trait_change('image.array,image.experiment.analysis.selection.updated')
     def update_statistics(self,object,name,old,new):
+        """Schedules statistics calculation. All updates that arrive within 
+        statistics_delay are merged into a single calculation, so dragging 
+        selections stays interactive.
+        """
+        if self.image.is_open and not self.image.is_processing \
+                and not self._statistics_pending:
+            self._statistics_pending = True
+            do_after(self.statistics_delay, self._calc_statistics)
+            
+    def _calc_statistics(self):
+        self._statistics_pending = False
         if self.image.is_open:
-            print('updating')
-            self.experiment.analysis.calc_statistics(self.image.array)
+            image = self.image.array
+            if self._integral is None or not self._integral.is_valid(image):
+                self._integral = IntegralImage(image)
+            self.experiment.analysis.calc_statistics(image, self._integral)
               
     
     view = View(
@@ -166,6 +227,9 @@ class ControlPanel(HasTraits):
                          show_label = False,
                          resizable = True),
                     Item('do_fit', show_label = False),
+                    HGroup(Item('object.image.track', label = 'Track drift'),
+                           Item('object.image.track_budget', label = 'Time budget [s]',
+                                enabled_when = 'object.image.track')),
                     label='Experiment',
                     dock="tab"), 
                 resizable = True)
@@ -6,6 +6,7 @@ from enthought.traits.ui.api import *
 from enthought.pyface.api import FileDialog, OK
 
 from .selection import RectangleSelection
+from .integral import rectangle_box
 from numpy import indices, zeros
 from . import base_fit
 import pickle
@@ -313,16 +314,22 @@ class Analysis(HasTraits):
         ind = self.selection.slice_indices(indices(image.shape))
         self.fitting.fit(im,ind)
     
-    def calc_statistics(self, image):
+    def calc_statistics(self, image, integral = None):
         """
-        Calculates image statistics on a predefined selection
+        Calculates image statistics on a predefined selection. If integral
+        (an :class:`.integral.IntegralImage` of image) is given, mean, std and
+        sum are taken from it instead of being recalculated from the slice.
         """
-        im = self.selection.slice_image(image)
-        self.statistics.mean = im.mean()
-        self.statistics.std = im.std()
-        self.statistics.max = im.max()
-        self.statistics.min = im.min()
-        self.statistics.sum = im.sum()
+        if integral is None:
+            im = self.selection.slice_image(image)
+            self.statistics.mean = im.mean()
+            self.statistics.std = im.std()
+            self.statistics.max = im.max()
+            self.statistics.min = im.min()
+            self.statistics.sum = im.sum()
+        else:
+            box = rectangle_box(self.selection, image.shape)
+            self.statistics.trait_set(**integral.statistics(box))
 
 
 
@@ -13,6 +13,8 @@ from scipy.misc.pilutil import fromimage, toimage
 from numpy import save, load, memmap
 import os
 
+from .stack import RawStack
+
 def open_bw(filename, size=(1024,1280), bits = 10, order = '>', shift_bits = True, data_offset = 0, as_float = False):
     """
     odpre raw file 'filename', velikost slike size = (st. vrstic,st. stolpcev) 
@@ -93,6 +95,14 @@ class Binary(HasTraits):
     def open(self, filename):
         return open_bw(filename, size = self.size, order = self.order, 
                          bits = self.bits, shift_bits = self.shift_bits, as_float = self.as_float)
+    
+    def open_stack(self, filenames):
+        """Returns a lazy integer :class:`.stack.RawStack` of filenames. Raises
+        NotImplementedError if as_float is set."""
+        if self.as_float:
+            raise NotImplementedError('Stacks hold integer data, as_float is not supported')
+        return RawStack(filenames, size = self.size, order = self.order_, 
+                        bits = self.bits, shift_bits = self.shift_bits)
                          
     def save(self, filename, data):
         raise NotImplementedError 
@@ -117,6 +127,14 @@ class BasePixelink(HasTraits):
     def open(self, filename):
         return open_bw(filename, size = self.size, order = '>', 
                          bits = self.bits_, shift_bits = self.shift_bits, as_float = self.as_float)
+
+    def open_stack(self, filenames):
+        """Returns a lazy integer :class:`.stack.RawStack` of filenames. Raises
+        NotImplementedError if as_float is set."""
+        if self.as_float:
+            raise NotImplementedError('Stacks hold integer data, as_float is not supported')
+        return RawStack(filenames, size = self.size, order = '>', 
+                        bits = self.bits_, shift_bits = self.shift_bits)
                          
     def save(self, filename, data):
         raise NotImplementedError    
@@ -173,6 +191,15 @@ class AnyFormat(BaseFormat):
     
     def open(self, filename):
         return self._format.open(filename)
+    
+    def open_stack(self, filenames):
+        """Returns a lazy :class:`.stack.RawStack` of filenames. Only raw 
+        (binary and pixelink) formats with integer data (as_float not set) 
+        can be opened as a stack, else NotImplementedError is raised.
+        """
+        if not hasattr(self._format, 'open_stack'):
+            raise NotImplementedError('Format %s can not be opened as a stack' % self.format)
+        return self._format.open_stack(filenames)
                          
     def save(self, filename, data):  
         self._format.save(filename, data)
@@ -0,0 +1,143 @@
+"""
+Summed-area tables (integral images) for fast rectangle statistics.
+
+* :func:`integral_image` computes a zero-padded summed-area table of an image
+* :class:`IntegralImage` holds integral images of data and data squared so that
+  sum, mean and std of any rectangle are computed in O(1)
+
+Building the tables takes two full-image passes, so they pay off only when
+many rectangles are queried on the same image (interactive selection
+changes); for a few boxes per image, slicing is cheaper. Build it once per
+image and query as many rectangles as you like:
+
+>>> import numpy as np
+>>> im = np.arange(20, dtype = 'uint16').reshape(4,5)
+>>> ii = IntegralImage(im)
+>>> int(ii.sum((1,1,3,4))) #same as im[1:3,1:4].sum()
+57
+>>> stats = ii.statistics((1,1,3,4))
+>>> np.allclose([stats['mean'], stats['std']], [im[1:3,1:4].mean(), im[1:3,1:4].std()])
+True
+
+Boxes are given as (ymin, xmin, ymax, xmax) tuples, in the same way as image
+slices im[ymin:ymax, xmin:xmax]. Use :func:`rectangle_box` to get the box of a
+:class:`.selection.Rectangle`.
+"""
+
+import numpy as np
+
+def integral_image(image, dtype = None):
+    """Returns a summed-area table of image, padded with a row and a column
+    of zeros, so that out[i,j] == image[:i,:j].sum().
+
+    Integer images are summed in int64 (exact), float images in float64.
+    Color images (ndim > 2) are summed over the color channels.
+
+    :param array image:
+        input image
+    :param dtype:
+        accumulator dtype, determined from image dtype if not specified
+
+    >>> integral_image(np.ones((2,3)))
+    array([[0., 0., 0., 0.],
+           [0., 1., 2., 3.],
+           [0., 2., 4., 6.]])
+    """
+    image = np.asarray(image)
+    if dtype is None:
+        dtype = 'int64' if image.dtype.kind in 'iub' else 'float64'
+    if image.ndim > 2:
+        image = image.reshape(image.shape[0:2] + (-1,)).sum(-1, dtype = dtype)
+    out = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype = dtype)
+    np.cumsum(image, axis = 0, dtype = dtype, out = out[1:,1:])
+    np.cumsum(out[1:,1:], axis = 1, out = out[1:,1:])
+    return out
+
+def rectangle_box(rectangle, shape):
+    """Returns (ymin, xmin, ymax, xmax) box of a rectangle, clipped to image
+    shape, the same way as :meth:`.selection.Rectangle.slice_image` does.
+    """
+    xmin, ymin = max(rectangle.top_left[0], 0), max(rectangle.top_left[1], 0)
+    xmax = 1 + min(rectangle.bottom_right[0], shape[1] - 1)
+    ymax = 1 + min(rectangle.bottom_right[1], shape[0] - 1)
+    return ymin, xmin, max(ymax, ymin), max(xmax, xmin)
+
+def _box_sum(table, boxes):
+    ymin, xmin, ymax, xmax = boxes
+    return table[ymax,xmax] - table[ymin,xmax] - table[ymax,xmin] + table[ymin,xmin]
+
+class IntegralImage(object):
+    """Integral images (sum and sum of squares) of a given image.
+
+    :param array image:
+        input image. A reference to it is kept in :attr:`image` for min/max
+        calculation and to check whether the cache is still valid.
+
+    >>> im = np.random.randint(0, 2**16, size = (64,64)).astype('uint16')
+    >>> ii = IntegralImage(im)
+    >>> boxes = [(0,0,10,10), (5,7,40,33), (63,63,64,64)]
+    >>> means = ii.means(boxes)
+    >>> np.allclose(means, [im[a:c,b:d].mean() for a,b,c,d in boxes])
+    True
+    >>> ii.is_valid(im)
+    True
+    """
+    def __init__(self, image):
+        self.image = image
+        image = np.asarray(image)
+        self.channels = int(np.prod(image.shape[2:]))
+        self.table = integral_image(image)
+        if image.dtype.kind in 'iub':
+            squared = np.square(image, dtype = 'int64')
+        else:
+            squared = np.square(image, dtype = 'float64')
+        self.table_squared = integral_image(squared)
+
+    def is_valid(self, image):
+        """Returns True if this object was computed from image"""
+        return image is self.image
+
+    def _boxes(self, boxes):
+        return np.asarray(boxes, dtype = 'intp').reshape(-1,4).T
+
+    def counts(self, boxes):
+        """Returns number of pixels in boxes"""
+        ymin, xmin, ymax, xmax = self._boxes(boxes)
+        return (ymax - ymin) * (xmax - xmin) * self.channels
+
+    def sums(self, boxes):
+        """Returns sums of pixel values in boxes, a sequence of (ymin, xmin, ymax, xmax)"""
+        return _box_sum(self.table, self._boxes(boxes))
+
+    def means(self, boxes):
+        """Returns means of pixel values in boxes"""
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return self.sums(boxes) / self.counts(boxes).astype('float64')
+
+    def stds(self, boxes):
+        """Returns standard deviations of pixel values in boxes"""
+        n = self.counts(boxes).astype('float64')
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = self.sums(boxes) / n
+            var = _box_sum(self.table_squared, self._boxes(boxes)) / n - mean ** 2
+        return np.sqrt(np.clip(var, 0, None))
+
+    def sum(self, box):
+        """Returns sum of pixel values in a single box"""
+        return self.sums(box)[0]
+
+    def statistics(self, box):
+        """Returns a dict of mean, std, sum, min and max values of a single box.
+        Min and max are computed from the image slice.
+        """
+        ymin, xmin, ymax, xmax = box
+        im = self.image[ymin:ymax, xmin:xmax]
+        return dict(mean = self.means(box)[0],
+                    std = self.stds(box)[0],
+                    sum = self.sums(box)[0],
+                    min = im.min(),
+                    max = im.max())
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
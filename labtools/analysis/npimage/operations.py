@@ -0,0 +1,230 @@
+"""
+Out-of-core operations on image stacks.
+
+* :func:`running_background` running median or mean background (subtraction)
+* :func:`bin_stack` spatial and temporal binning
+* :func:`average_stack` temporal averaging in windows of frames
+
+Stacks are never loaded as a whole. Frames are read in chunks from any source
+that :func:`.stack.iter_chunks` accepts (:class:`.stack.RawStack`,
+:class:`~labtools.pixelink.io.PixelinkDataStream`, arrays, memmaps), and
+results are written frame-by-frame to an output array, or to a .npy file
+that is opened as a memmap. Each function returns the output and a dict of
+throughput statistics (frames, time, fps).
+
+>>> import numpy as np
+>>> video = np.random.rand(20,8,6).astype('float32')
+>>> out, stats = running_background(video, None, window = 5, method = 'mean')
+>>> bg = video[0:5].mean(0) #background of frame 2 is the mean of frames 0-4
+>>> np.allclose(out[2], video[2] - bg, atol = 1e-5)
+True
+>>> out, stats = bin_stack(video, None, temporal = 2, spatial = (2,2))
+>>> out.shape
+(10, 4, 3)
+>>> np.allclose(out[0,0,0], video[0:2,0:2,0:2].mean())
+True
+>>> sorted(stats.keys())
+['fps', 'frames', 'time']
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from labtools.log import create_logger
+from .stack import iter_chunks
+
+logger = create_logger(__name__)
+
+#: available background methods
+BACKGROUND_METHODS = ('median', 'mean')
+
+def _open_output(output, shape, dtype):
+    if output is None:
+        return np.empty(shape, dtype = dtype)
+    elif isinstance(output, str):
+        return open_memmap(output, mode = 'w+', dtype = dtype, shape = shape)
+    elif output.shape != shape:
+        raise ValueError('Output shape must be %s' % (shape,))
+    return output
+
+def _length(source, n_frames):
+    if n_frames is not None:
+        return n_frames
+    try:
+        return len(source)
+    except TypeError:
+        raise ValueError('Number of frames of source is unknown, specify n_frames')
+
+def _bands(height, workers):
+    #row slices for parallel processing
+    edges = np.linspace(0, height, max(min(workers, height), 1) + 1).astype(int)
+    return [slice(start, stop) for start, stop in zip(edges[:-1], edges[1:])]
+
+class _Bands(object):
+    #runs function(rows) over row bands of a frame, in a thread pool
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers = workers) if workers > 1 else None
+
+    def run(self, function, height):
+        if self._executor is None:
+            function(slice(0, height))
+        else:
+            list(self._executor.map(function, _bands(height, self.workers)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+def _statistics(name, frames, t0):
+    t = time.time() - t0
+    fps = frames / t if t > 0 else float('inf')
+    logger.info('%s: %d frames in %.2fs (%.1f fps)' % (name, frames, t, fps))
+    return dict(frames = frames, time = t, fps = fps)
+
+def running_background(source, output, window = 31, method = 'median', subtract = True,
+                       chunk_size = 16, workers = 1, dtype = 'float32', n_frames = None):
+    """Computes a running background over a centered window of frames and
+    writes background-subtracted frames (or the background) to output.
+
+    :param source:
+        frame source
+    :param output:
+        output array, .npy filename, or None to allocate an array
+    :param int window:
+        number of frames in the background window (at stack ends, the window
+        is truncated)
+    :param str method:
+        one of :data:`BACKGROUND_METHODS`. Mean is computed with a running
+        sum, so it is much faster than median.
+    :param bool subtract:
+        if True, background is subtracted from frames, else background is stored
+    :param int chunk_size:
+        number of frames read at once
+    :param int workers:
+        number of threads; frames are split into row bands
+    :param dtype:
+        output dtype
+    :param int n_frames:
+        number of frames, needed only if source has no len()
+    """
+    if method not in BACKGROUND_METHODS:
+        raise ValueError('Unknown method %s, must be one of %s' % (method, BACKGROUND_METHODS))
+    n = _length(source, n_frames)
+    half = window // 2
+    size = 2 * half + 2 #one extra frame, so that frames are removed from sum before overwritten
+    state = dict(received = 0, lo = 0, hi = 0)
+    bands = _Bands(workers)
+    t0 = time.time()
+    ring = total = background = out = None
+
+    def emit(c):
+        lo, hi = max(0, c - half), min(state['received'] - 1, c + half) + 1
+        if method == 'mean':
+            while state['hi'] < hi:
+                np.add(total, ring[state['hi'] % size], out = total)
+                state['hi'] += 1
+            while state['lo'] < lo:
+                np.subtract(total, ring[state['lo'] % size], out = total)
+                state['lo'] += 1
+            np.divide(total, hi - lo, out = background)
+        else:
+            slots = [f % size for f in range(lo, hi)]
+            def median(rows):
+                background[rows] = np.median(ring[:, rows][slots], axis = 0)
+            bands.run(median, background.shape[0])
+        if subtract:
+            np.subtract(ring[c % size], background, out = out[c], casting = 'unsafe')
+        else:
+            out[c] = background
+
+    try:
+        c = 0
+        for chunk in iter_chunks(source, chunk_size):
+            for frame in chunk:
+                if ring is None:
+                    ring = np.empty((size,) + frame.shape, dtype = 'float32')
+                    total = np.zeros(frame.shape, dtype = 'float64')
+                    background = np.empty(frame.shape, dtype = 'float64')
+                    out = _open_output(output, (n,) + frame.shape, dtype)
+                ring[state['received'] % size] = frame
+                state['received'] += 1
+                while c + half < state['received']:
+                    emit(c)
+                    c += 1
+        while c < state['received']:
+            emit(c)
+            c += 1
+    finally:
+        bands.close()
+    return out, _statistics('running_background', state['received'], t0)
+
+def bin_stack(source, output, temporal = 1, spatial = (1,1), method = 'mean',
+              chunk_size = 16, workers = 1, dtype = 'float32', n_frames = None):
+    """Bins frames in time (groups of temporal frames) and space (blocks of
+    spatial pixels) and writes the binned stack to output. Frames and pixels
+    that do not fill a whole bin are dropped.
+
+    :param source:
+        frame source
+    :param output:
+        output array, .npy filename, or None to allocate an array
+    :param int temporal:
+        temporal bin size
+    :param tuple spatial:
+        (rows, columns) spatial bin size
+    :param str method:
+        'mean' or 'sum'
+    :param int chunk_size:
+        number of frames read at once
+    :param int workers:
+        number of threads; frames are split into row bands
+    :param dtype:
+        output dtype
+    :param int n_frames:
+        number of frames, needed only if source has no len()
+    """
+    if method not in ('mean', 'sum'):
+        raise ValueError('Unknown method %s, must be mean or sum' % method)
+    n = _length(source, n_frames) // temporal
+    sy, sx = spatial
+    bands = _Bands(workers)
+    t0 = time.time()
+    acc = out = None
+    received = 0
+    try:
+        for chunk in iter_chunks(source, chunk_size):
+            for frame in chunk:
+                if acc is None:
+                    height, width = frame.shape[0] // sy, frame.shape[1] // sx
+                    acc = np.zeros((height, width) + frame.shape[2:], dtype = 'float64')
+                    out = _open_output(output, (n,) + acc.shape, dtype)
+                def add(rows):
+                    block = acc[rows]
+                    data = frame[rows.start * sy:rows.stop * sy, 0:width * sx]
+                    data = data.reshape((block.shape[0], sy, width, sx) + frame.shape[2:])
+                    block += data.sum(axis = (1,3))
+                bands.run(add, height)
+                received += 1
+                if received % temporal == 0:
+                    i = received // temporal - 1
+                    if i >= n:
+                        break
+                    if method == 'mean':
+                        acc /= temporal * sy * sx
+                    out[i] = acc
+                    acc[...] = 0.
+    finally:
+        bands.close()
+    return out, _statistics('bin_stack', received, t0)
+
+def average_stack(source, output, window, **kw):
+    """Averages non-overlapping windows of frames. Same as
+    :func:`bin_stack` with temporal = window."""
+    return bin_stack(source, output, temporal = window, **kw)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
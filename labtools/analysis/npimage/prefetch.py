@@ -0,0 +1,123 @@
+"""
+Background prefetching for image iteration.
+
+* :class:`PrefetchIterator` computes function(item) for a sequence of items
+  in a thread pool, up to depth items ahead of the consumer.
+
+Disk reads and decoding (PIL, numpy) release the GIL, so loading of the next
+images overlaps with processing of the current one:
+
+>>> import time
+>>> def load(i):
+...     time.sleep(0.01)
+...     return i * 2
+>>> it = PrefetchIterator(load, range(10), depth = 4, workers = 2)
+>>> [x for x in it]
+[0, 2, 4, 6, 8, 10, 12, 14, 16, 18]
+
+Counters can be used to choose depth. If stall_time is large compared to the
+processing time, loading is the bottleneck and depth/workers should be
+increased.
+
+>>> stats = it.statistics()
+>>> stats['items']
+10
+>>> sorted(stats.keys())
+['items', 'max_depth', 'mean_depth', 'stall_time', 'stalls']
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import time
+
+class PrefetchIterator(object):
+    """Iterator over function(item) for item in items, with results computed
+    in background threads.
+
+    :param function:
+        a function that takes an item and returns the loaded data
+    :param items:
+        an iterable of items (filenames, frame indices...)
+    :param int depth:
+        maximum number of results computed ahead (queue size)
+    :param int workers:
+        number of worker threads
+    """
+    def __init__(self, function, items, depth = 4, workers = 2):
+        self.function = function
+        self.depth = max(int(depth), 1)
+        self._items = iter(items)
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers = max(int(workers), 1))
+        #: number of items returned
+        self.items = 0
+        #: number of times the consumer had to wait for data
+        self.stalls = 0
+        #: total time (in seconds) the consumer spent waiting for data
+        self.stall_time = 0.
+        #: maximum number of ready results observed
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self.depth:
+            try:
+                item = next(self._items)
+            except StopIteration:
+                break
+            self._pending.append(self._executor.submit(self.function, item))
+
+    @property
+    def queue_depth(self):
+        """Number of results that are ready and waiting to be consumed"""
+        return sum(1 for f in self._pending if f.done())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            self.close()
+            raise StopIteration
+        depth = self.queue_depth
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+        future = self._pending.popleft()
+        if not future.done():
+            self.stalls += 1
+            t0 = time.time()
+            try:
+                result = future.result()
+            finally:
+                self.stall_time += time.time() - t0
+        else:
+            result = future.result()
+        self.items += 1
+        self._fill()
+        return result
+
+    def statistics(self):
+        """Returns a dict of prefetch counters"""
+        return dict(items = self.items,
+                    stalls = self.stalls,
+                    stall_time = self.stall_time,
+                    max_depth = self.max_depth,
+                    mean_depth = self._depth_sum / max(self.items, 1))
+
+    def close(self):
+        """Cancels pending work and stops worker threads"""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait = False)
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,134 @@
+"""
+Region-of-interest extraction from image stacks.
+
+* :class:`ROIExtractor` computes per-ROI reductions (mean, sum, max...) or
+  extracts ROI data of many rectangles over a whole frame source in a single
+  streaming pass.
+
+Frame sources are anything :func:`.stack.iter_chunks` accepts: a
+:class:`.stack.RawStack`, a 3D array or memmap (tiff stack), a
+:class:`~labtools.pixelink.io.PixelinkDataStream` or any iterable of frames.
+Frames are read in chunks, so memory use is bounded by chunk size, and
+rectangle coordinates are read only once, when the extractor is created.
+
+>>> import numpy as np
+>>> video = np.arange(4*6*8, dtype = 'uint16').reshape(4,6,8)
+>>> ex = ROIExtractor([(0,0,2,2), (2,3,4,5), (4,6,6,8)])
+>>> means = ex.reduce(video, 'mean', chunk_size = 3)
+>>> means.shape # (n_frames, n_rois)
+(4, 3)
+>>> np.allclose(means[:,1], video[:,2:4,3:5].mean(axis = (1,2)))
+True
+>>> data = ex.extract(video)
+>>> data.shape # (n_frames, n_rois, height, width)
+(4, 3, 2, 2)
+>>> views = ex.views(video) # no copy for arrays
+>>> np.shares_memory(views[0], video)
+True
+"""
+
+import numpy as np
+
+from .integral import rectangle_box
+from .stack import iter_chunks
+
+#: supported reductions
+REDUCTIONS = ('mean', 'sum', 'max', 'min', 'std')
+
+class ROIExtractor(object):
+    """Extracts data of several rectangular regions from a frame source.
+
+    :param list boxes:
+        a list of (ymin, xmin, ymax, xmax) boxes, see :func:`.integral.rectangle_box`
+    """
+    def __init__(self, boxes):
+        self.boxes = [tuple(int(i) for i in box) for box in boxes]
+
+    @classmethod
+    def from_rectangles(cls, rectangles, shape):
+        """Creates extractor from a list of :class:`.selection.Rectangle`
+        objects (or a :class:`.selection.MultiSelections` selections list)
+        and frame shape (height, width)."""
+        return cls([rectangle_box(r, shape) for r in rectangles])
+
+    @property
+    def slices(self):
+        """A list of (row, column) slices of the ROIs"""
+        return [(slice(ymin, ymax), slice(xmin, xmax)) for ymin, xmin, ymax, xmax in self.boxes]
+
+    @property
+    def shapes(self):
+        """A list of (height, width) of the ROIs"""
+        return [(ymax - ymin, xmax - xmin) for ymin, xmin, ymax, xmax in self.boxes]
+
+    def views(self, video):
+        """Returns a list of (n_frames, height, width) views of a 3D array
+        or memmap, one for each ROI. No data is read."""
+        return [video[(slice(None),) + s] for s in self.slices]
+
+    def reduce(self, source, reduction = 'mean', chunk_size = 64):
+        """Computes a reduction of each ROI for each frame of source.
+
+        :param source:
+            frame source
+        :param str reduction:
+            one of :data:`REDUCTIONS`, or a sequence of these
+        :param int chunk_size:
+            number of frames read at once
+        :returns:
+            (n_frames, n_rois) float array, or a dict of these if reduction
+            is a sequence
+        """
+        names = (reduction,) if isinstance(reduction, str) else tuple(reduction)
+        for name in names:
+            if name not in REDUCTIONS:
+                raise ValueError('Unknown reduction %s, must be one of %s' % (name, REDUCTIONS))
+        results = dict((name, []) for name in names)
+        for chunk in iter_chunks(source, chunk_size):
+            out = dict((name, np.empty((len(chunk), len(self.boxes)))) for name in names)
+            for i, s in enumerate(self.slices):
+                data = chunk[(slice(None),) + s].reshape(len(chunk), -1)
+                for name in names:
+                    if name == 'sum':
+                        out[name][:,i] = data.sum(axis = 1, dtype = 'float64')
+                    elif name == 'mean':
+                        out[name][:,i] = data.mean(axis = 1, dtype = 'float64')
+                    elif name == 'std':
+                        out[name][:,i] = data.std(axis = 1, dtype = 'float64')
+                    else:
+                        out[name][:,i] = getattr(data, name)(axis = 1)
+            for name in names:
+                results[name].append(out[name])
+        results = dict((name, _concatenate(value, len(self.boxes))) for name, value in results.items())
+        if isinstance(reduction, str):
+            return results[reduction]
+        return results
+
+    def extract(self, source, chunk_size = 64, dtype = None):
+        """Copies ROI data of all frames of source into a
+        (n_frames, n_rois, height, width) array. All ROIs must be of the same
+        size. Use :meth:`views` instead, if source is an array.
+        """
+        shapes = set(self.shapes)
+        if len(shapes) != 1:
+            raise ValueError('All ROIs must be of the same size')
+        shape = shapes.pop()
+        out = []
+        for chunk in iter_chunks(source, chunk_size):
+            data = np.empty((len(chunk), len(self.boxes)) + shape + chunk.shape[3:],
+                            dtype = chunk.dtype if dtype is None else dtype)
+            for i, s in enumerate(self.slices):
+                data[:,i] = chunk[(slice(None),) + s]
+            out.append(data)
+        if not out:
+            return np.empty((0, len(self.boxes)) + shape, dtype = dtype or 'float64')
+        return np.concatenate(out)
+
+def _concatenate(arrays, n):
+    if arrays:
+        return np.concatenate(arrays)
+    return np.empty((0, n))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
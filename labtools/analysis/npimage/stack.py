@@ -0,0 +1,216 @@
+"""
+Lazy image stacks.
+
+* :class:`RawStack` presents a list of same-size raw image files as one
+  (n_frames x height x width) integer stack that is read on demand.
+* :func:`iter_chunks` iterates over chunks of frames of any frame source.
+
+>>> import numpy as np, tempfile, os
+>>> tmp = tempfile.mkdtemp()
+>>> for i in range(5):
+...     a = (np.arange(12, dtype = 'uint16').reshape(3,4) + i) << 6 # 10 bit data, MSB aligned
+...     a.astype('>u2').tofile(os.path.join(tmp, 'frame%d.raw' % i))
+>>> stack = RawStack.from_directory(tmp, '*.raw', size = (3,4), bits = 10, order = '>', shift_bits = True)
+>>> stack.shape
+(5, 3, 4)
+>>> int(stack[2][0,0]) # integer data, bits shifted back
+2
+>>> stack[1:4, 1:, ::2].shape # slicing in time and space
+(3, 2, 2)
+
+Frames can be read into a reusable buffer, so that no memory is allocated
+while iterating over the stack:
+
+>>> buffer = stack.empty_frame()
+>>> for frame in stack.iter_frames(buffer):
+...     assert frame is buffer
+>>> chunks = [chunk.shape for chunk in stack.iter_chunks(2)]
+>>> chunks
+[(2, 3, 4), (2, 3, 4), (1, 3, 4)]
+
+Floating point data is computed only when needed, with a given precision:
+
+>>> f = stack.as_float(stack[0])
+>>> f.dtype.name, bool(np.isclose(f.max(), 11./1023))
+('float32', True)
+"""
+
+import glob, os, re
+import numpy as np
+
+_DTYPE = {8 : 'uint8', 16 : 'uint16'}
+
+def _container_bits(bits):
+    if bits > 0 and bits <= 8:
+        return 8
+    elif bits <= 16:
+        return 16
+    else:
+        raise ValueError('bits must be between 1 and 16 ')
+
+def _natural_key(path):
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', path)]
+
+def _as_index_list(key, n):
+    if isinstance(key, slice):
+        return list(range(*key.indices(n)))
+    indices = np.arange(n)[key]
+    return list(np.atleast_1d(indices))
+
+class RawStack(object):
+    """A stack of raw image files of the same size and format.
+
+    Files are not kept open. Each frame is memory-mapped only when it is read,
+    so that spatial slices read only the bytes they need, and data is copied
+    into a native byte order integer array (optionally a reusable buffer).
+
+    :param list filenames:
+        a list of raw image filenames
+    :param tuple size:
+        size of an image (height, width)
+    :param int bits:
+        determines how many bits are actually used (camera bits)
+    :param order:
+        must be either '>' or '<', determines byte order of the files
+    :param bool shift_bits:
+        if True, data is assumed to be MSB aligned and is shifted by
+        (container bits - bits) when read, so that max value is 2**bits - 1
+    :param int data_offset:
+        determines offset to the data in each file
+    """
+    def __init__(self, filenames, size = (1024,1280), bits = 10, order = '>',
+                 shift_bits = False, data_offset = 0):
+        self.filenames = list(filenames)
+        self.size = tuple(size)
+        self.bits = bits
+        container = _container_bits(bits)
+        self.dtype = np.dtype(_DTYPE[container])
+        self.file_dtype = self.dtype.newbyteorder(order)
+        self.shift = container - bits if shift_bits else 0
+        self.data_offset = data_offset
+
+    @classmethod
+    def from_directory(cls, directory, pattern = '*.*', **kw):
+        """Creates stack from files matching pattern in directory. Files are
+        sorted by the numbers in their names."""
+        filenames = sorted(glob.glob(os.path.join(directory, pattern)), key = _natural_key)
+        return cls(filenames, **kw)
+
+    @property
+    def shape(self):
+        """(n_frames, height, width) tuple"""
+        return (len(self.filenames),) + self.size
+
+    @property
+    def scale(self):
+        """Factor that scales integer data to max = 1."""
+        return 1. / (2 ** self.bits - 1)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def empty_frame(self):
+        """Returns an empty frame buffer, for use with :meth:`read`"""
+        return np.empty(self.size, dtype = self.dtype)
+
+    def read(self, index, out = None, region = (slice(None),slice(None))):
+        """Reads frame data of a given index into out (if specified) and
+        returns it. Region can be a tuple of (row, column) slices.
+        """
+        a = np.memmap(self.filenames[index], dtype = self.file_dtype, mode = 'r',
+                      shape = self.size, offset = self.data_offset)
+        a = a[region]
+        if out is None:
+            out = np.empty(a.shape, dtype = self.dtype)
+        out[...] = a
+        del a
+        if self.shift:
+            np.right_shift(out, self.shift, out = out)
+        return out
+
+    def as_float(self, frame, out = None, dtype = 'float32'):
+        """Scales integer frame data to float so that max = 1."""
+        if out is None:
+            out = np.empty(frame.shape, dtype = dtype)
+        np.multiply(frame, self.scale, out = out, casting = 'unsafe')
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        index, region = key[0], key[1:3]
+        if isinstance(index, (int, np.integer)):
+            return self.read(index, region = region)
+        indices = _as_index_list(index, len(self))
+        first = self.empty_frame()[region]
+        out = np.empty((len(indices),) + first.shape, dtype = self.dtype)
+        for i, j in enumerate(indices):
+            self.read(j, out[i], region)
+        return out
+
+    def iter_frames(self, out = None):
+        """Iterates over frames. If out is specified, data is written to it
+        and the same array is yielded every time."""
+        for i in range(len(self)):
+            yield self.read(i, out)
+
+    def iter_chunks(self, size, out = None):
+        """Iterates over chunks of at most size frames. A single chunk buffer
+        is allocated (or out is used) and reused for all chunks."""
+        if out is None:
+            out = np.empty((size,) + self.size, dtype = self.dtype)
+        n = len(self)
+        for start in range(0, n, size):
+            stop = min(start + size, n)
+            chunk = out[0:stop - start]
+            for i in range(start, stop):
+                self.read(i, chunk[i - start])
+            yield chunk
+
+def _frame_data(frame):
+    #PixelinkDataStream yields (desc, image) tuples
+    if isinstance(frame, tuple):
+        return frame[-1]
+    return frame
+
+def iter_chunks(source, size, out = None):
+    """Iterates over (n <= size, height, width...) chunks of frames of source.
+
+    Source can be a :class:`RawStack`, a 3D array or memmap (chunks are then
+    views, no data is copied), or any iterable of frames, such as a
+    :class:`~labtools.pixelink.io.PixelinkDataStream` or a list of images.
+    For iterables, frames are copied into a single chunk buffer (or out),
+    that is reused for all chunks. A PixelinkDataStream with frames of 
+    constant size is read through its :attr:`frames` view instead.
+
+    >>> [c.shape for c in iter_chunks(np.zeros((5,2,2)), 2)]
+    [(2, 2, 2), (2, 2, 2), (1, 2, 2)]
+    >>> [int(c.sum()) for c in iter_chunks((np.ones((2,2)) * i for i in range(3)), 2)]
+    [4, 8]
+    """
+    if getattr(source, 'is_constant', False):
+        source = source.frames
+    if isinstance(source, RawStack):
+        for chunk in source.iter_chunks(size, out):
+            yield chunk
+    elif isinstance(source, np.ndarray):
+        for start in range(0, len(source), size):
+            yield source[start:start + size]
+    else:
+        i = 0
+        for frame in source:
+            frame = _frame_data(frame)
+            if out is None:
+                out = np.empty((size,) + frame.shape, dtype = frame.dtype)
+            out[i] = frame
+            i += 1
+            if i == size:
+                yield out[0:i]
+                i = 0
+        if i > 0:
+            yield out[0:i]
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
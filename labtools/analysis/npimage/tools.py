@@ -10,11 +10,20 @@ from enthought.pyface.api import FileDialog, OK, ProgressDialog
 
 
 from .format import AnyFormat, ExtFormat, BaseFormat
+from .prefetch import PrefetchIterator
+import numpy
 import os
 import glob
 import re
 import sys
 
+try:
+    import tifffile
+except ImportError:
+    tifffile = None #needed only for 'tiff stack' output
+
+OUTPUT_TYPES = ('files', 'npy stack', 'tiff stack')
+
 
 #class StoppableThread (threading.Thread):
 #    """Thread class with a stop() method. 
@@ -152,10 +161,14 @@ class Image(HasTraits):
     #errors are written here
     error = Str('', transient = True)
     
+    #set when array is set by the iterator (prefetched or read from a stack), no reload needed
+    _prefetching = Bool(False, transient = True)
+    
     view = image_view
     
     def _filename_changed(self,new):
-        self._reload_fired()
+        if not self._prefetching:
+            self._reload_fired()
 
 
     def _format_default(self):
@@ -309,6 +322,13 @@ images_view = View(
 class Images(Image):
     """
     Image collection, defines next method which opens and returns next image in filenames list
+    
+    When iterating over raw images (binary and pixelink formats), files are 
+    read as a :class:`.stack.RawStack`, into a few integer frame buffers that 
+    are reused for all frames, so no float arrays are allocated per frame. 
+    A returned array is overwritten two frames later (more with prefetching), 
+    so copy it if it is needed longer. Set :attr:`use_stack` to False to open 
+    each file with the format instead.
     """
     files = Instance(Filenames,())
     
@@ -316,10 +336,90 @@ class Images(Image):
     filename = DelegatesTo('files')
     directory = DelegatesTo('files')
     
+    #: number of images opened ahead in background threads when iterating, 0 to disable
+    prefetch = Int(0, desc = 'number of images opened ahead when iterating')
+    #: number of threads used for prefetching
+    prefetch_workers = Int(2, desc = 'number of prefetching threads')
+    #: prefetch counters of the last iteration, see :meth:`.PrefetchIterator.statistics`
+    prefetch_statistics = Dict(transient = True)
+    #: when iterating, read raw formats (see :meth:`.format.AnyFormat.open_stack`)
+    #: as integer frames into reused buffers, instead of opening each file
+    use_stack = Bool(True, desc = 'read raw images into reused buffers when iterating')
+    
+    _prefetcher = Any(transient = True)
+    _stack = Any(transient = True)
+    _buffers = List(transient = True)
+    
     view = images_view 
+    
+    def _open_stack(self):
+        #returns a RawStack of filenames, or None if format has no stack support
+        if not self.use_stack or not hasattr(self.format, 'open_stack'):
+            return None
+        try:
+            return self.format.open_stack(list(self.filenames))
+        except NotImplementedError:
+            return None
+    
+    def _read_stack(self, index):
+        #buffers are used in turn, so the last two returned frames (current 
+        #and previous) and the prefetched frames are never overwritten
+        buffer = self._buffers[index % len(self._buffers)]
+        return self._stack.filenames[index], self._stack.read(index, buffer)
+    
+    def _open_prefetched(self, filename):
+        array = self.format.open(filename)
+        if isinstance(array, numpy.memmap):
+            #force the read in the worker thread
+            array = numpy.array(array)
+        return filename, array
+        
+    def _set_loaded(self, filename, array):
+        #sets array loaded by the iterator, without reloading filename
+        self._prefetching = True
+        try:
+            self.filename = filename
+        finally:
+            self._prefetching = False
+        self.array = array
+        self._name = os.path.split(filename)[-1]
+        self.opened = True
+        self.error = ''
+        return self.array
                 
+    def _next_prefetched(self):
+        try:
+            filename, array = next(self._prefetcher)
+        except StopIteration:
+            self.prefetch_statistics = self._prefetcher.statistics()
+            self._prefetcher = None
+            self._stack = None
+            raise
+        except Exception as e:
+            #same as in _reload_fired, report error and keep the old array
+            self.error = error_to_str(e)
+            return self.array
+        return self._set_loaded(filename, array)
+        
+    def _next_stack(self):
+        if self.next_index >= len(self._stack):
+            self.next_index = 0
+            self._stack = None
+            raise StopIteration
+        index = self.next_index
+        self.next_index += 1
+        try:
+            filename, array = self._read_stack(index)
+        except Exception as e:
+            self.error = error_to_str(e)
+            return self.array
+        return self._set_loaded(filename, array)
                 
     def __next__(self):
+        if self._prefetcher is not None:
+            return self._next_prefetched()
+        if self._stack is not None:
+            return self._next_stack()
         try:
             self.filename = self.filenames[self.next_index]
             self.next_index += 1
@@ -329,11 +429,30 @@ class Images(Image):
             
         return self.array
         
+    def stop_prefetching(self):
+        """Stops background loading of an unfinished iteration"""
+        self._stack = None
+        if self._prefetcher is not None:
+            self.prefetch_statistics = self._prefetcher.statistics()
+            self._prefetcher.close()
+            self._prefetcher = None
+        
     def __len__(self):
         return len(self.filenames)
         
     def __iter__(self):
         self.next_index = 0
+        self.stop_prefetching()
+        self._stack = self._open_stack()
+        if self._stack is not None:
+            self._buffers = [self._stack.empty_frame() for i in range(max(self.prefetch, 0) + 2)]
+        if self.prefetch > 0:
+            if self._stack is not None:
+                load, items = self._read_stack, range(len(self._stack))
+            else:
+                load, items = self._open_prefetched, list(self.filenames)
+            self._prefetcher = PrefetchIterator(load, items,
+                                                depth = self.prefetch, workers = self.prefetch_workers)
         return self
         
 processor_view = View(
@@ -358,6 +477,7 @@ processor_view = View(
 #                            Item('save', show_label = False),
                             statistics_group,
                             ),
+                        'prefetch',
                         'do_process',
                         enabled_when = 'is_processing == False',
                         ),
@@ -377,6 +497,7 @@ class BaseProcessor(Images):
                 
     def _do_process_fired(self):
         def stop_process():
+            self.stop_prefetching()
             progress.update(max_t)
             self.is_processing = False
             progress.close()  
@@ -408,6 +529,7 @@ class BaseProcessor(Images):
                 self.process(image, i)
             self.post_process() 
         finally:
+            self.stop_prefetching()
             self.is_processing = False
                 
     def process(self, image, index):
@@ -447,8 +569,11 @@ converter_view = View(
                             ),
                         Group(
                             'directory',
-                            'extension',
+                            'output',
+                            Item('extension', enabled_when = 'output == "files"'),
+                            Item('stack_name', enabled_when = 'output != "files"'),
                             'overwrite',
+                            'workers',
                             show_border = True, 
                             label = 'Output'
                             ),
@@ -461,7 +586,27 @@ converter_view = View(
                     ) 
 
 class Converter(BaseProcessor):
-    """
+    """Converts images to a different format. Images are read, scaled and saved
+    in a pool of :attr:`workers` threads. Images that fail to convert are
+    reported in :attr:`failed` and do not stop the conversion.
+    
+    Instead of writing each image to its own file, all images can be written
+    to a single .npy stack or a multi-page TIFF (needs tifffile) by setting
+    :attr:`output`.
+    
+    >>> import tempfile
+    >>> source, target = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> filenames = [os.path.join(source, 'image%d.npy' % i) for i in range(3)]
+    >>> for i, filename in enumerate(filenames):
+    ...     numpy.save(filename, numpy.full((4,5), i, dtype = 'uint16'))
+    >>> c = Converter(format = AnyFormat(format = 'numpy'), directory = target, 
+    ...               workers = 2, output = 'npy stack')
+    >>> c.files.filenames = filenames
+    >>> c.convert()
+    []
+    >>> stack = numpy.load(os.path.join(target, 'stack.npy'))
+    >>> stack.shape, stack[:,0,0].tolist()
+    ((3, 4, 5), [0, 1, 2])
     """
     do_process = Button('convert')
     
@@ -472,16 +617,138 @@ class Converter(BaseProcessor):
     directory = Directory(os.path.abspath(os.path.curdir), desc = 'output folder name')
 
     overwrite = Bool(False)
+    
+    #: number of threads used for reading, scaling and saving
+    workers = Int(1, desc = 'number of conversion threads')
+    #: whether to write images to separate files or to a single stack file
+    output = Enum(*OUTPUT_TYPES, desc = 'output type')
+    #: output stack filename (without extension), used for stack outputs
+    stack_name = Str('stack', desc = 'output stack name')
+    #: a list of (filename, error) tuples of images that could not be converted
+    failed = List(Tuple(Str,Str), transient = True)
+    
     view = converter_view    
+    
+    def _output_path(self, filename):
+        name = os.path.basename(filename)
+        name, ext = os.path.splitext(name)
+        return os.path.join(self.directory, name + self.extension)
+        
+    def _stack_path(self):
+        ext = '.npy' if self.output == 'npy stack' else '.tiff'
+        return os.path.join(self.directory, self.stack_name + ext)
                 
     def process(self, image, index):
-        name = os.path.basename(self.filename)
-        name, ext = os.path.splitext(name)
-        path = os.path.join(self.directory, name + self.extension)
+        path = self._output_path(self.filename)
         if not os.path.exists(path) or self.overwrite:
             ExtFormat.save(path, image)
         else:
             raise IOError('File exists')         
+            
+    def _convert_file(self, filename):
+        try:
+            path = self._output_path(filename)
+            if os.path.exists(path) and not self.overwrite:
+                raise IOError('File exists')
+            ExtFormat.save(path, self.format.open(filename))
+            return filename, None
+        except Exception as e:
+            return filename, error_to_str(e)
+            
+    def _read_file(self, filename):
+        try:
+            return filename, numpy.asarray(self.format.open(filename)), None
+        except Exception as e:
+            return filename, None, error_to_str(e)
+            
+    def _store_file(self, item):
+        index, filename, stack = item
+        filename, image, error = self._read_file(filename)
+        if error is None:
+            try:
+                stack[index] = image
+            except Exception as e:
+                error = error_to_str(e)
+        return filename, error
+        
+    def _iter_files(self):
+        filenames = list(self.filenames)
+        workers = max(self.workers, 1)
+        if self.output == 'files':
+            for result in PrefetchIterator(self._convert_file, filenames, 2 * workers, workers):
+                yield result
+            return
+        if self.output == 'tiff stack' and tifffile is None:
+            raise ImportError('tifffile not installed. Please install it if you want to convert to multi-page tiff files')
+        path = self._stack_path()
+        if os.path.exists(path) and not self.overwrite:
+            raise IOError('File %s exists' % path)
+        if self.output == 'npy stack':
+            #shape and dtype of the stack are determined from the first readable image
+            for first, filename in enumerate(filenames):
+                filename, image, error = self._read_file(filename)
+                yield filename, error
+                if error is None:
+                    break
+            else:
+                return
+            stack = numpy.lib.format.open_memmap(path, mode = 'w+', dtype = image.dtype, 
+                                                 shape = (len(filenames),) + image.shape)
+            stack[first] = image
+            items = [(i, filename, stack) for i, filename in enumerate(filenames) if i > first]
+            for result in PrefetchIterator(self._store_file, items, 2 * workers, workers):
+                yield result
+            stack.flush()
+        else:
+            #pages must be written in order, reading is done ahead in the pool
+            with tifffile.TiffWriter(path) as tif:
+                for filename, image, error in PrefetchIterator(self._read_file, filenames, 2 * workers, workers):
+                    if error is None:
+                        tif.write(image, contiguous = True)
+                    yield filename, error
+                    
+    def convert(self, callback = None):
+        """Converts all images. If callback is given, it is called after each 
+        image with the number of images converted so far. If it returns False,
+        conversion is stopped. Returns a list of (filename, error) tuples of 
+        images that failed to convert.
+        """
+        self.failed = []
+        for i, (filename, error) in enumerate(self._iter_files()):
+            if error is not None:
+                self.failed.append((filename, error))
+            if callback is not None and callback(i + 1) == False:
+                break
+        if self.failed:
+            self.error = '%d images failed to convert. %s: %s' % ((len(self.failed),) + self.failed[0])
+        else:
+            self.error = ''
+        return self.failed
+        
+    def process_all(self):
+        self.is_processing = True
+        try:
+            self.convert()
+        finally:
+            self.is_processing = False
+            
+    def _do_process_fired(self):
+        def callback(i):
+            cont, skip = progress.update(i)
+            return cont and not skip
+        self.is_processing = True
+        max_t = len(self.filenames)
+        progress = ProgressDialog(title="progress", message="Converting... ", max=max_t, show_time=True, can_cancel=True)
+        progress.open()
+        try:
+            self.convert(callback)
+        except Exception as e:
+            self.error = error_to_str(e)
+            raise e
+        finally:
+            progress.update(max_t)
+            self.is_processing = False
+            progress.close()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+"""
+ROI drift tracking with FFT phase correlation.
+
+* :func:`phase_correlate` estimates shifts between stacks of image patches
+* :class:`DriftTracker` estimates per-ROI shifts between consecutive frames
+
+ROIs of the same size are processed together, as one (n_rois, height, width)
+FFT, and windows are cached per ROI size. Shifts are estimated to subpixel
+precision with a parabolic fit around the correlation peak.
+
+>>> import numpy as np, scipy.ndimage as nd
+>>> np.random.seed(0)
+>>> im0 = nd.gaussian_filter(np.random.rand(128,128), 2.)
+>>> im1 = nd.shift(im0, (1.5, -2.), mode = 'wrap') #moved by dy = 1.5, dx = -2
+>>> t = DriftTracker()
+>>> t.update(im0, [(30,30,62,62), (60,50,92,82)]) #first frame, no shift
+array([[0., 0.],
+       [0., 0.]])
+>>> shifts = t.update(im1, [(30,30,62,62), (60,50,92,82)])
+>>> np.allclose(shifts, [[1.5,-2.],[1.5,-2.]], atol = 0.25)
+True
+>>> t.time < t.budget
+True
+"""
+
+import time
+import numpy as np
+
+from labtools.log import create_logger
+
+logger = create_logger(__name__)
+
+#: minimum ROI size (in each dimension) for tracking
+MIN_SIZE = 4
+
+def _parabolic(cm, c0, cp):
+    #vertex position of a parabola through (-1,cm), (0,c0), (1,cp)
+    denom = cm - 2 * c0 + cp
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        d = np.where(denom != 0, 0.5 * (cm - cp) / denom, 0.)
+    return np.clip(np.nan_to_num(d), -0.5, 0.5)
+
+def phase_correlate(reference, data):
+    """Returns (n, 2) array of (dy, dx) shifts of data with respect to
+    reference, both given as (n, height, width) arrays (or their rfft2).
+
+    >>> a = np.zeros((1,16,16)); a[0,4,5] = 1.
+    >>> b = np.roll(a, (2,-3), axis = (1,2))
+    >>> phase_correlate(a, b)
+    array([[ 2., -3.]])
+    """
+    reference, data = np.asarray(reference), np.asarray(data)
+    n, h, w = data.shape
+    f0 = np.fft.rfft2(reference)
+    f1 = np.fft.rfft2(data)
+    cross = f1 * f0.conj()
+    cross /= np.abs(cross) + 1e-12
+    corr = np.fft.irfft2(cross, s = (h, w))
+    peak = corr.reshape(n, -1).argmax(axis = 1)
+    py, px = np.unravel_index(peak, (h, w))
+    rows = np.arange(n)
+    dy = _parabolic(corr[rows, (py - 1) % h, px], corr[rows, py, px], corr[rows, (py + 1) % h, px])
+    dx = _parabolic(corr[rows, py, (px - 1) % w], corr[rows, py, px], corr[rows, py, (px + 1) % w])
+    #wrap to [-size/2, size/2)
+    py = (py + h // 2) % h - h // 2
+    px = (px + w // 2) % w - w // 2
+    return np.column_stack((py + dy, px + dx))
+
+class DriftTracker(object):
+    """Estimates shifts of ROI content between consecutive frames.
+
+    :param bool window:
+        if True, patches are multiplied by a Hann window to suppress edge
+        effects of the FFT
+    :param float budget:
+        per-frame time budget in seconds. Frames that take longer are counted
+        in :attr:`overruns` and logged.
+    """
+    def __init__(self, window = True, budget = 0.05):
+        self.window = window
+        self.budget = budget
+        self._windows = {}
+        self._previous = None
+        #: time spent on the last frame, in seconds
+        self.time = 0.
+        #: number of frames that exceeded the time budget
+        self.overruns = 0
+
+    def reset(self):
+        """Forgets the previous frame"""
+        self._previous = None
+
+    def get_window(self, shape):
+        """Returns (cached) window for a given patch shape"""
+        try:
+            return self._windows[shape]
+        except KeyError:
+            window = np.outer(np.hanning(shape[0]), np.hanning(shape[1]))
+            self._windows[shape] = window
+            return window
+
+    def _patches(self, image, boxes):
+        patches = np.array([image[ymin:ymax, xmin:xmax] for ymin, xmin, ymax, xmax in boxes],
+                           dtype = 'float64')
+        if patches.ndim > 3: #color images
+            patches = patches.reshape(patches.shape[0:3] + (-1,)).mean(-1)
+        patches -= patches.mean(axis = (1,2), keepdims = True)
+        if self.window:
+            patches *= self.get_window(patches.shape[1:3])
+        return patches
+
+    def update(self, image, boxes):
+        """Returns (n_rois, 2) array of (dy, dx) shifts of ROI content
+        between the previous image and this image. Boxes are (ymin, xmin,
+        ymax, xmax) tuples at current ROI positions. The first call returns
+        zero shifts. A reference to image is kept until the next call, so it
+        must not be changed in place in the meantime.
+        """
+        t0 = time.time()
+        shifts = np.zeros((len(boxes), 2))
+        if self._previous is not None:
+            groups = {}
+            for i, (ymin, xmin, ymax, xmax) in enumerate(boxes):
+                shape = (ymax - ymin, xmax - xmin)
+                if min(shape) >= MIN_SIZE:
+                    groups.setdefault(shape, []).append(i)
+            for shape, indices in groups.items():
+                group = [boxes[i] for i in indices]
+                shifts[indices] = phase_correlate(self._patches(self._previous, group),
+                                                  self._patches(image, group))
+        self._previous = image
+        self.time = time.time() - t0
+        if self.time > self.budget:
+            self.overruns += 1
+            logger.warning('Tracking took %.3fs, budget is %.3fs' % (self.time, self.budget))
+        return shifts
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
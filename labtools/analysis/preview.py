@@ -0,0 +1,244 @@
+"""
+Multi-resolution previews of long recordings.
+
+* :func:`build_preview` computes a spatially and temporally downsampled
+  pyramid of a frame source in one streaming pass and saves it to a directory
+* :func:`load_preview` loads the preview of a recording, stored next to it,
+  or builds it if it does not exist or is out of date
+* :class:`Preview` gives access to preview levels (memory-mapped), and to
+  full resolution frames only when a preview is too coarse for display
+
+Level 0 frames are binned by spatial x spatial pixels and averaged over
+temporal frames. Each next level is binned by two more in space and in time.
+
+>>> import numpy as np, tempfile, os
+>>> video = np.random.randint(0, 255, (64,32,48)).astype('uint8')
+>>> directory = os.path.join(tempfile.mkdtemp(), 'video.preview')
+>>> preview = build_preview(video, directory, levels = 3, spatial = 2, temporal = 2)
+>>> [level.shape for level in preview.levels]
+[(32, 16, 24), (16, 8, 12), (8, 4, 6)]
+>>> bool(np.isclose(preview.levels[0][1,0,0], video[2:4,0:2,0:2].mean(), atol = 0.5))
+True
+
+Frames are returned from the coarsest level that still has the resolution
+needed for display; full resolution frames are read only when zoomed in:
+
+>>> preview.level_for((8,12)), preview.level_for((16,24)), preview.level_for((32,48))
+(1, 0, None)
+>>> preview.get_frame(10, (8,12)).shape
+(8, 12)
+>>> preview.get_frame(10, (32,48), read = lambda i: video[i]).shape
+(32, 48)
+"""
+
+import os, time
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from labtools.log import create_logger
+from labtools.analysis.npimage.stack import iter_chunks
+
+logger = create_logger(__name__)
+
+#: extension of the preview directory, stored next to the recording
+PREVIEW_EXT = '.preview'
+
+#: filename of preview metadata
+META_NAME = 'meta.npz'
+
+def preview_directory(filename):
+    """Returns preview directory name of a recording"""
+    return filename + PREVIEW_EXT
+
+def _level_name(directory, level):
+    return os.path.join(directory, 'level%d.npy' % level)
+
+def _bin(frames, factor):
+    #spatial binning of a (n, height, width) float array
+    if factor == 1:
+        return frames
+    n, height, width = frames.shape[0:3]
+    h, w = height // factor, width // factor
+    frames = frames[:, 0:h * factor, 0:w * factor]
+    return frames.reshape((n, h, factor, w, factor) + frames.shape[3:]).mean(axis = (2,4))
+
+class _Level(object):
+    #temporal accumulator of one pyramid level
+    def __init__(self, out, spatial, temporal):
+        self.out = out
+        self.spatial = spatial
+        self.temporal = temporal
+        self.acc = np.zeros(out.shape[1:], dtype = 'float64')
+        self.count = 0
+        self.written = 0
+
+    def add(self, frames):
+        #adds a chunk of frames, returns a list of completed (averaged) frames
+        frames = _bin(frames, self.spatial)
+        done = []
+        for frame in frames:
+            self.acc += frame
+            self.count += 1
+            if self.count == self.temporal:
+                frame = self.acc / self.temporal
+                if self.written < len(self.out):
+                    self.out[self.written] = np.rint(frame) if self.out.dtype.kind in 'iu' else frame
+                    self.written += 1
+                done.append(frame)
+                self.acc[...] = 0.
+                self.count = 0
+        return np.array(done)
+
+def build_preview(source, directory, levels = 4, spatial = 4, temporal = 1,
+                  chunk_size = 16, n_frames = None, stat = None):
+    """Builds a preview pyramid of source in one pass and saves it to
+    directory (created if needed). Returns a :class:`Preview`.
+
+    :param source:
+        frame source, see :func:`.npimage.stack.iter_chunks`
+    :param str directory:
+        output directory
+    :param int levels:
+        number of levels
+    :param int spatial:
+        spatial binning of level 0
+    :param int temporal:
+        temporal binning of level 0
+    :param int chunk_size:
+        number of frames read at once
+    :param int n_frames:
+        number of frames, needed only if source has no len()
+    :param stat:
+        os.stat result of the recording, stored to validate the preview
+    """
+    if n_frames is None:
+        n_frames = len(source)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    t0 = time.time()
+    pyramid = None
+    for chunk in iter_chunks(source, chunk_size):
+        if pyramid is None:
+            shape, dtype = chunk.shape[1:], chunk.dtype.newbyteorder('=')
+            pyramid = []
+            n, s = n_frames, 1
+            for level in range(levels):
+                factor = spatial if level == 0 else 2
+                binning = temporal if level == 0 else 2
+                n, s = n // binning, s * factor
+                level_shape = (n, shape[0] // s, shape[1] // s) + shape[2:]
+                if n == 0 or level_shape[1] == 0 or level_shape[2] == 0:
+                    break
+                out = open_memmap(_level_name(directory, level), mode = 'w+',
+                                  dtype = dtype, shape = level_shape)
+                pyramid.append(_Level(out, factor, binning))
+        frames = chunk.astype('float32')
+        for level in pyramid:
+            frames = level.add(frames)
+            if len(frames) == 0:
+                break
+    if pyramid is None:
+        raise ValueError('Source has no frames')
+    for level in pyramid:
+        level.out.flush()
+    spatial_factors = np.cumprod([l.spatial for l in pyramid])
+    temporal_factors = np.cumprod([l.temporal for l in pyramid])
+    meta = dict(n_frames = n_frames, shape = shape,
+                spatial = spatial_factors, temporal = temporal_factors)
+    if stat is not None:
+        meta.update(size = stat.st_size, mtime = stat.st_mtime)
+    np.savez(os.path.join(directory, META_NAME), **meta)
+    logger.info('Preview of %d frames built in %.2fs' % (n_frames, time.time() - t0))
+    del pyramid
+    return Preview(directory)
+
+def load_preview(filename, source = None, **kw):
+    """Loads preview of a recording filename from :func:`preview_directory`.
+    If it does not exist, or the recording has changed (size or modification
+    time), it is built from source (a :class:`~labtools.pixelink.io.PixelinkDataStream`
+    of filename by default). Other keyword arguments are passed to
+    :func:`build_preview`."""
+    stat = os.stat(filename)
+    directory = preview_directory(filename)
+    try:
+        preview = Preview(directory)
+        if preview.size == stat.st_size and preview.mtime == stat.st_mtime:
+            logger.debug('Using preview %s' % directory)
+            return preview
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    if source is None:
+        from labtools.pixelink.io import PixelinkDataStream
+        source = PixelinkDataStream()
+        source.open(filename)
+    logger.info('Building preview of %s' % filename)
+    return build_preview(source, directory, stat = stat, **kw)
+
+class Preview(object):
+    """Preview pyramid stored in a directory, see :func:`build_preview`.
+    Levels are memory-mapped, so opening a preview reads no frame data.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with np.load(os.path.join(directory, META_NAME)) as meta:
+            self.n_frames = int(meta['n_frames'])
+            #: shape of full resolution frames
+            self.shape = tuple(int(i) for i in meta['shape'])
+            #: spatial binning of each level, relative to full resolution
+            self.spatial = [int(i) for i in meta['spatial']]
+            #: temporal binning of each level, relative to full resolution
+            self.temporal = [int(i) for i in meta['temporal']]
+            self.size = int(meta['size']) if 'size' in meta else None
+            self.mtime = float(meta['mtime']) if 'mtime' in meta else None
+        #: a list of (n, height, width) preview arrays, from finest to coarsest
+        self.levels = [np.load(_level_name(directory, i), mmap_mode = 'r')
+                       for i in range(len(self.spatial))]
+
+    def level_for(self, shape):
+        """Returns the coarsest level whose frames are at least of a given
+        (height, width) display shape, or None if full resolution is needed."""
+        for level in reversed(range(len(self.levels))):
+            height, width = self.levels[level].shape[1:3]
+            if height >= shape[0] and width >= shape[1]:
+                return level
+        return None
+
+    def index(self, frame, level = 0):
+        """Returns index of the preview frame of a given level, that contains
+        full resolution frame"""
+        return min(frame // self.temporal[level], len(self.levels[level]) - 1)
+
+    def frame(self, frame, level = 0):
+        """Returns preview frame of a given level, that contains full
+        resolution frame"""
+        return self.levels[level][self.index(frame, level)]
+
+    def thumbnail(self, frame, max_size = 128):
+        """Returns the smallest preview frame of frame, that is at least
+        max_size in its larger dimension (or the finest level)"""
+        for level in reversed(range(len(self.levels))):
+            if max(self.levels[level].shape[1:3]) >= max_size:
+                return self.frame(frame, level)
+        return self.frame(frame, 0)
+
+    def display_shape(self, size):
+        """Returns (height, width) of frames scaled so that the larger
+        dimension is at most size pixels"""
+        height, width = self.shape[0:2]
+        scale = min(float(size) / max(height, width), 1.)
+        return int(np.ceil(height * scale)), int(np.ceil(width * scale))
+
+    def get_frame(self, frame, shape = None, read = None):
+        """Returns frame for display of a given shape. If a preview level has
+        enough resolution, preview frame is returned, else full resolution
+        frame is read with read(frame)."""
+        level = self.level_for(shape) if shape is not None else None
+        if level is None:
+            if read is None:
+                raise ValueError('Preview has not enough resolution, a read function is needed')
+            return read(frame)
+        return self.frame(frame, level)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
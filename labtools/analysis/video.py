@@ -1,14 +1,16 @@
 """Some tools for extracting and displaying video frame-by-frame 
 """
 from enthought.traits.api import HasTraits, Instance,  File, Range, Array, \
-        Property, Int, Float, Long, on_trait_change, Enum
+        Property, Int, Float, Long, on_trait_change, Enum, Bool
 from enthought.traits.ui.api import View, Item, RangeEditor
 
 
 from scipy.misc.pilutil import fromimage
 
 from labtools.analysis.figure import Figure
-from labtools.instruments.pixelink.io import PixelinkDataStream
+from labtools.pixelink.io import PixelinkDataStream
+from labtools.utils.cache import ReadAheadCache
+from labtools.analysis.preview import Preview, load_preview
 
 try:
     import pyffmpeg
@@ -59,6 +61,16 @@ class Video(HasTraits):
     >>> v.open_stream('/home/andrej/Desktop/Film10/10.avi')
     >>> im = v.get_frame(0)
     >>> for im in v: pass
+    
+    Decoded frames are stored in a LRU cache of cache_size megabytes, and 
+    read_ahead frames are decoded in a background thread in the direction 
+    (and with the step) of scrubbing, so that scrubbing through cached frames
+    does not decode them again.
+    
+    For long pixelink recordings, set use_preview. A downsampled preview 
+    pyramid is then built once (see :mod:`labtools.analysis.preview`) and 
+    frames are displayed from it. Full resolution frames are decoded only if 
+    display_size is larger than the finest preview level.
     """
     #: specifies video filename
     filename = File
@@ -70,6 +82,19 @@ class Video(HasTraits):
     image = Array
     #: display figure
     figure = Instance(Figure,())
+    #: frame cache size in megabytes
+    cache_size = Float(256.)
+    #: number of frames decoded ahead of the displayed one
+    read_ahead = Int(16)
+    
+    #: whether to display frames from the preview pyramid
+    use_preview = Bool(False)
+    #: display size (larger image dimension) in pixels, used with preview
+    display_size = Int(512)
+    #: preview pyramid, if use_preview is set
+    preview = Instance(Preview)
+    
+    _cache = Instance(ReadAheadCache)
     view = View('filename','video_type',Item('figure',style = 'custom', show_label = False),
                 Item('frame_info', label = 'Frame', style = 'custom'),resizable = True)
     
@@ -88,46 +113,88 @@ class Video(HasTraits):
         :returns numpy.array of a given frame
             
         """
+        if self.preview is not None:
+            shape = self.preview.display_shape(self.display_size)
+            self.image = self.preview.get_frame(index, shape, read = self._cache.__getitem__)
+        else:
+            self.image = self._cache[index]
         if self.video_type == 'pixelink':
-            self.image = self.stream.get_frame(index)
             self.figure.update_image(self.image)
         else:
-            self.image = fromimage(self.stream.GetFrameNo(index))
             self.figure.update_image(self.image[:,:,0])
         return self.image
         
+    def _read_frame(self, index):
+        if self.video_type == 'pixelink':
+            return self.stream.get_frame(index)[1]
+        else:
+            return fromimage(self.stream.GetFrameNo(index))
+        
     def open_stream(self, filename):
         """Opens stream from filename
         
         :param str filename:
             must be a valid filename
         """
+        self._close_cache()
         if self.video_type == 'pixelink':
             self.stream = PixelinkDataStream()
-            self.stream.open(filename)
+            self.stream.open(filename, index = True)
+            n_frames = len(self.stream)
+            self._open_cache(n_frames)
+            self.preview = load_preview(filename, self.stream) if self.use_preview else None
             self.frame_info.index = 0
             self.get_frame(0)
-            self.frame_info.n_frames = len(self.stream.frame_desc)
-            self.frame_info.duration = self.stream.frame_desc[-1]['FrameTime'] - \
-                                        self.stream.frame_desc[0]['FrameTime']
-            self.frame_info.fps = self.stream.frame_desc[0]['FrameRate']
+            self.frame_info.n_frames = n_frames
+            descriptors = self.stream.descriptors
+            self.frame_info.duration = float(descriptors[-1]['FrameTime'] - descriptors[0]['FrameTime'])
+            self.frame_info.fps = float(descriptors[0]['FrameRate'])
             
         else:
             self.stream = pyffmpeg.VideoStream()
             self.stream.open(filename)
+            self.preview = None
+            n_frames = (self.stream.tv.duration() -1)
+            self._open_cache(n_frames)
             self.frame_info.index = 0
             self.get_frame(0)
-            self.frame_info.n_frames = (self.stream.tv.duration() -1)
+            self.frame_info.n_frames = n_frames
             self.frame_info.duration = self.stream.vr.duration_time()
             self.frame_info.fps = self.stream.tv.get_fps() 
         self.filename = filename
         
+    def _open_cache(self, n_frames):
+        self._cache = ReadAheadCache(self._read_frame, n_frames, 
+                                     maxbytes = int(self.cache_size * 1024 * 1024), 
+                                     depth = self.read_ahead)
+                                     
+    def _close_cache(self):
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+            
+    def _cache_size_changed(self, value):
+        if self._cache is not None:
+            self._cache.maxbytes = int(value * 1024 * 1024)
+            
+    def _read_ahead_changed(self, value):
+        if self._cache is not None:
+            self._cache.depth = value
+        
     def _filename_changed(self,name):
         self.open_stream(name)
         
     def _video_type_changed(self):
         if self.filename:
             self.open_stream(self.filename)
+            
+    def _use_preview_changed(self):
+        if self.filename:
+            self.open_stream(self.filename)
+            
+    def _display_size_changed(self):
+        if self.preview is not None:
+            self.get_frame(self.frame_info.index)
         
     def __iter__(self):
         self._iteration_start = True
@@ -0,0 +1,225 @@
+"""uEye API fake functions.. for testing without the camera.
+
+Only functions used by :mod:`labtools.ids.ueye` are defined. A capture thread
+fills image memories of the sequence at a given frame rate. As in the uEye
+driver, buffers are filled in sequence order, locked buffers are skipped,
+and locked buffers can not be freed. Each frame is filled with its frame
+number (modulo the maximum pixel value), so that buffer ownership can be
+checked by inspecting data.
+"""
+import ctypes, threading, time
+import numpy as np
+
+IS_SUCCESS = 0
+IS_NO_SUCCESS = -1
+IS_TIMED_OUT = 122
+IS_GET_COLOR_MODE = 0x8000
+IS_CM_MONO8 = 6
+
+#: simulated sensor size
+WIDTH, HEIGHT = 640, 480
+
+_state = {'mode' : IS_CM_MONO8,
+          'framerate' : 100.,
+          'exposure' : 10.,
+          'memories' : {}, #memory id: [address, width, height, bits, locked]
+          'active' : None,
+          'sequence' : [],
+          'current' : 0, #index of the sequence buffer that is being filled
+          'last' : None, #index of the last filled sequence buffer
+          'frames' : 0,
+          'thread' : None,
+          'stop' : threading.Event(),
+          'event' : threading.Event(),
+          'lock' : threading.Lock()}
+
+def _value(obj):
+    return obj.value if hasattr(obj, 'value') else obj
+
+def _address(pointer):
+    return ctypes.cast(pointer, ctypes.c_void_p).value
+
+def _set(ref, value):
+    ref._obj.value = value
+
+def _fill(memid):
+    address, width, height, bits, locked = _state['memories'][memid]
+    dtype = 'uint8' if bits <= 8 else 'uint16'
+    size = width * height * np.dtype(dtype).itemsize
+    data = np.frombuffer((ctypes.c_char * size).from_address(address), dtype = dtype)
+    data[...] = _state['frames'] % (np.iinfo(dtype).max + 1)
+    _state['frames'] += 1
+
+def is_GetNumberOfDevices():
+    return 1
+
+def is_InitCamera(handle, window = None):
+    _set(handle, 1)
+    return IS_SUCCESS
+
+def is_ExitCamera(handle):
+    is_StopLiveVideo(handle, 0)
+    return IS_SUCCESS
+
+def is_GetSensorInfo(handle, info):
+    info._obj.nMaxWidth = WIDTH
+    info._obj.nMaxHeight = HEIGHT
+    return IS_SUCCESS
+
+def is_SetExternalTrigger(handle, mode):
+    return IS_SUCCESS
+
+def is_SetDisplayMode(handle, mode):
+    return IS_SUCCESS
+
+def is_ParameterSet(handle, command, *args):
+    return IS_SUCCESS
+
+def is_AOI(handle, command, rect, size):
+    rect._obj.s32X, rect._obj.s32Y = 0, 0
+    rect._obj.s32Width, rect._obj.s32Height = WIDTH, HEIGHT
+    return IS_SUCCESS
+
+def is_SetColorMode(handle, mode):
+    if mode == IS_GET_COLOR_MODE:
+        return _state['mode']
+    _state['mode'] = mode
+    return IS_SUCCESS
+
+def is_SetFrameRate(handle, framerate, new):
+    _state['framerate'] = _value(framerate)
+    _set(new, _state['framerate'])
+    return IS_SUCCESS
+
+def is_SetExposureTime(handle, exposure, new):
+    _state['exposure'] = _value(exposure)
+    _set(new, _state['exposure'])
+    return IS_SUCCESS
+
+def is_SetAllocatedImageMem(handle, width, height, bits, memory, memid):
+    with _state['lock']:
+        n = max(list(_state['memories'].keys()) + [0]) + 1
+        _state['memories'][n] = [_address(memory), _value(width), _value(height), _value(bits), False]
+    _set(memid, n)
+    return IS_SUCCESS
+
+def is_SetImageMem(handle, memory, memid):
+    if _value(memid) not in _state['memories']:
+        return IS_NO_SUCCESS
+    _state['active'] = _value(memid)
+    return IS_SUCCESS
+
+def is_FreeImageMem(handle, memory, memid):
+    with _state['lock']:
+        memid = _value(memid)
+        if memid not in _state['memories'] or _state['memories'][memid][4]:
+            return IS_NO_SUCCESS #unknown or locked memory
+        if memid in _state['sequence'] and _state['thread'] is not None:
+            return IS_NO_SUCCESS #memory is used by the capture
+        del _state['memories'][memid]
+        if memid in _state['sequence']:
+            _state['sequence'].remove(memid)
+    return IS_SUCCESS
+
+def is_FreezeVideo(handle, wait):
+    if _state['active'] is None:
+        return IS_NO_SUCCESS
+    time.sleep(1. / _state['framerate'])
+    with _state['lock']:
+        _fill(_state['active'])
+    return IS_SUCCESS
+
+def is_AddToSequence(handle, memory, memid):
+    if _value(memid) not in _state['memories']:
+        return IS_NO_SUCCESS
+    _state['sequence'].append(_value(memid))
+    return IS_SUCCESS
+
+def is_ClearSequence(handle):
+    if _state['thread'] is not None:
+        return IS_NO_SUCCESS
+    _state['sequence'] = []
+    _state['current'], _state['last'] = 0, None
+    return IS_SUCCESS
+
+def _capture():
+    next_time = time.time()
+    while not _state['stop'].is_set():
+        next_time += 1. / _state['framerate']
+        delay = next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        with _state['lock']:
+            sequence = _state['sequence']
+            #find the next unlocked buffer
+            for i in range(len(sequence)):
+                index = (_state['current'] + i) % len(sequence)
+                if not _state['memories'][sequence[index]][4]:
+                    _fill(sequence[index])
+                    _state['last'] = index
+                    _state['current'] = (index + 1) % len(sequence)
+                    _state['event'].set()
+                    break
+
+def is_CaptureVideo(handle, wait):
+    if not _state['sequence'] or _state['thread'] is not None:
+        return IS_NO_SUCCESS
+    _state['stop'].clear()
+    _state['thread'] = threading.Thread(target = _capture)
+    _state['thread'].daemon = True
+    _state['thread'].start()
+    return IS_SUCCESS
+
+def is_StopLiveVideo(handle, wait):
+    if _state['thread'] is not None:
+        _state['stop'].set()
+        _state['thread'].join()
+        _state['thread'] = None
+    return IS_SUCCESS
+
+def is_EnableEvent(handle, which):
+    _state['event'].clear()
+    return IS_SUCCESS
+
+def is_DisableEvent(handle, which):
+    return IS_SUCCESS
+
+def is_WaitEvent(handle, which, timeout):
+    if _state['event'].wait(_value(timeout) / 1000.):
+        _state['event'].clear()
+        return IS_SUCCESS
+    return IS_TIMED_OUT
+
+def is_GetActSeqBuf(handle, num, memory, last):
+    with _state['lock']:
+        sequence = _state['sequence']
+        if not sequence:
+            return IS_NO_SUCCESS
+        _set(num, _state['current'] + 1) #sequence numbers start with 1
+        _set(memory, _state['memories'][sequence[_state['current']]][0])
+        if _state['last'] is not None:
+            _set(last, _state['memories'][sequence[_state['last']]][0])
+    return IS_SUCCESS
+
+def _seq_memory(num, memory):
+    address = _address(memory)
+    for memid in _state['sequence']:
+        if _state['memories'][memid][0] == address:
+            return memid
+    return None
+
+def is_LockSeqBuf(handle, num, memory):
+    with _state['lock']:
+        memid = _seq_memory(num, memory)
+        if memid is None:
+            return IS_NO_SUCCESS
+        _state['memories'][memid][4] = True
+    return IS_SUCCESS
+
+def is_UnlockSeqBuf(handle, num, memory):
+    with _state['lock']:
+        memid = _seq_memory(num, memory)
+        if memid is None or not _state['memories'][memid][4]:
+            return IS_NO_SUCCESS #unknown or not locked
+        _state['memories'][memid][4] = False
+    return IS_SUCCESS
@@ -53,6 +53,16 @@ You can also change framerate and exposure anytime between image captures.
 Not that framerate and exposure cannot be set exactly. The methods above return the actual
 setting value. This of course depends on the camera used...
 
+For continuous capture, start a sequence of n image buffers. The camera fills
+buffers in a ring, while you process them
+
+>>> c.start_sequence(8)
+>>> index = c.wait_frame() #index of the last captured buffer
+>>> im = c.lock_frame(index) #buffer is not overwritten until it is unlocked
+>>> m = im.mean()
+>>> c.unlock_frame(index)
+>>> c.stop_sequence()
+
 Close the camera when you are finished:
 
 >>> c.close()
@@ -64,7 +74,7 @@ from labtools.log import create_logger
 import logging as logger
 import platform,os
 import numpy as np
-from labtools.ids.conf import LOGLEVEL
+from labtools.ids.conf import LOGLEVEL, SIMULATE
 import warnings
 
 logger = create_logger(__name__, LOGLEVEL)
@@ -73,7 +83,11 @@ if platform.architecture()[0] == '64bit':
     LIBNAME = 'uEye_api_64'
 else:
     LIBNAME = 'uEye_api'
-ueyelib = cdll.LoadLibrary(LIBNAME)
+
+if SIMULATE == True:
+    from labtools.ids._test import ueyelib
+else:
+    ueyelib = cdll.LoadLibrary(LIBNAME)
 
 #-------------Ueye API ctype definitions
 
@@ -140,7 +154,11 @@ IS_CM_SENSOR_RAW12 = 27
 IS_CM_SENSOR_RAW16 = 29
 
 
+IS_DONT_WAIT = 0x0000
 IS_WAIT = 0x0001
+IS_FORCE_VIDEO_STOP = 0x4000
+IS_TIMED_OUT = 122
+IS_SET_EVENT_FRAME = 2
 IS_SET_DM_DIB = 1
 IS_AOI_IMAGE_SET_SIZE = 0x0005
 IS_AOI_IMAGE_GET_AOI = 0x0002
@@ -206,6 +224,10 @@ class Camera(object):
     _memory_id = INT()
     _initialized = False
     sensor_info = SENSORINFO()
+    image = None
+    #: list of sequence image buffers, if sequence is allocated
+    sequence = None
+    _sequence_memory = []
     
     def init(self,device = 0):
         """Initializes camera"""
@@ -294,9 +316,109 @@ class Camera(object):
     def capture(self):
         """Captures a single frame. Returns a reference to numpy image data array"""
         logger.debug("Capturing next frame.")
+        if self.sequence is not None:
+            raise UEyeError("Sequence capture is running. Call stop_sequence first.")
         execute(ueyelib.is_FreezeVideo,self._handle,IS_WAIT)
         return self.image
         
+    def allocate_sequence(self, n_buffers = 8):
+        """Allocates n_buffers image buffers of the same shape and dtype as
+        :attr:`image` and adds them to the camera sequence."""
+        if self.image is None:
+            raise UEyeError("Image not allocated. Call set_parameters or load_parameters first.")
+        self.free_sequence()
+        height, width = self.image.shape
+        bits = INT(8 * self.image.dtype.itemsize)
+        self.sequence = []
+        self._sequence_memory = []
+        self._locked = set()
+        self._last = None
+        self.skipped = 0
+        for i in range(n_buffers):
+            buffer = np.empty_like(self.image)
+            memory = buffer.ctypes.data_as(POINTER(c_char))
+            memory_id = INT()
+            execute(ueyelib.is_SetAllocatedImageMem, self._handle, width, height, bits,
+                    memory, byref(memory_id))
+            self.sequence.append(buffer)
+            self._sequence_memory.append((memory, memory_id))
+            execute(ueyelib.is_AddToSequence, self._handle, memory, memory_id)
+            
+    def free_sequence(self):
+        """Stops sequence capture and frees sequence buffers"""
+        if self.sequence is None:
+            return
+        ueyelib.is_StopLiveVideo(self._handle, IS_FORCE_VIDEO_STOP)
+        ueyelib.is_DisableEvent(self._handle, IS_SET_EVENT_FRAME)
+        for index in list(self._locked):
+            self.unlock_frame(index)
+        execute(ueyelib.is_ClearSequence, self._handle)
+        for memory, memory_id in self._sequence_memory:
+            execute(ueyelib.is_FreeImageMem, self._handle, memory, memory_id)
+        self.sequence = None
+        self._sequence_memory = []
+        
+    def start_sequence(self, n_buffers = 8):
+        """Allocates a sequence of n_buffers image buffers and starts continuous 
+        capture. The camera fills buffers in a ring, skipping locked buffers. 
+        Use :meth:`wait_frame`, :meth:`lock_frame` and :meth:`unlock_frame` 
+        to get the data."""
+        logger.info("Starting sequence capture.")
+        self.allocate_sequence(n_buffers)
+        execute(ueyelib.is_EnableEvent, self._handle, IS_SET_EVENT_FRAME)
+        execute(ueyelib.is_CaptureVideo, self._handle, IS_DONT_WAIT)
+        
+    def stop_sequence(self):
+        """Stops sequence capture and frees sequence buffers."""
+        logger.info("Stopping sequence capture.")
+        self.free_sequence()
+        
+    def wait_frame(self, timeout = 1.):
+        """Waits at most timeout seconds for a new frame and returns index of
+        the last captured sequence buffer. If more than one frame was captured
+        since the last call, the number of skipped frames is added to 
+        :attr:`skipped` (estimated from buffer indices)."""
+        if self.sequence is None:
+            raise UEyeError("Sequence not allocated. Call start_sequence first.")
+        value = ueyelib.is_WaitEvent(self._handle, IS_SET_EVENT_FRAME, int(timeout * 1000))
+        if value == IS_TIMED_OUT:
+            raise UEyeError("No frame received in %s seconds." % timeout)
+        elif value != IS_SUCCESS:
+            raise UEyeError("is_WaitEvent failed with exit code %s." % value)
+        number, memory, last = INT(), c_void_p(), c_void_p()
+        execute(ueyelib.is_GetActSeqBuf, self._handle, byref(number), byref(memory), byref(last))
+        addresses = [cast(m, c_void_p).value for m, i in self._sequence_memory]
+        index = addresses.index(last.value)
+        if self._last is not None:
+            self.skipped += (index - self._last - 1) % len(self.sequence)
+        self._last = index
+        return index
+        
+    def lock_frame(self, index):
+        """Locks sequence buffer of a given index, so that the camera does not
+        overwrite it, and returns it. Call :meth:`unlock_frame` when done."""
+        if index in self._locked:
+            raise UEyeError("Buffer %d is already locked." % index)
+        memory, memory_id = self._sequence_memory[index]
+        execute(ueyelib.is_LockSeqBuf, self._handle, index + 1, memory)
+        self._locked.add(index)
+        return self.sequence[index]
+        
+    def unlock_frame(self, index):
+        """Unlocks sequence buffer of a given index. The buffer returned by 
+        :meth:`lock_frame` must not be used after this call."""
+        if index not in self._locked:
+            raise UEyeError("Buffer %d is not locked." % index)
+        memory, memory_id = self._sequence_memory[index]
+        execute(ueyelib.is_UnlockSeqBuf, self._handle, index + 1, memory)
+        self._locked.discard(index)
+        
+    def capture_sequence(self, timeout = 1.):
+        """Waits for a new frame and returns (index, image) of a locked 
+        sequence buffer. Unlock it with :meth:`unlock_frame` when done."""
+        index = self.wait_frame(timeout)
+        return index, self.lock_frame(index)
+        
     def free_memory(self):
         """Frees image memory. Use this only if you allocate_image by yourself. Normally, this gets called automatically when needed."""
         logger.debug("Freeing image memory")
@@ -311,6 +433,7 @@ class Camera(object):
                          
     def close(self):
         logger.info("Closing camera.")
+        self.free_sequence()
         self._free_memory_silent()
         execute(ueyelib.is_ExitCamera,self._handle)
         self._initialized = False
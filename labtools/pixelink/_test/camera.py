@@ -0,0 +1,133 @@
+"""Simulated pixelink camera.. for testing without the SDK or hardware.
+
+Features are stored in a dict, and frames are generated at a given frame
+rate: a gaussian spot moving in a circle on a noisy background, scaled by
+shutter and gain.
+
+>>> c = SimulatedCamera(frame_rate = 200.)
+>>> c.init()
+>>> c.set_camera(shutter = 0.01, roi = [0, 0, 64, 48])
+>>> c.empty_frame().shape
+(48, 64)
+>>> ring = c.start_streaming(n_buffers = 4)
+>>> frame = c.get_frame()
+>>> frame.data.shape, int(frame.descriptor['FrameNumber']) == frame.number
+((48, 64), True)
+>>> c.stop_streaming()
+>>> c.close()
+"""
+
+import time
+import numpy as np
+
+from labtools.pixelink.camera import Camera
+from labtools.pixelink.PxLTypes import *
+
+class SimulatedCamera(Camera):
+    """A :class:`~labtools.pixelink.camera.Camera` that does not call the
+    pixelink API.
+
+    :param float frame_rate:
+        maximum frame rate in frames per second
+    :param float noise:
+        standard deviation of the background noise, in counts
+    :param int bit_depth:
+        significant bits of 16 bit pixel formats
+    """
+    def __init__(self, device = 0, frame_rate = 30., noise = 2., bit_depth = 10):
+        Camera.__init__(self, device, bit_depth)
+        self.noise = noise
+        self._features = {FEATURE_ROI : [0., 0., 640., 480.],
+                          FEATURE_DECIMATION : [1., 0.],
+                          FEATURE_PIXEL_FORMAT : [float(PIXEL_FORMAT_MONO8)],
+                          FEATURE_SHUTTER : [0.01],
+                          FEATURE_GAIN : [0.],
+                          FEATURE_GAMMA : [1.],
+                          FEATURE_FRAME_RATE : [frame_rate]}
+        self._ranges = {FEATURE_ROI : [(0., 0.), (0., 0.), (8., 640.), (8., 480.)],
+                        FEATURE_DECIMATION : [(1., 4.), (0., 0.)],
+                        FEATURE_PIXEL_FORMAT : [(float(PIXEL_FORMAT_MONO8), float(PIXEL_FORMAT_MONO16))],
+                        FEATURE_SHUTTER : [(1e-4, 2.)],
+                        FEATURE_GAIN : [(0., 24.)],
+                        FEATURE_GAMMA : [(0.1, 4.)],
+                        FEATURE_FRAME_RATE : [(1., 1000.)]}
+        self._frame_number = 0
+        self._next_time = 0.
+        self._t0 = time.time()
+        self._random = np.random.RandomState(0)
+
+    def init(self, device = None):
+        if device is not None:
+            self.device = device
+        self._initialized = True
+        self.camera_features = self.get_camera_features()
+
+    def close(self):
+        self.stop_streaming()
+        self._initialized = False
+
+    def get_camera_features(self, id = FEATURE_ALL):
+        ids = list(self._ranges.keys()) if id == FEATURE_ALL else [id]
+        return dict((i, {'flags' : 0, 'params' : list(self._ranges[i])}) for i in ids)
+
+    def get_feature(self, id, return_flags = False, as_type = float):
+        params = [as_type(p) for p in self._features[id]]
+        if return_flags:
+            return params, as_type(0)
+        return params
+
+    def set_feature(self, id, values, flags = 0):
+        try:
+            values = list(values)
+        except TypeError:
+            values = [values]
+        self._features[id] = [float(v) for v in values]
+
+    def set_stream_state(self, id):
+        if id == START_STREAM:
+            self._next_time = time.time()
+
+    def set_preview_state(self, id):
+        pass
+
+    def _grab(self, im, descriptor = None):
+        #wait for the next frame, as a real camera would
+        frame_time = 1. / self._features[FEATURE_FRAME_RATE][0]
+        delay = self._next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time + frame_time, time.time())
+
+        t = time.time() - self._t0
+        shape = im.shape[0:2]
+        y, x = np.ogrid[0:shape[0], 0:shape[1]]
+        cy = shape[0] * (0.5 + 0.25 * np.sin(t))
+        cx = shape[1] * (0.5 + 0.25 * np.cos(t))
+        sigma = max(min(shape) / 16., 1.)
+        signal = np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * sigma ** 2))
+        shutter = self._features[FEATURE_SHUTTER][0]
+        gain = 10 ** (self._features[FEATURE_GAIN][0] / 20.)
+        maxval = self.saturation_level(im.dtype)
+        data = 10. + signal * maxval * shutter * gain * 10. + \
+               self._random.normal(0, self.noise, shape)
+        data = np.clip(data, 0, maxval)
+        if im.ndim == 3:
+            data = data[..., None]
+        im[...] = data
+
+        if descriptor is not None:
+            desc = descriptor[0]
+            desc['Size'] = descriptor.itemsize
+            desc['FrameTime'] = t
+            desc['FrameNumber'] = self._frame_number
+            desc['Shutter'] = shutter
+            desc['Gain'] = self._features[FEATURE_GAIN][0]
+            desc['FrameRate'] = self._features[FEATURE_FRAME_RATE][0]
+            desc['ROI'] = self._features[FEATURE_ROI]
+            desc['Decimation'] = self._features[FEATURE_DECIMATION][0]
+            desc['PixelFormat'] = self._features[FEATURE_PIXEL_FORMAT][0]
+        self._frame_number += 1
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -21,7 +21,8 @@ import time
 
 logger = create_logger(__name__, LOGLEVEL)
 
-from labtools.pixelink.io import PIXEL_FORMAT
+from labtools.pixelink.io import PIXEL_FORMAT, FRAME_DESC_DTYPE
+from labtools.utils.frames import FrameRing, FrameGrabber
 
 from labtools.utils.instr import  \
          BaseInstrument, InstrError, do_if_initialized
@@ -69,6 +70,44 @@ def free(addr):
     libc.free(addr)
 
 
+def histogram(im, step = 4):
+    """Returns intensity histogram of every step-th pixel (in each direction) of 
+    an integer image.
+    
+    >>> im = np.arange(64, dtype = 'uint8').reshape(8,8)
+    >>> int(histogram(im, step = 2).sum())
+    16
+    """
+    sample = im[::step, ::step]
+    return np.bincount(sample.ravel(), minlength = int(sample.max()) + 1)
+        
+def highlight_level(im, percent = 1, step = 4):
+    """Returns intensity level of the brightest percent of pixels of im, 
+    computed from the :func:`histogram` of every step-th pixel.
+    
+    >>> im = np.arange(100, dtype = 'uint8').reshape(10,10)
+    >>> highlight_level(im, 10, step = 1)
+    90
+    """
+    hist = histogram(im, step)
+    counts = np.cumsum(hist[::-1])
+    n = max(counts[-1] * percent / 100., 1)
+    return len(hist) - 1 - int(np.searchsorted(counts, n))
+
+def black_level(im, percent = 1, step = 4):
+    """Returns intensity level of the darkest percent of pixels of im (an
+    estimate of the background), computed from the :func:`histogram` of every 
+    step-th pixel.
+    
+    >>> im = np.arange(100, dtype = 'uint8').reshape(10,10)
+    >>> black_level(im, 10, step = 1)
+    9
+    """
+    counts = np.cumsum(histogram(im, step))
+    n = max(counts[-1] * percent / 100., 1)
+    return int(np.searchsorted(counts, n))
+        
+
 class CameraFeatures(object):
     """To be used only with get_camera_features method in the Camera class. 
     Buffer_size must be determined as written in the manual then 
@@ -181,6 +220,19 @@ class Camera(BaseInstrument):
     >>> c.save_image('test.tiff', im, IMAGE_FORMAT_TIFF) #save to tiff file
     >>> c.save_image('test.jpg', im) #store to jpg by default
     
+    For continuous acquisition, start streaming. Frames are captured in a
+    separate thread into a ring of preallocated buffers
+    
+    >>> ring = c.start_streaming(n_buffers = 8)
+    >>> frame = c.get_frame() #next frame, a view of the ring buffer
+    >>> frame.number, frame.data, frame.descriptor, frame.timestamp
+    
+    The view is valid until the next get_frame call, copy the data if you need
+    to keep it. If frames are not read fast enough, the oldest are dropped
+    
+    >>> c.stream_statistics()['dropped']
+    >>> c.stop_streaming()
+    
     You can also capture simple movies
     
     >>> c.save_clip('test.pds', 2) # save a two frame video
@@ -209,7 +261,7 @@ class Camera(BaseInstrument):
     #holds handles to custom descriptors, if any.. the create_descriptor fills this list
     _descriptors = []
     
-    def __init__(self, device = 0):
+    def __init__(self, device = 0, bit_depth = 10):
         self.device = device
         self._handle = None
         self._descriptor = FRAME_DESC()
@@ -223,6 +275,10 @@ class Camera(BaseInstrument):
             return ret        
         self._cb = GET_CLIP_CALLBACK_FUNC(callback) #must be set as attribute, so that reference is not lost
         self._video_done = True #for internal tracking of video capture
+        #: number of significant bits of 16 bit pixel formats (sensor depth)
+        self.bit_depth = bit_depth
+        self._ring = None
+        self._grabber = None
         
     def init(self, device = None):
         """Initializes the camera with the given device number (serial number)
@@ -244,6 +300,7 @@ class Camera(BaseInstrument):
     def close(self):
         """This should be called when finished"""
         if self._handle is not None:
+            self.stop_streaming()
             self.remove_descriptor()
             execute(PxLUninitialize, self._handle)
             self._handle = None
@@ -383,8 +440,8 @@ class Camera(BaseInstrument):
         """Creates an empty image frame. based on camera specifications,
         for filling with the :meth:`.Camera.get_next_frame`"""
         resample, typ = self.get_feature(FEATURE_DECIMATION, as_type = int)
-        t,l,b,r = self.get_feature(FEATURE_ROI, as_type = int)
-        im_shape = (r-l)/resample, (b-t)/resample 
+        left, top, width, height = self.get_feature(FEATURE_ROI, as_type = int)
+        im_shape = height // resample, width // resample 
         format = self.get_feature(FEATURE_PIXEL_FORMAT, as_type = int)[0]
         try:
             color, dt = PIXEL_FORMAT[int(format)]
@@ -392,7 +449,19 @@ class Camera(BaseInstrument):
             raise InstrError('Unsupported pixel format %s' % format)
         if color == 'rgb':
             im_shape = im_shape + (3,) 
-        return np.empty(im_shape, dtype = dt).newbyteorder(ENDIAN)
+        return np.empty(im_shape, dtype = dt.newbyteorder(ENDIAN))
+        
+    def _grab(self, im, descriptor = None):
+        """Grabs next frame of a running stream into im. Descriptor is
+        written to descriptor, a one-element array of FRAME_DESC_DTYPE,
+        if given, else to the internal FRAME_DESC structure."""
+        buffer_size = c_uint32(im.size * im.itemsize)
+        p = im.ctypes.data_as(c_void_p) # pointer to numpy data
+        if descriptor is None:
+            pdesc = byref(self._descriptor)
+        else:
+            pdesc = descriptor.ctypes.data_as(POINTER(FRAME_DESC)) #no copy
+        execute(PxLGetNextFrame, self._handle, buffer_size, p, pdesc)
         
     @do_if_initialized        
     def get_next_frame(self, output = None):
@@ -400,20 +469,103 @@ class Camera(BaseInstrument):
         Captures image and writes it to numpy array. If output is specified,
         it uses it to fill data, but it mast be of correct shape and dtype.
         If it is not specified, it is determined automatically.
+        If camera is streaming, next frame of the stream is copied instead.
         """
         if output is None:
             im = self.empty_frame()
         else: 
             im = output
+        if self.streaming:
+            frame = self.get_frame()
+            im[...] = frame.data
+        else:
+            self.set_stream_state(STOP_STREAM)
+            self.set_stream_state(START_STREAM)
+            self._grab(im)
+            self.set_stream_state(STOP_STREAM)
+        if output is None:
+            return im
+            
+    @property
+    def streaming(self):
+        """True if continuous acquisition is running"""
+        return self._grabber is not None and self._grabber.is_alive()
+            
+    @do_if_initialized
+    def start_streaming(self, n_buffers = 8, mailbox = None, clock = time.time):
+        """start_streaming(n_buffers = 8, mailbox = None, clock = time.time)
+        Starts continuous acquisition. The stream is started once and frames
+        are captured in a separate thread into a :class:`~labtools.utils.frames.FrameRing`
+        of n_buffers preallocated frames (with descriptors), which is returned.
+        Image parameters (ROI, format, decimation) must not change while streaming.
+        If mailbox (a :class:`~labtools.utils.frames.LatestFrame`) is given, 
+        frames are also put to it, for live display. See :attr:`mailbox`.
+        Frames are timestamped with clock, when they are grabbed.
+        """
+        self.stop_streaming()
+        im = self.empty_frame()
+        self._ring = FrameRing(im.shape, im.dtype, n_buffers, FRAME_DESC_DTYPE, clock)
         self.set_stream_state(STOP_STREAM)
         self.set_stream_state(START_STREAM)
+        self._grabber = FrameGrabber(self._grab, self._ring, mailbox = mailbox)
+        self._grabber.start()
+        return self._ring
+        
+    @property
+    def mailbox(self):
+        """:class:`~labtools.utils.frames.LatestFrame` mailbox of a running 
+        stream, or None. It can be set (or removed) while streaming."""
+        return self._grabber.mailbox if self._grabber is not None else None
+        
+    @mailbox.setter
+    def mailbox(self, mailbox):
+        if self._grabber is None:
+            raise InstrError('Not streaming! You must call "start_streaming" method first')
+        self._grabber.mailbox = mailbox
+        
+    def stop_streaming(self):
+        """Stops continuous acquisition, if running"""
+        if self._grabber is not None:
+            self._grabber.stop()
+            self._grabber = None
+            self.set_stream_state(STOP_STREAM)
+            logger.info('Streaming stopped. %s' % self._ring.statistics())
             
-        buffer_size = c_uint32(im.size * im.itemsize)
-        p = im.ctypes.data_as(c_void_p) # pointer to numpy data
-        execute(PxLGetNextFrame, self._handle, buffer_size, p, byref(self._descriptor))
-        self.set_stream_state(STOP_STREAM)
-        if output is None:
-            return im
+    def _check_stream(self):
+        if self._ring is None:
+            raise InstrError('Not streaming! You must call "start_streaming" method first')
+        if self._grabber is not None and self._grabber.error is not None:
+            raise self._grabber.error
+            
+    def get_frame(self, timeout = 1.):
+        """get_frame(timeout = 1.)
+        Returns the next :class:`~labtools.utils.frames.Frame` of the stream
+        (frame number, data, descriptor, timestamp). Data is a view of the ring
+        buffer, valid until the next call. Raises InstrError on timeout.
+        """
+        self._check_stream()
+        frame = self._ring.get(timeout)
+        if frame is None:
+            self._check_stream()
+            raise InstrError('No frame received in %s seconds' % timeout)
+        return frame
+        
+    def get_latest_frame(self, timeout = 1.):
+        """get_latest_frame(timeout = 1.)
+        Same as :meth:`get_frame`, but skips to the most recent frame
+        """
+        self._check_stream()
+        frame = self._ring.get_latest(timeout)
+        if frame is None:
+            self._check_stream()
+            raise InstrError('No frame received in %s seconds' % timeout)
+        return frame
+        
+    def stream_statistics(self):
+        """Returns a dict of frame counters of the stream (written, read,
+        dropped, skipped, pending)"""
+        self._check_stream()
+        return self._ring.statistics()
             
     @do_if_initialized        
     def save_clip(self, fname, n = 1, wait = True):
@@ -467,31 +619,79 @@ class Camera(BaseInstrument):
         finally:
             free(pout)
             
-    def auto_shutter(self, highlight_value = 200, highlight_percent = 1, min_shutter = 0.):
+    def saturation_level(self, dtype):
+        """Returns the maximum pixel value of images of a given dtype. For 16 bit 
+        pixel formats this is determined by :attr:`bit_depth`, not by the dtype.
+        """
+        return min(2 ** self.bit_depth, np.iinfo(dtype).max + 1) - 1
+            
+    def _exposure_frame(self, shutter, retries = 4):
+        #returns a frame captured with a given shutter. When streaming, frames
+        #that were exposed with the previous shutter are skipped
+        if not self.streaming:
+            return self.get_next_frame()
+        frame = self.get_latest_frame()
+        for i in range(retries):
+            if abs(float(frame.descriptor['Shutter']) - shutter) <= 1e-3 * shutter:
+                break
+            frame = self.get_frame()
+        return frame.data
+            
+    def auto_shutter(self, highlight_value = 200, highlight_percent = 1, min_shutter = 0., 
+                     step = 4, tolerance = 0.1, max_frames = 3, black_percent = 1):
         """Return optimal shutter value. By default it assumes a higlight value of 200 and 
-        it assumes at max 1 percent of higlight area. You can also define minimal shutter
-        for faster auto_shutter at higher shutter values."""
-        highlight_value = min(abs(highlight_value), 254)
+        it assumes at max 1 percent of higlight area. You can also define minimal shutter.
+        
+        Highlight level (intensity of the brightest highlight_percent of pixels) 
+        is computed with :func:`highlight_level` from every step-th pixel. 
+        Intensity is assumed to be linear in shutter above the black level, 
+        which is estimated from the first frame with :func:`black_level` (the 
+        darkest black_percent of pixels). The next shutter is predicted from 
+        the levels above the black level, and from the measured slope after
+        two frames. It stops when the level is within tolerance of 
+        highlight_value, or after max_frames frames. This takes 2-3 frames, 
+        unless the highlights of the first frame are within the background 
+        noise (shutter far too short), then increase max_frames. Saturation 
+        is determined with :meth:`saturation_level`.
+        """
         highlight_percent = min(abs(highlight_percent), 99)
         frange, flags = self.get_feature_range(FEATURE_SHUTTER)
-        shutter = frange[0][0]
-        shutter_max = frange[0][1]
-        
-        min_shutter = min(abs(min_shutter), shutter_max)
-        shutter = max(shutter, min_shutter)
-        
-        while True:
-            
-            self.set_camera(shutter = shutter)
-            im = self.get_next_frame()
-            hotpixels = im.size/100. * highlight_percent
-            if im[im>=highlight_value].size >= hotpixels:
-                return shutter/2.
+        shutter_min, shutter_max = frange[0][0], frange[0][1]
+        shutter_min = max(shutter_min, min(abs(min_shutter), shutter_max))
+        shutter = min(max(self.get_feature(FEATURE_SHUTTER)[0], shutter_min), shutter_max)
+        best, previous, offset = shutter, None, None
+        for i in range(max_frames):
+            self.set_feature(FEATURE_SHUTTER, [shutter])
+            im = self._exposure_frame(shutter)
+            maxval = self.saturation_level(im.dtype)
+            target = min(abs(highlight_value), maxval - 1)
+            level = highlight_level(im, highlight_percent, step)
+            if offset is None:
+                #background is not a useful black level if it is close to 
+                #the highlights (uniform image)
+                offset = black_level(im, black_percent, step)
+                if offset > min(level, target) / 2.:
+                    offset = 0
+            logger.debug('Shutter %f, highlight level %d, black level %d' % (shutter, level, offset))
+            if level >= maxval:
+                #saturated, response is unknown, so reduce by a large factor, 
+                #or to the geometric mean with the last unsaturated shutter
+                new = shutter * 0.1 if previous is None else np.sqrt(shutter * previous[0])
             else:
-                if shutter == shutter_max:
-                    return shutter
-                shutter = min(shutter*2,shutter_max) 
-    
+                best = shutter
+                if abs(level - target) <= tolerance * target:
+                    break
+                new = shutter * (target - offset) / max(level - offset, 1.)
+                if previous is not None and previous[0] != shutter:
+                    slope = (level - previous[1]) / (shutter - previous[0])
+                    if slope > 0:
+                        new = shutter + (target - level) / slope
+                previous = shutter, level
+            new = min(max(new, shutter_min), shutter_max)
+            if new == shutter:
+                break
+            shutter = new
+        return best
     
     def __del__(self):
         try:
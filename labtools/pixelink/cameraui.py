@@ -16,12 +16,14 @@ import enthought.traits.ui.api as ui
 
 
 import enthought.pyface.api as pyface
+from enthought.pyface.timer.api import Timer
 
 from labtools.pixelink.camera import Camera, get_number_cameras
+from labtools.utils.frames import LatestFrame
 
 import matplotlib.pyplot as plt
 from scipy.misc.pilutil import toimage
-import numpy, os
+import numpy, os, time
 
 from labtools.utils.instrui import BaseSearchDeviceUI, device_search_group, status_group
 
@@ -160,6 +162,98 @@ class ROI(traits.HasTraits):
 
 
 
+class LiveView(traits.HasTraits):
+    """Live view of a streaming camera. The acquisition thread puts frames
+    (decimated, if specified) to a :class:`~labtools.utils.frames.LatestFrame` 
+    mailbox, and a timer pulls the latest frame and redraws the figure at its 
+    own refresh rate. A slow redraw only drops frames for display, never 
+    from the camera stream that is used for recording or analysis.
+    """
+    camera = traits.Instance(Camera, transient = True)
+    mailbox = traits.Instance(LatestFrame, (), transient = True)
+    
+    interval = traits.Range(10, 2000, 100, desc = 'display refresh interval in ms')
+    decimation = traits.Range(1, 16, 1, desc = 'display decimation (every n-th pixel)')
+    
+    start = traits.Button(desc = 'start live view action')
+    stop = traits.Button(desc = 'stop live view action')
+    running = traits.Bool(False, transient = True)
+    
+    display_rate = traits.Float(0., desc = 'displayed frames per second', transient = True)
+    dropped = traits.Int(0, desc = 'number of frames not displayed', transient = True)
+    
+    timer = traits.Any(transient = True)
+    _image = traits.Any(transient = True)
+    _t0 = traits.Float(0.)
+    #: whether streaming was started by the live view
+    _streaming = traits.Bool(False)
+    
+    view = ui.View(ui.HGroup(ui.Item('start', show_label = False, enabled_when = 'not running'),
+                             ui.Item('stop', show_label = False, enabled_when = 'running')),
+                   ui.Item('interval'),
+                   ui.Item('decimation'),
+                   ui.HGroup(ui.Item('display_rate', style = 'readonly', format_str = '%.1f'),
+                             ui.Item('dropped', style = 'readonly')))
+    
+    def _decimation_changed(self, value):
+        self.mailbox.step = value
+        
+    def _interval_changed(self, value):
+        if self.running:
+            self.timer.Start(value)
+        
+    def _start_fired(self):
+        self.start_view()
+        
+    def _stop_fired(self):
+        self.stop_view()
+            
+    def start_view(self):
+        """Starts camera streaming (if needed) and display timer"""
+        self.mailbox.step = self.decimation
+        if self.camera.streaming:
+            self.camera.mailbox = self.mailbox
+        else:
+            self.camera.start_streaming(mailbox = self.mailbox)
+            self._streaming = True
+        self._t0 = time.time()
+        self.mailbox.displayed = 0
+        try:
+            self.timer.Start(self.interval)
+        except AttributeError:
+            self.timer = Timer(self.interval, self._update)
+        self.running = True
+        
+    def stop_view(self):
+        """Stops display timer and removes the mailbox from the stream. 
+        Streaming is stopped if it was started by :meth:`start_view`."""
+        try:
+            self.timer.Stop()
+        except AttributeError:
+            pass
+        if self._streaming:
+            self.camera.stop_streaming()
+            self._streaming = False
+        elif self.camera.streaming:
+            self.camera.mailbox = None
+        self.running = False
+        
+    def _update(self):
+        frame = self.mailbox.get()
+        if frame is None:
+            return
+        if self._image is None or self._image.get_array().shape != frame.data.shape:
+            plt.figure()
+            self._image = plt.imshow(frame.data, cmap = 'gray', interpolation = 'nearest')
+            plt.show(block = False)
+        else:
+            self._image.set_data(frame.data)
+            self._image.figure.canvas.draw_idle()
+        t = time.time() - self._t0
+        if t > 0:
+            self.display_rate = self.mailbox.displayed / t
+        self.dropped = self.mailbox.dropped
+
 class CameraUI(traits.HasTraits):
     """Camera settings defines basic camera settings
     """
@@ -180,6 +274,7 @@ class CameraUI(traits.HasTraits):
     shutter = create_range_feature('shutter', desc = 'camera exposure time',transient = True)
     format = create_mapped_feature('format',_FORMAT, desc = 'image format',transient = True)
     roi = traits.Instance(ROI,transient = True)
+    live_view = traits.Instance(LiveView, transient = True)
     
     im_shape = traits.Property(depends_on = 'format.value,roi.values')
     im_dtype = traits.Property(depends_on = 'format.value')
@@ -202,6 +297,7 @@ class CameraUI(traits.HasTraits):
                         ui.Item('roi', style = 'custom'),
                         ui.HGroup(ui.Item('capture',show_label = False),
                         ui.Item('save_button',show_label = False)),
+                        ui.Item('live_view', style = 'custom', show_label = False),
                         enabled_when = 'is_initialized',
                         ),
                         ),
@@ -220,6 +316,9 @@ class CameraUI(traits.HasTraits):
     def _roi_default(self):
         return ROI()
         
+    def _live_view_default(self):
+        return LiveView(camera = self.camera_control)
+        
     #@display_cls_error 
     def _get_im_shape(self):
         top, left, width, height = self.roi.values
@@ -263,6 +362,7 @@ class CameraUI(traits.HasTraits):
     def _camera_changed(self):
         if self._is_initialized:
             self._is_initialized= False
+            self.live_view.stop_view()
             self.camera_control.close()
             self.message = 'Camera uninitialized'
     
@@ -279,6 +379,7 @@ class CameraUI(traits.HasTraits):
     def _on_off_fired(self):
         if self._is_initialized:
             self._is_initialized= False
+            self.live_view.stop_view()
             self.camera_control.close()
             self.message = 'Camera uninitialized'
         else:
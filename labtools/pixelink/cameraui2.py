@@ -26,6 +26,7 @@ from labtools.utils.instrui import BaseDeviceUI, device_group, device_search_gro
 from .PxLAPI import *
 from .PxLTypes import *
 from .PxLCodes import *
+from .cameraui import LiveView
 
 
 _NO_CAMERAS = 'No cameras found!'
@@ -177,6 +178,7 @@ class CameraUI(Camera,  BaseDeviceUI):
     shutter = create_range_feature('shutter', desc = 'camera exposure time',transient = True)
     format = create_mapped_feature('format',_FORMAT, desc = 'image format',transient = True)
     roi = traits.Instance(ROI,transient = True)
+    live_view = traits.Instance(LiveView, transient = True)
     
     im_shape = traits.Property(depends_on = 'format.value,roi.values')
     im_dtype = traits.Property(depends_on = 'format.value')
@@ -199,6 +201,7 @@ class CameraUI(Camera,  BaseDeviceUI):
                         ui.Item('roi', style = 'custom'),
                         ui.HGroup(ui.Item('capture',show_label = False),
                         ui.Item('save_button',show_label = False)),
+                        ui.Item('live_view', style = 'custom', show_label = False),
                         enabled_when = 'is_initialized',
                         ),
                         ),
@@ -217,6 +220,9 @@ class CameraUI(Camera,  BaseDeviceUI):
     def _roi_default(self):
         return ROI()
         
+    def _live_view_default(self):
+        return LiveView(camera = self)
+        
     #@display_cls_error 
     def _get_im_shape(self):
         top, left, width, height = self.roi.values
@@ -276,6 +282,7 @@ class CameraUI(Camera,  BaseDeviceUI):
     def _on_off_fired(self):
         if self._initialized:
             self._initialized= False
+            self.live_view.stop_view()
             self.close()
             self.message = 'Camera uninitialized'
         else:
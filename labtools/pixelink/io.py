@@ -9,11 +9,16 @@ This module defines some functions for pixelink data IO
 
 * :func:`open_bw` Use this to open pixelink raw data
 * :func:`open_pds` Use this to read pixelink data stream (video)
-* :func:`pds_to_avi` Use this to convert pds video to AVI.
+* :func:`pds_to_avi` Use this to convert pds video to AVI (without the
+  pixelink SDK, see :mod:`labtools.utils.avi`).
+* :func:`pds_to_npy` and :func:`pds_to_hdf5` convert pds video to array stacks,
+  without the pixelink SDK.
 
 """
-import struct
+import struct, threading
+from queue import Queue, Full
 from numpy import memmap, dtype, fromfile
+from numpy.lib.format import open_memmap
 import numpy as np
 import os
 
@@ -73,7 +78,79 @@ FRAME_DESC_DTYPE = dtype([\
         ('Decimation', 'float32'),
         ('PixelFormat', 'float32'),
         ('ExtendedShutter', 'float32', (PXL_MAX_KNEE_POINTS,)),
-        ('AutoROI','float32', (4,))])
+        ('AutoROI','float32', (4,))]).newbyteorder(ENDIAN)
+
+#: byte order of image data in the stream (data is stored byte-swapped)
+DATA_ENDIAN = '>'
+
+#: extension of the frame index file, stored next to the pds file
+INDEX_EXT = '.index.npz'
+
+def frame_format(desc):
+    """Returns (shape, dtype) of image data of a given frame descriptor.
+    dtype is native; data in the stream is stored in :data:`DATA_ENDIAN` order.
+    """
+    decimation = int(desc['Decimation']) or 1
+    shape = int(desc['ROI'][3]) // decimation, int(desc['ROI'][2]) // decimation #height, width
+    try:
+        color, dt = PIXEL_FORMAT[int(desc['PixelFormat'])]
+    except KeyError:
+        raise ValueError('Unknown pixlenik format "%i", only RGB and Mono supported' % int(desc['PixelFormat']))    
+    if color == 'rgb':
+        shape = shape + (3,)
+    return shape, dt
+
+def build_index(filename):
+    """Scans pds file and returns (offsets, descriptors) arrays. Offsets 
+    are positions of frame descriptors (with an extra element, the end of the 
+    last frame) and descriptors is a structured array of 
+    :data:`FRAME_DESC_DTYPE`. Only descriptors are read, image data is skipped.
+    """
+    with open(filename, 'rb') as f:
+        magic, n = struct.unpack(HEADER, f.read(8))
+        if magic != 0x04040404:
+            raise IOError('Not a valid psd file')
+        offsets = np.empty(n + 1, dtype = 'int64')
+        descriptors = np.empty(n, dtype = FRAME_DESC_DTYPE)
+        offset = f.tell()
+        for i in range(n):
+            offsets[i] = offset
+            f.seek(offset)
+            data = f.read(FRAME_DESC_DTYPE.itemsize)
+            if len(data) != FRAME_DESC_DTYPE.itemsize:
+                raise IOError('Unexpected end of file at frame %d' % i)
+            descriptors[i] = np.frombuffer(data, dtype = FRAME_DESC_DTYPE)[0]
+            shape, dt = frame_format(descriptors[i])
+            offset += int(descriptors[i]['Size']) + int(np.prod(shape)) * dt.itemsize
+        offsets[n] = offset
+    return offsets, descriptors
+
+def index_filename(filename):
+    """Returns filename of the index file of a pds file"""
+    return filename + INDEX_EXT
+
+def load_index(filename):
+    """Loads index of a pds file (see :func:`build_index`), or builds it and
+    saves it to :func:`index_filename`. Saved index is rebuilt if pds file 
+    size or modification time has changed."""
+    stat = os.stat(filename)
+    fname = index_filename(filename)
+    try:
+        with np.load(fname) as data:
+            if int(data['size']) == stat.st_size and float(data['mtime']) == stat.st_mtime:
+                logger.debug('Using frame index %s' % fname)
+                return data['offsets'], data['descriptors']
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    logger.info('Building frame index of %s' % filename)
+    offsets, descriptors = build_index(filename)
+    try:
+        with open(fname, 'wb') as f:
+            np.savez(f, offsets = offsets, descriptors = descriptors, 
+                     size = stat.st_size, mtime = stat.st_mtime)
+    except (IOError, OSError):
+        logger.warning('Could not write frame index %s' % fname)
+    return offsets, descriptors
 
 def open_bw(filename, size=(1024,1280), bits = 10,  data_offset = 0, as_float = False, order = ENDIAN):
     """
@@ -107,19 +184,66 @@ def open_bw(filename, size=(1024,1280), bits = 10,  data_offset = 0, as_float =
         a = a / (2** bits - 1.)
     return a
 
-def pds_to_avi(pdsname, aviname = None):
+def pds_to_avi(pdsname, aviname = None, codec = 'raw', frame_rate = None, 
+               low = None, high = None, chunk_size = 16, use_sdk = False, **kw):
     """Converts pixelink data stream file to avi file.
     if aviname is not specified it is determined from input filename
-    """
-    from .PxLAPI import PxLFormatClip #import it here to report warnings here if SDK not installed
-    from .PxLCodes import ERRORS
     
+    Frames are written with :class:`~labtools.utils.avi.AVIWriter`, so the 
+    pixelink SDK is not needed. 16 bit frames (and 8 bit frames, if low or 
+    high is given) are converted to 8 bit with a lookup table, see 
+    :func:`~labtools.analysis.image.lut.make_lut`.
+    
+    :param str codec:
+        'raw' (uncompressed) or 'mjpeg' (needs PIL)
+    :param float frame_rate:
+        frame rate, read from the first frame descriptor if not specified
+    :param low:
+        value displayed as black (0 by default)
+    :param high:
+        value displayed as white (maximum value of the data type by default)
+    :param int chunk_size:
+        number of frames read at once
+    :param bool use_sdk:
+        if True, the file is converted with PxLFormatClip of the pixelink 
+        SDK instead (other parameters are ignored)
+        
+    Other keyword arguments are passed to :class:`~labtools.utils.avi.AVIWriter`.
+    Returns the number of frames written (None if use_sdk).
+    """
     if aviname is None:
         aviname, ext = os.path.splitext(pdsname) 
         aviname = os.path.abspath(aviname + '.avi')
     pdsname = os.path.abspath(pdsname)
-        
     logger.info('Converting %s to %s.' % (pdsname, aviname))
+    if use_sdk:
+        _pds_to_avi_sdk(pdsname, aviname)
+        return
+    
+    from labtools.utils.avi import AVIWriter
+    from labtools.analysis.image.lut import make_lut
+    stream = _open_constant_stream(pdsname)
+    if len(stream) == 0:
+        raise ValueError('%s has no frames' % pdsname)
+    dt = stream.frames.dtype.newbyteorder('=')
+    if frame_rate is None:
+        frame_rate = float(stream.frame_descriptors[0]['FrameRate'])
+        if frame_rate <= 0:
+            frame_rate = 25.
+    convert = None
+    if dt.itemsize > 1 or low is not None or high is not None:
+        size = 2 ** (8 * dt.itemsize)
+        table = make_lut(low or 0, size - 1 if high is None else high, size)[:,0]
+        convert = table.take
+    with AVIWriter(aviname, frame_rate, codec, convert = convert, **kw) as writer:
+        for i, desc, frames in _read_chunks(stream, 0, chunk_size):
+            for frame in frames:
+                writer.write(frame)
+    return writer.frames
+    
+def _pds_to_avi_sdk(pdsname, aviname):
+    from .PxLAPI import PxLFormatClip #import it here to report warnings here if SDK not installed
+    from .PxLCodes import ERRORS
     ret = PxLFormatClip(pdsname,aviname, CLIP_FORMAT_AVI)
 
     if ret != 0:
@@ -127,6 +251,135 @@ def pds_to_avi(pdsname, aviname = None):
         logger.error(msg)
         raise ERRORS.get(ret)(msg)
     
+
+def _read_chunks(stream, start, chunk_size, depth = 4):
+    #reads chunks of native order frames in a background thread, so that 
+    #reading overlaps with writing. Yields (index, descriptors, frames)
+    queue = Queue(depth)
+    stop = threading.Event()
+    frames, descriptors = stream.frames, stream.frame_descriptors
+    native = frames.dtype.newbyteorder('=')
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout = 0.1)
+                return
+            except Full:
+                pass
+                
+    def reader():
+        try:
+            for i in range(start, len(frames), chunk_size):
+                if stop.is_set():
+                    break
+                put((i, np.array(descriptors[i:i+chunk_size]), frames[i:i+chunk_size].astype(native)))
+        except Exception as e:
+            put(e)
+        finally:
+            put(None)
+            
+    thread = threading.Thread(target = reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def _open_constant_stream(pdsname):
+    stream = PixelinkDataStream()
+    stream.open(pdsname)
+    if not stream.is_constant:
+        raise ValueError('Frames of %s differ in size or format, cannot convert to a stack' % pdsname)
+    return stream
+
+def pds_to_npy(pdsname, npyname = None, chunk_size = 64, resume = True):
+    """Converts pixelink data stream file to a .npy stack of (n_frames, height, width)
+    native order frames and a <name>_desc.npy structured array of frame 
+    descriptors. Output is memory-mappable with numpy.load(npyname, mmap_mode = 'r').
+    Reading and writing run in separate threads. Does not need the pixelink SDK.
+    
+    :param str pdsname:
+        input filename
+    :param str npyname:
+        output filename, determined from input filename if not specified
+    :param int chunk_size:
+        number of frames read and written at once
+    :param bool resume:
+        if True, an interrupted conversion (see <npyname>.progress file) is 
+        continued, else it is started from the beginning
+    :returns:
+        output filename
+    """
+    if npyname is None:
+        npyname = os.path.splitext(pdsname)[0] + '.npy'
+    stream = _open_constant_stream(pdsname)
+    shape, dt = stream.frames.shape, stream.frames.dtype.newbyteorder('=')
+    progress = npyname + '.progress'
+    start = 0
+    if resume and os.path.exists(progress) and os.path.exists(npyname):
+        with open(progress) as f:
+            start = int(f.read() or 0)
+        out = open_memmap(npyname, mode = 'r+')
+        if out.shape != shape or out.dtype != dt:
+            start, out = 0, None
+    else:
+        out = None
+    if out is None:
+        out = open_memmap(npyname, mode = 'w+', dtype = dt, shape = shape)
+    logger.info('Converting %s to %s, starting at frame %d.' % (pdsname, npyname, start))
+    np.save(os.path.splitext(npyname)[0] + '_desc.npy', np.array(stream.frame_descriptors))
+    for i, desc, frames in _read_chunks(stream, start, chunk_size):
+        out[i:i+len(frames)] = frames
+        out.flush()
+        with open(progress, 'w') as f:
+            f.write(str(i + len(frames)))
+    del out
+    if os.path.exists(progress):
+        os.remove(progress)
+    return npyname
+
+def pds_to_hdf5(pdsname, h5name = None, chunk_size = 64, compression = None, resume = True):
+    """Converts pixelink data stream file to a HDF5 file with a 'frames' 
+    dataset, chunked by frame, and a 'descriptors' dataset. Needs h5py.
+    
+    :param str compression:
+        per-frame compression, e.g. 'gzip' or 'lzf', or None
+        
+    See :func:`pds_to_npy` for other parameters. Progress of an interrupted 
+    conversion is stored in the 'frames_done' attribute of the frames dataset.
+    """
+    import h5py #import it here, so that h5py is needed only for this function
+    if h5name is None:
+        h5name = os.path.splitext(pdsname)[0] + '.h5'
+    stream = _open_constant_stream(pdsname)
+    shape, dt = stream.frames.shape, stream.frames.dtype.newbyteorder('=')
+    mode = 'a' if resume else 'w'
+    with h5py.File(h5name, mode) as f:
+        dataset = f.get('frames')
+        if dataset is None or dataset.shape != shape or dataset.dtype != dt:
+            for name in ('frames', 'descriptors'):
+                if name in f:
+                    del f[name]
+            dataset = f.create_dataset('frames', shape = shape, dtype = dt, 
+                                       chunks = (1,) + shape[1:], compression = compression)
+            dataset.attrs['frames_done'] = 0
+            f.create_dataset('descriptors', data = np.array(stream.frame_descriptors))
+        start = int(dataset.attrs.get('frames_done', 0))
+        logger.info('Converting %s to %s, starting at frame %d.' % (pdsname, h5name, start))
+        for i, desc, frames in _read_chunks(stream, start, chunk_size):
+            dataset[i:i+len(frames)] = frames
+            dataset.attrs['frames_done'] = i + len(frames)
+            f.flush()
+    return h5name
                                                                                                     
 def open_pds(fname):
    """Returns an :class:`PixelinkDataStream` object that can then be used as an iterator
@@ -168,19 +421,39 @@ class PixelinkDataStream(object):
     >>> desc, im = stream.get_frame(0) #get first frame descriptor and image array
     >>> desc, im = stream.get_frame(-1) #get last frame
     
+    For random access in large files, open with index = True. Offsets and 
+    descriptors of all frames are then read in one pass (or loaded from the 
+    index file, saved next to the pds file) and stored in :attr:`descriptors`.
+    
+    >>> stream.open('test.pds', index = True)
+    >>> n = len(stream.descriptors)
+    
+    If all frames have the same ROI, decimation and pixel format, the whole
+    stream can be accessed as a single (n_frames x height x width) array, 
+    with descriptors in a parallel structured array. Both are views of one
+    memmap, so only the sliced data is read from disk:
+    
+    >>> if stream.is_constant: 
+    ...     frames = stream.frames[1000:2000, 100:200, :]
+    ...     times = stream.frame_descriptors['FrameTime'][1000:2000]
     """
+    #: structured array of all frame descriptors, if opened with index = True
+    descriptors = None
+    _views = None
     
-    def open(self, filename):
-        """Opens filename for reading. This function reads frame dexcriptions
-        of all frames and fills frame_desc attributes
+    def open(self, filename, index = False):
+        """Opens filename for reading. 
         
         :param str filename:
             filename string
+        :param bool index:
+            if True, it reads (or loads from index file) offsets and 
+            descriptors of all frames, see :func:`load_index`
         :raises:
             IOError fi it is not a valid pds file
         """
         logger.info('Opening pixelink data stream file %s' % filename)
-        with open(filename,'r') as f:
+        with open(filename,'rb') as f:
             magic, n = struct.unpack(HEADER, f.read(8))
             if magic != 0x04040404:
                 raise IOError('Not a valid psd file')
@@ -188,6 +461,11 @@ class PixelinkDataStream(object):
             self._n = n # number of frames
             self._offsets = {0 : f.tell()} #storres offset info of each frame
             self._index = 0 # current running index (for get_frame, next methods)
+            self.descriptors = None
+            self._views = None
+        if index:
+            offsets, self.descriptors = load_index(filename)
+            self._offsets = dict(enumerate(offsets.tolist()))
             
     def get_frame(self, index = None):
         """Returns a frame. If no argument is scpecified it will return next frame.
@@ -225,24 +503,89 @@ class PixelinkDataStream(object):
                 desc, im = self._get_frame(offset)
             return desc, im 
         
+    def _read_descriptor(self, offset):
+        with open(self._filename, 'rb') as f:
+            f.seek(offset)
+            return fromfile(f, dtype = FRAME_DESC_DTYPE, count = 1).reshape(())
+    
+    def _geometry(self):
+        #returns (stride, shape, dtype) if all frames have the same geometry, else None
+        if self._n == 0:
+            return None
+        first = self._offsets[0]
+        desc = self.descriptors[0] if self.descriptors is not None else self._read_descriptor(first)
+        shape, dt = frame_format(desc)
+        stride = int(desc['Size']) + int(np.prod(shape)) * dt.itemsize
+        if self.descriptors is not None:
+            d = self.descriptors
+            if not (np.all(d['ROI'] == desc['ROI']) and np.all(d['Decimation'] == desc['Decimation']) and
+                    np.all(d['PixelFormat'] == desc['PixelFormat']) and np.all(d['Size'] == desc['Size'])):
+                return None
+        else:
+            #check file size and geometry of the last frame
+            if os.path.getsize(self._filename) != first + self._n * stride:
+                return None
+            last = self._read_descriptor(first + (self._n - 1) * stride)
+            if int(last['Size']) != int(desc['Size']) or frame_format(last) != (shape, dt):
+                return None
+        return stride, shape, dt
+    
+    def _get_views(self):
+        if self._views is None:
+            geometry = self._geometry()
+            if geometry is None:
+                raise ValueError('Frames of %s do not have the same geometry' % self._filename)
+            stride, shape, dt = geometry
+            first = self._offsets[0]
+            data = np.memmap(self._filename, dtype = 'uint8', mode = 'r')
+            descriptors = np.ndarray((self._n,), dtype = FRAME_DESC_DTYPE, buffer = data, 
+                                     offset = first, strides = (stride,))
+            #image data is stored byte-swapped; a non-native dtype view avoids a copy
+            dt = dt.newbyteorder(DATA_ENDIAN)
+            image_strides = tuple(np.empty(shape, dtype = dt).strides)
+            frames = np.ndarray((self._n,) + shape, dtype = dt, buffer = data,
+                                offset = first + int(descriptors[0]['Size']), 
+                                strides = (stride,) + image_strides)
+            self._views = descriptors, frames
+        return self._views
+    
+    @property
+    def is_constant(self):
+        """True if all frames have the same size and format, so that 
+        :attr:`frames` can be used."""
+        try:
+            self._get_views()
+            return True
+        except ValueError:
+            return False
+    
+    @property
+    def frames(self):
+        """A read-only (n_frames x height x width) view of all image data.
+        Raises ValueError if frames differ in size or format"""
+        return self._get_views()[1]
+    
+    @property
+    def frame_descriptors(self):
+        """A read-only structured array view of all frame descriptors, 
+        parallel to :attr:`frames`"""
+        return self._get_views()[0]
+        
     def _get_frame(self, offset):
         """Reads description info and frame at a given offset
         """
-        with open(self._filename) as f:
-            logger.debug('Opening image descriptior at %i' % offset)
-            f.seek(offset)
-            desc = fromfile(f, dtype = FRAME_DESC_DTYPE, count = 1).newbyteorder(ENDIAN).reshape(()) # change byteorder and make it 0 dimensional
-            im_shape = int(desc['ROI'][3]/desc['Decimation']), int(desc['ROI'][2]/desc['Decimation']) #height, width
-            try:
-                color, dt = PIXEL_FORMAT[int(desc['PixelFormat'])]
-                if color == 'rgb':
-                    im_shape = im_shape + (3,)
-            except KeyError:
-                raise ValueError('Unknown pixlenik format "%i", only RGB and Mono supported' % int(desc['PixelFormat']))    
-        offset += desc['Size']
+        if self.descriptors is not None:
+            desc = self.descriptors[self._index]
+        else:
+            with open(self._filename, 'rb') as f:
+                logger.debug('Opening image descriptior at %i' % offset)
+                f.seek(offset)
+                desc = fromfile(f, dtype = FRAME_DESC_DTYPE, count = 1).reshape(()) # make it 0 dimensional
+        im_shape, dt = frame_format(desc)
+        offset += int(desc['Size'])
         logger.debug('Opening image data at %i' % offset)
-        #first change byte order to pixelink byteorder, then swap (because strem is in swapped order!)
-        im = np.memmap(self._filename, dtype = dt, mode = 'c', shape = im_shape, offset = offset ).newbyteorder(ENDIAN).byteswap()
+        #stream is in swapped order, convert to native order
+        im = np.memmap(self._filename, dtype = dt.newbyteorder(DATA_ENDIAN), mode = 'r', shape = im_shape, offset = offset).astype(dt)
         self._index += 1
         self._offsets[self._index] = offset + im.size * im.dtype.itemsize 
         return desc, im
@@ -256,4 +599,7 @@ class PixelinkDataStream(object):
         
     def __iter__(self):
         self._index = 0
-        return self
\ No newline at end of file
+        return self
+        
+    def __len__(self):
+        return self._n
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+.. module:: pixelink.recorder
+   :synopsis: Pixelink data stream recorder
+
+Records frames to pixelink data stream (pds) files without the pixelink SDK,
+so that frames that are analyzed live can also be stored.
+
+* :func:`make_descriptor` creates a frame descriptor for an image
+* :class:`Recorder` writes frames to a pds file in a background thread
+* :func:`record_camera` records frames of a streaming camera
+
+Files have the same header, :data:`~.io.FRAME_DESC_DTYPE` descriptors and
+byte-swapped image data as files written by the SDK, so they can be opened
+with :func:`~.io.open_pds`.
+
+Frames are serialized into a pool of large blocks (one copy per frame).
+Full blocks are written by the writer thread, so that all writes but the
+last one are of the same size and aligned to the block size in the file.
+If all blocks are queued for writing (disk is slower than the camera),
+:meth:`Recorder.add` waits (back-pressure), or drops the frame if called with
+block = False.
+
+>>> import os, tempfile
+>>> import numpy as np
+>>> from labtools.pixelink.io import open_pds
+>>> fname = os.path.join(tempfile.mkdtemp(), 'test.pds')
+>>> recorder = Recorder(fname, block_size = 4096)
+>>> recorder.start()
+>>> for i in range(10):
+...     ok = recorder.add(None, np.full((20,30), i, dtype = 'uint16'))
+>>> stats = recorder.stop()
+>>> stats['frames'], stats['dropped']
+(10, 0)
+>>> stream = open_pds(fname)
+>>> desc, im = stream.get_frame(-1)
+>>> len(stream), int(desc['FrameNumber']), im.shape, int(im[0,0])
+(10, 9, (20, 30), 9)
+
+Frames that need more blocks than are free are dropped as a whole:
+
+>>> recorder = Recorder(os.path.join(tempfile.mkdtemp(), 'test.pds'), block_size = 4096, queue_size = 1)
+>>> recorder.add(None, np.zeros((64,64), dtype = 'uint16'), block = False) #needs 3 blocks, 2 are free
+False
+>>> recorder.stop()['dropped']
+1
+"""
+
+import struct, threading, time
+from queue import Queue, Empty
+import numpy as np
+
+from labtools.log import create_logger
+from labtools.pixelink.conf import LOGLEVEL
+from .PxLTypes import PIXEL_FORMAT_MONO8, PIXEL_FORMAT_MONO16, \
+    PIXEL_FORMAT_RGB24, PIXEL_FORMAT_RGB48
+from .io import HEADER, FRAME_DESC_DTYPE, DATA_ENDIAN
+
+logger = create_logger(__name__, LOGLEVEL)
+
+#: magic number of the pds header
+MAGIC = 0x04040404
+
+#: pixel formats of (color, itemsize)
+_FORMATS = {('gray', 1) : PIXEL_FORMAT_MONO8,
+            ('gray', 2) : PIXEL_FORMAT_MONO16,
+            ('rgb', 1) : PIXEL_FORMAT_RGB24,
+            ('rgb', 2) : PIXEL_FORMAT_RGB48}
+
+def make_descriptor(data, frame_number = 0, frame_time = 0.):
+    """Returns a one-element :data:`~.io.FRAME_DESC_DTYPE` array, describing
+    image data (a 2D gray or a 3D rgb image of 8 or 16 bit integers)."""
+    color = 'rgb' if data.ndim == 3 else 'gray'
+    try:
+        format = _FORMATS[(color, data.dtype.itemsize)]
+    except KeyError:
+        raise ValueError('Unsupported image dtype %s' % data.dtype)
+    desc = np.zeros(1, dtype = FRAME_DESC_DTYPE)
+    desc['Size'] = FRAME_DESC_DTYPE.itemsize
+    desc['FrameNumber'] = frame_number
+    desc['FrameTime'] = frame_time
+    desc['ROI'] = [0, 0, data.shape[1], data.shape[0]]
+    desc['Decimation'] = 1
+    desc['PixelFormat'] = format
+    return desc
+
+class Recorder(threading.Thread):
+    """A thread that writes frames to a pds file.
+
+    :param str filename:
+        output filename
+    :param int block_size:
+        size of writes in bytes, should be a multiple of the disk block size
+    :param int queue_size:
+        number of blocks that can wait for writing
+    """
+    def __init__(self, filename, block_size = 4 * 1024 * 1024, queue_size = 8):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.block_size = block_size
+        self._free = Queue()
+        for i in range(queue_size + 1):
+            self._free.put(np.empty(block_size, dtype = 'uint8'))
+        self._full = Queue()
+        self._block = None
+        self._position = 0
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.error = None
+        self._t0 = None
+        self._t1 = None
+        self._file = open(filename, 'wb', buffering = 0)
+
+    def _next_block(self, block):
+        #returns a free block, or None if there is none and block is False
+        try:
+            return self._free.get(block)
+        except Empty:
+            return None
+
+    def _write_bytes(self, data):
+        data = memoryview(data).cast('B')
+        while len(data):
+            n = min(len(data), self.block_size - self._position)
+            self._block[self._position:self._position + n] = data[:n]
+            self._position += n
+            data = data[n:]
+            if self._position == self.block_size:
+                self._full.put(self._block)
+                self._block = self._free.get()
+                self._position = 0
+
+    def add(self, descriptor, data, block = True):
+        """Adds a frame. Descriptor is a :data:`~.io.FRAME_DESC_DTYPE` array
+        (or None, to create one with :func:`make_descriptor`), data is image
+        data. Data is copied, so buffers can be reused after the call.
+        If block is False and no buffer space is available, the frame is
+        dropped. Returns True if the frame was added."""
+        if self.error is not None:
+            raise self.error
+        if self._t0 is None:
+            self._t0 = time.time()
+        if self._block is None:
+            self._block = self._next_block(block)
+            if self._block is None:
+                self.dropped += 1
+                return False
+            if self.frames == 0 and self._position == 0:
+                #header is written with 0 frames, and updated when closed
+                self._write_bytes(struct.pack(HEADER, MAGIC, 0))
+        if not block:
+            #number of extra blocks needed for this frame, checked before
+            #anything is written, so that _write_bytes does not wait
+            needed = (self._position + FRAME_DESC_DTYPE.itemsize + data.nbytes) // self.block_size
+            if needed > self._free.qsize():
+                self.dropped += 1
+                return False
+        if descriptor is None:
+            descriptor = make_descriptor(data, self.frames, time.time() - self._t0)
+        descriptor = np.asarray(descriptor, dtype = FRAME_DESC_DTYPE)
+        data = np.ascontiguousarray(data, dtype = data.dtype.newbyteorder(DATA_ENDIAN))
+        self._write_bytes(descriptor)
+        self._write_bytes(data)
+        self.frames += 1
+        return True
+
+    def run(self):
+        try:
+            while True:
+                block = self._full.get()
+                if block is None:
+                    break
+                self._file.write(block)
+                self.bytes += len(block)
+                self._free.put(block)
+        except Exception as e:
+            self.error = e
+            logger.error('Error writing %s: %s' % (self.filename, e))
+            #release waiting producers
+            while True:
+                block = self._full.get()
+                if block is None:
+                    break
+                self._free.put(block)
+
+    def stop(self):
+        """Writes the remaining data, updates the header and closes the file.
+        Returns :meth:`statistics`."""
+        self._full.put(None)
+        if self.is_alive():
+            self.join()
+        try:
+            if self.error is None:
+                if self._block is not None:
+                    self._file.write(self._block[0:self._position])
+                    self.bytes += self._position
+                else:
+                    self._file.write(struct.pack(HEADER, MAGIC, 0))
+                self._file.seek(0)
+                self._file.write(struct.pack(HEADER, MAGIC, self.frames))
+        finally:
+            self._file.close()
+            self._block = None
+        self._t1 = time.time()
+        stats = self.statistics()
+        logger.info('Recorded %(frames)d frames (%(dropped)d dropped) at %(rate).1f MB/s' % stats)
+        if self.error is not None:
+            raise self.error
+        return stats
+
+    def statistics(self):
+        """Returns a dict of frames, dropped frames, bytes written, number of
+        queued blocks, time and sustained write rate in MB/s"""
+        if self._t0 is None:
+            t = 0.
+        else:
+            t = (self._t1 or time.time()) - self._t0
+        return dict(frames = self.frames, dropped = self.dropped, bytes = self.bytes,
+                    queued = self._full.qsize(), time = t,
+                    rate = self.bytes / t / 1e6 if t > 0 else 0.)
+
+def record_camera(camera, filename, n_frames, callback = None, **kw):
+    """Records n_frames of a streaming :class:`~labtools.pixelink.camera.Camera`
+    to filename. Streaming is started, if it is not running. If callback is
+    given, it is called with each :class:`~labtools.utils.frames.Frame` after
+    it is added to the recorder, for live analysis of the recorded frames.
+    Other keyword arguments are passed to :class:`Recorder`. Returns
+    :meth:`Recorder.statistics`.
+
+    >>> import os, tempfile
+    >>> from labtools.pixelink._test.camera import SimulatedCamera
+    >>> c = SimulatedCamera(frame_rate = 500.)
+    >>> c.init()
+    >>> c.set_camera(roi = [0, 0, 64, 48])
+    >>> fname = os.path.join(tempfile.mkdtemp(), 'test.pds')
+    >>> stats = record_camera(c, fname, 20, block_size = 64 * 1024)
+    >>> stats['frames']
+    20
+    >>> c.close()
+    """
+    if not camera.streaming:
+        camera.start_streaming()
+    recorder = Recorder(filename, **kw)
+    recorder.start()
+    try:
+        for i in range(n_frames):
+            frame = camera.get_frame()
+            recorder.add(frame.descriptor, frame.data)
+            if callback is not None:
+                callback(frame)
+    finally:
+        stats = recorder.stop()
+    return stats
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,234 @@
+"""
+Streaming AVI writer.
+
+* :class:`AVIWriter` writes frames to an uncompressed or MJPEG AVI file
+  incrementally
+* :func:`write_avi` writes all frames of an iterator
+
+Frames are 2D uint8 gray images or (height, width, 3) uint8 RGB images, all
+of the same shape. Frames are encoded in a pool of worker threads and written
+in order. At most a few frames per worker are kept in memory, and the frame
+index is spooled to a temporary file, so memory use does not depend on the
+number of frames. MJPEG encoding needs PIL (Pillow), uncompressed AVI has no
+dependencies. Files are AVI 1.0 files, limited to 4 GB.
+
+>>> import os, tempfile
+>>> import numpy as np
+>>> fname = os.path.join(tempfile.mkdtemp(), 'test.avi')
+>>> frames = (np.full((48, 64), i, dtype = 'uint8') for i in range(10))
+>>> write_avi(fname, frames, frame_rate = 10.)
+10
+>>> info = read_info(fname)
+>>> info['frames'], info['width'], info['height'], info['codec']
+(10, 64, 48, 'raw')
+"""
+
+import struct, tempfile, os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+
+#: supported codecs
+CODECS = ('raw', 'mjpeg')
+
+#: AVI main header flag; file has an index
+AVIF_HASINDEX = 0x10
+#: index flag; frame is a key frame
+AVIIF_KEYFRAME = 0x10
+
+#: maximum file size of an AVI 1.0 file
+MAX_SIZE = 2**32 - 1
+
+#: size of the headers, up to the 'movi' list data
+_HEADER_SIZE = 12 + 12 + 8 + 56 + 12 + 8 + 56 + 8 + 40 + 12
+
+_GRAY_PALETTE = np.repeat(np.arange(256, dtype = 'uint8'), 4).reshape(256, 4)
+_GRAY_PALETTE[:,3] = 0
+
+def _chunk(fourcc, data):
+    return struct.pack('<4sI', fourcc, len(data)) + data
+
+def encode_raw(frame):
+    """Returns frame data of an uncompressed AVI (bottom-up rows, padded to
+    4 bytes, BGR for color images)"""
+    if frame.ndim == 3:
+        frame = frame[::-1, :, ::-1]
+    else:
+        frame = frame[::-1]
+    row = frame.shape[1] * (3 if frame.ndim == 3 else 1)
+    pad = -row % 4
+    data = np.ascontiguousarray(frame).reshape(frame.shape[0], row)
+    if pad:
+        data = np.hstack((data, np.zeros((data.shape[0], pad), dtype = 'uint8')))
+    return data.tobytes()
+
+def encode_jpeg(frame, quality = 90):
+    """Returns JPEG encoded frame. Needs PIL."""
+    from PIL import Image #import it here, so that PIL is needed only for mjpeg
+    f = BytesIO()
+    Image.fromarray(frame).save(f, 'JPEG', quality = quality)
+    return f.getvalue()
+
+class AVIWriter(object):
+    """Writes frames to an AVI file.
+
+    :param str filename:
+        output filename
+    :param float frame_rate:
+        frame rate in frames per second
+    :param str codec:
+        'raw' (uncompressed) or 'mjpeg', see :data:`CODECS`
+    :param int quality:
+        JPEG quality (1-95) for mjpeg codec
+    :param int workers:
+        number of encoding threads (number of CPUs by default)
+    :param convert:
+        optional function, that converts each frame to a uint8 image before
+        encoding, called in the encoding threads
+    """
+    def __init__(self, filename, frame_rate = 25., codec = 'raw', quality = 90,
+                 workers = None, convert = None):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec %s, use one of %s' % (codec, CODECS))
+        if codec == 'mjpeg':
+            import PIL #fail early, if PIL is missing
+        self.filename = filename
+        self.frame_rate = frame_rate
+        self.codec = codec
+        self.quality = quality
+        self.convert = convert
+        self.workers = workers or os.cpu_count() or 1
+        self.frames = 0
+        self.shape = None
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._pending = deque()
+        self._file = open(filename, 'wb')
+        self._index = tempfile.TemporaryFile()
+        self._max_chunk = 0
+        self._movi_size = 4
+
+    def _encode(self, frame):
+        if self.convert is not None:
+            frame = self.convert(frame)
+        frame = np.asarray(frame)
+        if frame.dtype != 'uint8' or frame.shape != self.shape:
+            raise ValueError('Frame must be a uint8 array of shape %s' % (self.shape,))
+        if self.codec == 'mjpeg':
+            return encode_jpeg(frame, self.quality)
+        return encode_raw(frame)
+
+    def _header(self):
+        height, width = self.shape[0:2]
+        color = len(self.shape) == 3
+        scale, rate = 1000, int(round(self.frame_rate * 1000))
+        if self.codec == 'mjpeg':
+            handler, compression, bits = b'MJPG', b'MJPG', 24
+            size_image = width * height * 3
+        else:
+            handler, compression, bits = b'DIB ', b'\0\0\0\0', 24 if color else 8
+            size_image = ((width * bits // 8 + 3) // 4 * 4) * height
+        palette = b'' if bits == 24 else _GRAY_PALETTE.tobytes()
+        strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, bits, compression,
+                           size_image, 0, 0, len(palette) // 4, 0) + palette
+        avih = struct.pack('<14I', int(1e6 / self.frame_rate), 0, 0, AVIF_HASINDEX,
+                           self.frames, 0, 1, self._max_chunk, width, height, 0, 0, 0, 0)
+        strh = struct.pack('<4s4sIHHIIIIIIII4h', b'vids', handler, 0, 0, 0, 0, scale,
+                           rate, 0, self.frames, self._max_chunk, 0xFFFFFFFF, 0,
+                           0, 0, width, height)
+        strl = b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+        hdrl = b'hdrl' + _chunk(b'avih', avih) + _chunk(b'LIST', strl)
+        riff_size = 4 + 8 + len(hdrl) + 8 + self._movi_size + 8 + 16 * self.frames
+        return struct.pack('<4sI4s', b'RIFF', riff_size, b'AVI ') + _chunk(b'LIST', hdrl) + \
+               struct.pack('<4sI4s', b'LIST', self._movi_size, b'movi')
+
+    def _write_next(self):
+        #writes the oldest encoded frame
+        data = self._pending.popleft().result()
+        fourcc = b'00dc' if self.codec == 'mjpeg' else b'00db'
+        size = len(data)
+        padded = size + size % 2
+        if self._file.tell() + 8 + padded + 16 * (self.frames + 1) + 8 > MAX_SIZE:
+            raise IOError('AVI file size limit of 4 GB exceeded')
+        offset = self._movi_size #relative to the 'movi' fourcc
+        self._file.write(struct.pack('<4sI', fourcc, size))
+        self._file.write(data)
+        if padded != size:
+            self._file.write(b'\0')
+        self._index.write(struct.pack('<4sIII', fourcc, AVIIF_KEYFRAME, offset, size))
+        self._movi_size += 8 + padded
+        self._max_chunk = max(self._max_chunk, size)
+        self.frames += 1
+
+    def write(self, frame):
+        """Adds a frame for encoding. Encoded frames are written in order.
+        Blocks if too many frames are waiting for encoding."""
+        if self.shape is None:
+            shape = np.shape(self.convert(frame) if self.convert is not None else frame)
+            if len(shape) not in (2, 3) or (len(shape) == 3 and shape[2] != 3):
+                raise ValueError('Frames must be gray or RGB images')
+            self.shape = shape
+            self._header_size = len(self._header())
+            self._file.write(b'\0' * self._header_size)
+        while len(self._pending) >= 2 * self.workers:
+            self._write_next()
+        self._pending.append(self._pool.submit(self._encode, frame))
+
+    def close(self):
+        """Writes the remaining frames, the index and the final headers, and
+        closes the file. Returns the number of frames written."""
+        if self._file.closed:
+            return self.frames
+        try:
+            while self._pending:
+                self._write_next()
+            if self.shape is not None:
+                self._file.write(struct.pack('<4sI', b'idx1', 16 * self.frames))
+                self._index.seek(0)
+                while True:
+                    data = self._index.read(1024 * 1024)
+                    if not data:
+                        break
+                    self._file.write(data)
+                self._file.seek(0)
+                self._file.write(self._header())
+        finally:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._pool.shutdown()
+            self._index.close()
+            self._file.close()
+        return self.frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_avi(filename, frames, **kw):
+    """Writes all frames of an iterable to filename. Keyword arguments are
+    passed to :class:`AVIWriter`. Returns the number of frames written."""
+    with AVIWriter(filename, **kw) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return writer.frames
+
+def read_info(filename):
+    """Returns a dict of frames, width, height, frame_rate and codec of an
+    AVI file written by :class:`AVIWriter`"""
+    with open(filename, 'rb') as f:
+        data = f.read(_HEADER_SIZE + 4 * 256)
+    riff, size, avi = struct.unpack('<4sI4s', data[0:12])
+    if riff != b'RIFF' or avi != b'AVI ':
+        raise IOError('Not a valid avi file')
+    avih = struct.unpack('<14I', data[32:88])
+    strh = struct.unpack('<4s4sIHHIIIIIIII4h', data[108:164])
+    return dict(frames = avih[4], width = avih[8], height = avih[9],
+                frame_rate = strh[7] / float(strh[6]),
+                codec = 'mjpeg' if strh[1] == b'MJPG' else 'raw')
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,239 @@
+"""
+A least-recently-used cache for numpy data.
+
+* :class:`LRUCache` stores values up to a given number of items and/or a given
+  total size in bytes, evicting the least recently used values first.
+* :class:`ReadAheadCache` is an LRU cache of indexed items (video frames),
+  that reads items ahead of the requested ones in a background thread.
+
+>>> import numpy as np
+>>> cache = LRUCache(maxbytes = 2000)
+>>> cache.put('a', np.zeros(100)) # 800 bytes
+>>> cache.put('b', np.zeros(100))
+>>> cache.get('a') is not None # 'a' is now most recently used
+True
+>>> cache.put('c', np.zeros(100)) # 'b' is evicted
+>>> 'b' in cache, 'a' in cache, 'c' in cache
+(False, True, True)
+>>> cache.nbytes
+1600
+>>> cache.hits, cache.misses
+(1, 0)
+
+The cache is thread safe, so it can be filled from a background thread.
+
+:class:`ReadAheadCache` predicts the direction and step of access from the
+last two requests, and reads the next items in that direction:
+
+>>> frames = ReadAheadCache(lambda i: np.zeros(100) + i, 1000, depth = 4)
+>>> int(frames[10][0]), int(frames[12][0])
+(10, 12)
+>>> frames.wait()
+>>> [i in frames for i in (14, 16, 18, 20, 22)] # read ahead with step 2
+[True, True, True, True, False]
+>>> frames.close()
+"""
+
+from collections import OrderedDict
+from threading import RLock, Lock, Condition, Thread
+
+def sizeof(value):
+    """Returns size in bytes of a numpy array, or of a tuple/list of arrays.
+    Other objects are assumed to have no size.
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(sizeof(v) for v in value)
+    return int(getattr(value, 'nbytes', 0))
+
+class LRUCache(object):
+    """Least-recently-used cache.
+
+    :param int maxsize:
+        maximum number of stored items, or None for no limit
+    :param int maxbytes:
+        maximum total size (as computed by :func:`sizeof`), or None for no limit
+    """
+    def __init__(self, maxsize = None, maxbytes = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._lock = RLock()
+        #: total size of stored items in bytes
+        self.nbytes = 0
+        #: number of successful lookups
+        self.hits = 0
+        #: number of failed lookups
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        """Returns a list of keys, from least to most recently used"""
+        with self._lock:
+            return list(self._data.keys())
+
+    def get(self, key, default = None):
+        """Returns value of key and marks it as most recently used, or returns
+        default if key is not in the cache"""
+        with self._lock:
+            try:
+                value, size = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value, size
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size = None):
+        """Stores value. If size is not given, it is computed with :func:`sizeof`.
+        Values larger than maxbytes are not stored."""
+        if size is None:
+            size = sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = value, size
+            self.nbytes += size
+            self._evict()
+
+    def pop(self, key, default = None):
+        """Removes key and returns its value, or default if not found"""
+        with self._lock:
+            try:
+                value, size = self._data.pop(key)
+            except KeyError:
+                return default
+            self.nbytes -= size
+            return value
+
+    def clear(self):
+        """Removes all items"""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self._data and ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                              (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            key, (value, size) = self._data.popitem(last = False)
+            self.nbytes -= size
+
+class ReadAheadCache(LRUCache):
+    """LRU cache of items 0 ... length - 1, read by the read(index) function.
+    Items are accessed by indexing. After each request, up to depth items are
+    read in a background thread, continuing from the requested index with the
+    step (and direction) of the last two requests. A newer request cancels
+    the read-ahead of the previous one. Calls to read are serialized, so read
+    does not have to be thread safe.
+
+    :param read:
+        a function that returns item of a given index
+    :param int length:
+        number of items
+    :param int maxbytes:
+        maximum total size of cached items
+    :param int depth:
+        number of items to read ahead, 0 disables read-ahead
+    :param int max_step:
+        maximum predicted step; larger jumps are treated as random access,
+        and read-ahead continues with step 1 in the same direction
+    """
+    def __init__(self, read, length, maxbytes = 256 * 1024 * 1024, depth = 16, max_step = 16):
+        LRUCache.__init__(self, maxbytes = maxbytes)
+        self.read = read
+        self.length = length
+        self.depth = depth
+        self.max_step = max_step
+        #: predicted step between requests
+        self.step = 1
+        #: number of items read in the background
+        self.prefetched = 0
+        self._last = None
+        self._read_lock = Lock()
+        self._condition = Condition()
+        self._request = None
+        self._generation = 0
+        self._busy = False
+        self._closed = False
+        self._thread = None
+
+    def __len__(self):
+        return self.length
+
+    def _read(self, index):
+        with self._read_lock:
+            return self.read(index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('Index %d out of range' % index)
+        value = self.get(index)
+        if value is None:
+            value = self._read(index)
+            self.put(index, value)
+        if self._last is not None and index != self._last:
+            step = index - self._last
+            if abs(step) > self.max_step:
+                step = 1 if step > 0 else -1
+            self.step = step
+        self._last = index
+        if self.depth > 0:
+            self._schedule(index)
+        return value
+
+    def _schedule(self, index):
+        with self._condition:
+            self._generation += 1
+            self._request = index, self.step, self._generation
+            self._condition.notify_all()
+        if self._thread is None:
+            self._thread = Thread(target = self._worker)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self._closed:
+                    self._busy = False
+                    self._condition.notify_all()
+                    self._condition.wait()
+                if self._closed:
+                    return
+                index, step, generation = self._request
+                self._request = None
+                self._busy = True
+            for i in range(1, self.depth + 1):
+                j = index + i * step
+                if not 0 <= j < self.length or generation != self._generation or self._closed:
+                    break
+                if j not in self:
+                    self.put(j, self._read(j))
+                    self.prefetched += 1
+
+    def wait(self):
+        """Waits for the read-ahead to finish"""
+        with self._condition:
+            while self._thread is not None and (self._busy or self._request is not None):
+                self._condition.wait()
+
+    def close(self):
+        """Stops the read-ahead thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
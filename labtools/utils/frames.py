@@ -0,0 +1,287 @@
+"""
+Frame buffers for continuous image acquisition.
+
+* :class:`FrameRing` is a preallocated ring of frame buffers, with frame
+  descriptors, timestamps and frame numbers, written by one producer thread
+  and read by one consumer.
+* :class:`FrameGrabber` is a thread that fills a ring with a grab function.
+* :class:`LatestFrame` is a single-slot mailbox of the most recent frame, for
+  live display.
+
+The producer never waits for the consumer. If the consumer falls behind,
+the oldest unread frames are overwritten and counted in
+:attr:`FrameRing.dropped`:
+
+>>> import numpy as np
+>>> ring = FrameRing((2,3), 'uint16', size = 4)
+>>> def grab(buffer, descriptor):
+...     buffer[...] = 1
+>>> grabber = FrameGrabber(grab, ring, count = 10)
+>>> grabber.start()
+>>> grabber.join()
+>>> ring.written, ring.dropped
+(10, 6)
+>>> frame = ring.get()
+>>> frame.number, int(frame.data.sum())
+(6, 6)
+
+Frames are returned as views of the ring buffers (no copy). A frame view is
+valid until the next call to :meth:`FrameRing.get`. The producer never writes
+to the buffer of that frame, even if the ring is full:
+
+>>> ring = FrameRing((1,), 'int64', size = 4)
+>>> def put(value):
+...     buffer, descriptor = ring.acquire()
+...     buffer[0] = value
+...     ring.commit()
+>>> put(100)
+>>> frame = ring.get()
+>>> for value in range(101, 105):
+...     put(value)
+>>> int(frame.data[0]), ring.dropped, int(ring.get().data[0])
+(100, 1, 102)
+
+For display, the grabber can also put each frame (optionally decimated) to a
+:class:`LatestFrame` mailbox. The display pulls the most recent frame at its
+own rate; frames are dropped for display only, never from the ring:
+
+>>> ring = FrameRing((4,6), 'uint8', size = 4)
+>>> mailbox = LatestFrame(step = 2)
+>>> grabber = FrameGrabber(grab, ring, count = 3, mailbox = mailbox)
+>>> grabber.start()
+>>> grabber.join()
+>>> frame = mailbox.get()
+>>> frame.number, frame.data.shape, mailbox.dropped
+(2, (2, 3), 2)
+>>> mailbox.get() is None #no new frame
+True
+"""
+
+import threading, time
+from collections import namedtuple, deque
+import numpy as np
+
+#: a frame returned by :meth:`FrameRing.get`
+Frame = namedtuple('Frame', ['number', 'data', 'descriptor', 'timestamp'])
+
+class FrameRing(object):
+    """Ring buffer of size frames of a given shape and dtype.
+
+    :param tuple shape:
+        frame shape
+    :param dtype:
+        frame dtype
+    :param int size:
+        number of buffers, at least 3: one that is being written, one with
+        the frame that the consumer is currently using (never written) and 
+        at least one for unread frames.
+    :param descriptor_dtype:
+        dtype of frame descriptors (a structured dtype), or None
+    :param clock:
+        function that returns frame timestamps, time.time by default
+    """
+    def __init__(self, shape, dtype, size = 8, descriptor_dtype = None, clock = time.time):
+        if size < 3:
+            raise ValueError('Ring size must be at least 3')
+        self.size = size
+        self.buffers = np.zeros((size,) + tuple(shape), dtype = dtype)
+        self.descriptors = np.zeros(size, dtype = descriptor_dtype) if descriptor_dtype is not None else None
+        self.timestamps = np.zeros(size)
+        self.numbers = np.zeros(size, dtype = 'int64')
+        self.clock = clock
+        self._condition = threading.Condition()
+        #: number of frames written (committed) by the producer
+        self.written = 0
+        #: number of the next frame to be read
+        self.read = 0
+        #: number of frames overwritten before they were read
+        self.dropped = 0
+        #: number of frames skipped by :meth:`get_latest`
+        self.skipped = 0
+        self.closed = False
+        self._free = list(range(size)) #slots that can be written
+        self._queue = deque() #written, unread slots, oldest first
+        self._writing = None #slot returned by acquire
+        self._held = None #slot of the frame returned by get
+
+    @property
+    def shape(self):
+        return self.buffers.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.buffers.dtype
+
+    @property
+    def pending(self):
+        """Number of frames written, but not yet read"""
+        return self.written - self.read
+
+    def acquire(self):
+        """Returns (buffer, descriptor) of the slot that the producer should
+        fill next. If the ring is full, the oldest unread frame is dropped 
+        and its slot is reused."""
+        with self._condition:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = self._queue.popleft()
+                self.read += 1
+                self.dropped += 1
+            self._writing = slot
+        descriptor = self.descriptors[slot:slot+1] if self.descriptors is not None else None
+        return self.buffers[slot], descriptor
+
+    def commit(self, timestamp = None):
+        """Marks the slot returned by :meth:`acquire` as written. Returns
+        (number, timestamp) of the frame."""
+        with self._condition:
+            slot, self._writing = self._writing, None
+            self.timestamps[slot] = self.clock() if timestamp is None else timestamp
+            self.numbers[slot] = self.written
+            self.written += 1
+            self._queue.append(slot)
+            self._condition.notify_all()
+            return int(self.numbers[slot]), self.timestamps[slot]
+
+    def close(self):
+        """Wakes up waiting consumers; no more frames will be written"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _release(self):
+        #returns the held slot to the free slots
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+
+    def get(self, timeout = None):
+        """Returns the next unread :class:`Frame`, waiting for it at most
+        timeout seconds (forever if None). Returns None on timeout, or if
+        the ring is closed and empty."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._queue or self.closed, timeout):
+                return None
+            if not self._queue:
+                return None
+            self._release()
+            slot = self._held = self._queue.popleft()
+            self.read += 1
+            descriptor = self.descriptors[slot] if self.descriptors is not None else None
+            return Frame(int(self.numbers[slot]), self.buffers[slot], descriptor, self.timestamps[slot])
+
+    def get_latest(self, timeout = None):
+        """Same as :meth:`get`, but skips to the most recent frame"""
+        with self._condition:
+            while len(self._queue) > 1:
+                self._free.append(self._queue.popleft())
+                self.read += 1
+                self.skipped += 1
+        return self.get(timeout)
+
+    def statistics(self):
+        """Returns a dict of counters"""
+        return dict(written = self.written, read = self.read, dropped = self.dropped,
+                    skipped = self.skipped, pending = self.pending)
+
+class FrameGrabber(threading.Thread):
+    """A thread that fills ring by calling grab(buffer, descriptor) until
+    stopped (or count frames are grabbed, if count is given). The ring is
+    closed when the thread stops, and exceptions of grab are stored in
+    :attr:`error`. If mailbox is given, frames are also put to it.
+    """
+    def __init__(self, grab, ring, count = None, mailbox = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.grab = grab
+        self.ring = ring
+        self.count = count
+        #: a :class:`LatestFrame` that receives every grabbed frame, or None
+        self.mailbox = mailbox
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        n = 0
+        try:
+            while not self._stop_event.is_set() and (self.count is None or n < self.count):
+                buffer, descriptor = self.ring.acquire()
+                self.grab(buffer, descriptor)
+                number, timestamp = self.ring.commit()
+                mailbox = self.mailbox
+                if mailbox is not None:
+                    mailbox.put(buffer, number, timestamp)
+                n += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ring.close()
+
+    def stop(self, timeout = None):
+        """Stops the thread and waits for it to finish"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+class LatestFrame(object):
+    """Single-slot mailbox of the most recent frame. One thread puts frames,
+    another one gets them. Three buffers are used, so that the writer never 
+    waits for the reader and never overwrites the frame that the reader got
+    last.
+
+    :param int step:
+        decimation; every step-th pixel in each direction is stored
+    """
+    def __init__(self, step = 1):
+        self.step = step
+        self._lock = threading.Lock()
+        self._buffers = [None, None, None]
+        self._front = None #index of the latest frame
+        self._reading = None #index of the frame that the reader holds
+        self._new = False
+        self._number = 0
+        self._timestamp = 0.
+        #: number of frames put
+        self.received = 0
+        #: number of frames returned by :meth:`get`
+        self.displayed = 0
+        #: number of frames replaced by a newer one before they were read
+        self.dropped = 0
+
+    def put(self, data, number = None, timestamp = None):
+        """Copies (decimated) data to the mailbox, replacing the previous frame"""
+        step = self.step
+        if step > 1:
+            data = data[::step, ::step]
+        with self._lock:
+            index = [i for i in range(3) if i != self._front and i != self._reading][0]
+        buffer = self._buffers[index]
+        if buffer is None or buffer.shape != data.shape or buffer.dtype != data.dtype.newbyteorder('='):
+            buffer = np.empty(data.shape, dtype = data.dtype.newbyteorder('='))
+            self._buffers[index] = buffer
+        buffer[...] = data
+        with self._lock:
+            if self._new:
+                self.dropped += 1
+            self._front = index
+            self._new = True
+            self._number = self.received if number is None else number
+            self._timestamp = time.time() if timestamp is None else timestamp
+            self.received += 1
+
+    def get(self):
+        """Returns the latest :class:`Frame` (with no descriptor) if there is
+        a new one since the last call, else None. Frame data is valid until 
+        the next call."""
+        with self._lock:
+            if not self._new:
+                return None
+            self._new = False
+            self._reading = self._front
+            self.displayed += 1
+            return Frame(self._number, self._buffers[self._front], None, self._timestamp)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,324 @@
+"""
+Synchronized capture from several cameras.
+
+* :class:`PixelinkSource` and :class:`UEyeSource` adapt a
+  :class:`labtools.pixelink.camera.Camera` and a :class:`labtools.ids.ueye.Camera`
+  to a common frame source interface (start, grab, stop)
+* :class:`SyncCapture` runs one acquisition thread per source, stamps frames
+  with a common monotonic clock (:func:`clock`) and matches frames of all
+  sources into :class:`FrameSet` tuples
+
+Frames are matched when their timestamps differ by at most tolerance seconds.
+Each source's frame that is closest to the latest head frame of the others is
+used, frames that can not be matched are dropped and counted:
+
+>>> from labtools.pixelink._test.camera import SimulatedCamera
+>>> cameras = [SimulatedCamera(frame_rate = 100.), SimulatedCamera(frame_rate = 200.)]
+>>> for c in cameras:
+...     c.init()
+...     c.set_camera(roi = [0, 0, 32, 24])
+>>> capture = SyncCapture([PixelinkSource(c) for c in cameras], tolerance = 0.004)
+>>> capture.start()
+>>> sets = [capture.get() for i in range(10)]
+>>> capture.stop()
+>>> [frame.data.shape for frame in sets[-1].frames]
+[(24, 32), (24, 32)]
+>>> all(s.skew <= 0.004 for s in sets)
+True
+>>> stats = capture.statistics()
+>>> stats['matched'] >= 10, stats['sources'][1]['unmatched'] > 0
+(True, True)
+>>> sorted(stats['sources'][0])
+['dropped', 'name', 'overflow', 'received', 'unmatched']
+>>> for c in cameras:
+...     c.close()
+
+The uEye camera is used in the same way, with its sequence capture, see
+:class:`UEyeSource`. With labtools.configure(SIMULATE = True) both cameras
+are simulated.
+"""
+
+import threading, time
+from collections import namedtuple, deque
+
+#: common clock of all sources, in seconds
+clock = time.monotonic
+
+#: a frame of a source, data is a copy owned by the frame
+Stamped = namedtuple('Stamped', ['timestamp', 'number', 'data'])
+
+#: matched frames of all sources (in source order), with mean timestamp and
+#: skew (maximum timestamp difference) in seconds
+FrameSet = namedtuple('FrameSet', ['timestamp', 'frames', 'skew'])
+
+class PixelinkSource(object):
+    """Frame source of a pixelink camera. Frames are streamed (see
+    :meth:`~labtools.pixelink.camera.Camera.start_streaming`) and stamped
+    when grabbed, in the camera's grabber thread.
+
+    :param camera:
+        an initialized :class:`~labtools.pixelink.camera.Camera`
+    :param int n_buffers:
+        size of the camera frame ring
+    """
+    def __init__(self, camera, n_buffers = 8, name = 'pixelink'):
+        self.camera = camera
+        self.n_buffers = n_buffers
+        self.name = name
+
+    def start(self):
+        self.camera.start_streaming(self.n_buffers, clock = clock)
+
+    def grab(self, timeout = 1.):
+        """Returns the next :data:`Stamped` frame"""
+        frame = self.camera.get_frame(timeout)
+        return Stamped(float(frame.timestamp), frame.number, frame.data.copy())
+
+    def stop(self):
+        self.camera.stop_streaming()
+
+class UEyeSource(object):
+    """Frame source of an IDS uEye camera. Frames are captured in a sequence
+    of n_buffers (see :meth:`~labtools.ids.ueye.Camera.start_sequence`) and
+    stamped when the frame event is received.
+
+    :param camera:
+        an initialized :class:`~labtools.ids.ueye.Camera` with allocated image
+    :param int n_buffers:
+        number of sequence buffers
+
+    Frames skipped by the camera (see :meth:`~labtools.ids.ueye.Camera.wait_frame`)
+    show up as gaps in frame numbers. With a simulated camera:
+
+    >>> import labtools
+    >>> labtools.configure(SIMULATE = True)
+    >>> from labtools.ids import ueye
+    >>> camera = ueye.Camera()
+    >>> camera.init()
+    >>> camera.set_parameters()
+    >>> rate = camera.set_framerate(100.)
+    >>> capture = SyncCapture([UEyeSource(camera)])
+    >>> capture.start()
+    >>> frames = capture.get()
+    >>> frames.frames[0].data.shape
+    (480, 640)
+    >>> capture.stop()
+    >>> camera.close()
+    """
+    def __init__(self, camera, n_buffers = 8, name = 'ueye'):
+        self.camera = camera
+        self.n_buffers = n_buffers
+        self.name = name
+        self._number = 0
+
+    def start(self):
+        self._number = 0
+        self.camera.start_sequence(self.n_buffers)
+
+    def grab(self, timeout = 1.):
+        """Returns the next :data:`Stamped` frame"""
+        index = self.camera.wait_frame(timeout)
+        timestamp = clock()
+        self._number += 1 + self.camera.skipped
+        self.camera.skipped = 0
+        data = self.camera.lock_frame(index).copy()
+        self.camera.unlock_frame(index)
+        return Stamped(timestamp, self._number - 1, data)
+
+    def stop(self):
+        self.camera.stop_sequence()
+
+class _SourceThread(threading.Thread):
+    #grabs frames of a source into a bounded queue of the capture
+    def __init__(self, capture, index, source):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.capture = capture
+        self.index = index
+        self.source = source
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                self.capture._put(self.index, self.source.grab())
+        except Exception as e:
+            if not self._stop_event.is_set():
+                self.error = e
+        finally:
+            self.capture._close_source(self.index)
+
+class SyncCapture(object):
+    """Captures frames of several sources concurrently and matches them.
+
+    :param list sources:
+        frame sources, objects with start(), grab() and stop() methods, where
+        grab returns a :data:`Stamped` frame
+    :param float tolerance:
+        maximum timestamp difference of matched frames, in seconds
+    :param int queue_size:
+        maximum number of unmatched frames kept for each source. If a
+        source is faster than matching, its oldest frames are dropped.
+
+    Frame numbers of each source must increase by one for every frame
+    captured by the camera, so that frames dropped upstream are counted.
+    """
+    def __init__(self, sources, tolerance = 0.005, queue_size = 32):
+        if len(sources) < 1:
+            raise ValueError('At least one source is needed')
+        self.sources = list(sources)
+        self.tolerance = tolerance
+        self.queue_size = queue_size
+        self._condition = threading.Condition()
+        self._threads = []
+        self._reset()
+
+    def _reset(self):
+        n = len(self.sources)
+        self._queues = [deque() for i in range(n)]
+        self._closed = [False] * n
+        self.received = [0] * n
+        #: number of frames of each source dropped because they had no match
+        self.unmatched = [0] * n
+        #: number of frames of each source dropped because the queue was full
+        self.overflow = [0] * n
+        #: number of frames of each source dropped before they were received
+        #: (by the camera or its driver), from gaps in frame numbers
+        self.dropped = [0] * n
+        self._last = [-1] * n
+        #: number of matched frame sets
+        self.matched = 0
+        self._skew_sum = 0.
+        self._skew_max = 0.
+        self._t0 = None
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Starts all sources and acquisition threads"""
+        self.stop()
+        self._reset()
+        self._t0 = clock()
+        started = []
+        try:
+            for source in self.sources:
+                source.start()
+                started.append(source)
+        except:
+            for source in started:
+                source.stop()
+            raise
+        self._threads = [_SourceThread(self, i, source) for i, source in enumerate(self.sources)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops acquisition threads and sources. Unmatched frames are
+        discarded."""
+        for thread in self._threads:
+            thread._stop_event.set()
+        #threads finish after their current grab, then sources can be stopped
+        for thread in self._threads:
+            thread.join()
+        for thread in self._threads:
+            thread.source.stop()
+        self._threads = []
+
+    def _put(self, index, frame):
+        with self._condition:
+            queue = self._queues[index]
+            if len(queue) >= self.queue_size:
+                queue.popleft()
+                self.overflow[index] += 1
+            queue.append(frame)
+            self.received[index] += 1
+            self.dropped[index] += max(frame.number - self._last[index] - 1, 0)
+            self._last[index] = frame.number
+            self._condition.notify_all()
+
+    def _close_source(self, index):
+        with self._condition:
+            self._closed[index] = True
+            self._condition.notify_all()
+
+    def _drop(self, index):
+        self._queues[index].popleft()
+        self.unmatched[index] += 1
+
+    def _match(self):
+        #returns a FrameSet, or None if more frames are needed
+        queues = self._queues
+        while all(queues):
+            ref = max(queue[0].timestamp for queue in queues)
+            for i, queue in enumerate(queues):
+                #skip to the frame closest to ref
+                while len(queue) > 1 and abs(queue[1].timestamp - ref) <= abs(queue[0].timestamp - ref):
+                    self._drop(i)
+            for i, queue in enumerate(queues):
+                #a later frame could still be closer, wait for it
+                if len(queue) == 1 and queue[0].timestamp < ref and not self._closed[i]:
+                    return None
+            stamps = [queue[0].timestamp for queue in queues]
+            skew = max(stamps) - min(stamps)
+            if skew <= self.tolerance:
+                frames = [queue.popleft() for queue in queues]
+                self.matched += 1
+                self._skew_sum += skew
+                self._skew_max = max(self._skew_max, skew)
+                return FrameSet(sum(stamps) / len(stamps), frames, skew)
+            self._drop(stamps.index(min(stamps)))
+        return None
+
+    def _check(self):
+        for thread in self._threads:
+            if thread.error is not None:
+                raise thread.error
+
+    def get(self, timeout = 1.):
+        """Returns the next matched :data:`FrameSet`. Raises an error of a
+        source, or RuntimeError if no match is found in timeout seconds or
+        sources are stopped."""
+        end = clock() + timeout
+        with self._condition:
+            while True:
+                frames = self._match()
+                if frames is not None:
+                    return frames
+                self._check()
+                if any(closed and not queue for closed, queue in zip(self._closed, self._queues)):
+                    raise RuntimeError('Capture is stopped')
+                remaining = end - clock()
+                if remaining <= 0:
+                    raise RuntimeError('No matched frames in %s seconds' % timeout)
+                self._condition.wait(remaining)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except RuntimeError:
+                if not self.running:
+                    return
+                raise
+
+    def statistics(self):
+        """Returns a dict of matched frame sets, mean and maximum skew in
+        seconds, matched sets per second and per source dicts of name,
+        received, dropped (upstream), unmatched and overflow frame counts."""
+        t = clock() - self._t0 if self._t0 is not None else 0.
+        sources = [dict(name = getattr(source, 'name', str(i)), received = self.received[i],
+                        dropped = self.dropped[i], unmatched = self.unmatched[i],
+                        overflow = self.overflow[i])
+                   for i, source in enumerate(self.sources)]
+        return dict(matched = self.matched,
+                    skew = self._skew_sum / self.matched if self.matched else 0.,
+                    max_skew = self._skew_max,
+                    rate = self.matched / t if t > 0 else 0.,
+                    sources = sources)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()